@@ -5,6 +5,7 @@ from datetime import datetime
 
 # --- Google/Firebase Imports ---
 from managers.firebase_client import FirebaseClient
+from managers.image_handler import ImageHandler
 
 # --- Import Managers ---
 from managers.auth_manager import AuthManager
@@ -14,10 +15,16 @@ from managers.inventory_manager import InventoryManager
 from managers.customer_manager import CustomerManager
 from managers.pos_manager import POSManager
 from managers.report_manager import ReportManager
+from managers.report_cache import ReportDayCache
+from managers.analytics_store import AnalyticsStore, AnalyticsSyncer
 from managers.settings_manager import SettingsManager
 from managers.promotion_manager import PromotionManager
 from managers.cost_manager import CostManager
 from managers.price_manager import PriceManager
+from managers.catalog_mirror import CatalogMirror
+from managers.app_secrets import get_secret
+from managers.offline_store import OfflineStore, OutboxFlusher
+from managers.firestore_metrics import FirestoreMetrics, instrument_manager
 
 # --- Import UI Pages ---
 from ui.login_page import render_login_page
@@ -103,36 +110,97 @@ def get_corrected_creds(secrets_key):
         creds_dict['private_key'] = creds_dict['private_key'].replace('\\n', '\n')
     return creds_dict
 
-# Initialize all managers and store them in session_state
+# Build the stateless managers once per process and share them across all sessions.
+# Each new browser tab previously constructed its own FirebaseClient, managers and
+# two Google Drive clients; now a session only holds references to these instances.
+@st.cache_resource(show_spinner=False)
+def get_shared_managers():
+    firebase_creds_info = get_corrected_creds("firebase_credentials")
+    pyrebase_config = st.secrets["pyrebase_config"].to_dict()
+    fb_client = FirebaseClient(firebase_creds_info, pyrebase_config)
+    # Count reads/writes/latency per manager method and per page render (see "Quản trị Hệ thống")
+    firestore_metrics = FirestoreMetrics()
+    fb_client.enable_instrumentation(firestore_metrics)
+
+    # One Drive client for the whole process (ProductManager + CostManager)
+    image_handler = ImageHandler.from_secrets()
+
+    branch_mgr = BranchManager(fb_client)
+    settings_mgr = SettingsManager(fb_client)
+    inventory_mgr = InventoryManager(fb_client)
+    customer_mgr = CustomerManager(fb_client)
+    promotion_mgr = PromotionManager(fb_client)
+    cost_mgr = CostManager(fb_client, image_handler=image_handler)
+    price_mgr = PriceManager(fb_client)
+    product_mgr = ProductManager(fb_client, image_handler=image_handler)
+    # P&L of closed days is kept in a local SQLite cache; only today and invalidated days are recomputed
+    report_day_cache = ReportDayCache(get_secret("report_cache_path", "data/report_cache.sqlite3"))
+    # Local Parquet copy of orders for heavy reports (secret analytics_dir), kept in sync by a background thread
+    analytics_store = None
+    if get_secret("analytics_dir"):
+        analytics_store = AnalyticsStore(fb_client.db, get_secret("analytics_dir"))
+    report_mgr = ReportManager(fb_client, cost_mgr, day_cache=report_day_cache, analytics_store=analytics_store)
+    # Branch offline mode (secret offline_mode = true): checkout commits to a local SQLite outbox
+    # and a background thread replays the orders into Firestore
+    offline_store = None
+    if get_secret("offline_mode"):
+        offline_store = OfflineStore(get_secret("offline_db_path", "data/offline_pos.sqlite3"))
+    pos_mgr = POSManager(
+        firebase_client=fb_client, inventory_mgr=inventory_mgr,
+        customer_mgr=customer_mgr, promotion_mgr=promotion_mgr,
+        price_mgr=price_mgr, cost_mgr=cost_mgr, offline_store=offline_store
+    )
+    # Live POS catalog (products + branch_prices + inventory) kept current by snapshot listeners
+    catalog_mirror = CatalogMirror(fb_client)
+
+    shared_managers = {
+        "branch_mgr": branch_mgr,
+        "settings_mgr": settings_mgr,
+        "inventory_mgr": inventory_mgr,
+        "customer_mgr": customer_mgr,
+        "promotion_mgr": promotion_mgr,
+        "cost_mgr": cost_mgr,
+        "price_mgr": price_mgr,
+        "product_mgr": product_mgr,
+        "report_mgr": report_mgr,
+        "pos_mgr": pos_mgr,
+        "catalog_mirror": catalog_mirror,
+    }
+    for manager in shared_managers.values():
+        instrument_manager(manager, firestore_metrics)
+
+    if offline_store is not None:
+        pos_mgr.outbox_flusher = OutboxFlusher(pos_mgr)
+        pos_mgr.outbox_flusher.start()
+    if analytics_store is not None:
+        analytics_store.syncer = AnalyticsSyncer(analytics_store)
+        analytics_store.syncer.start()
+
+    return {
+        "offline_store": offline_store,
+        "firebase_client": fb_client,
+        "firestore_metrics": firestore_metrics,
+        **shared_managers,
+    }
+
+# Attach the shared managers to session_state and create the per-user facades
 def init_managers():
     if 'managers_initialized' in st.session_state:
         return
 
     try:
-        if 'firebase_client' not in st.session_state:
-            firebase_creds_info = get_corrected_creds("firebase_credentials")
-            pyrebase_config = st.secrets["pyrebase_config"].to_dict()
-            st.session_state.firebase_client = FirebaseClient(firebase_creds_info, pyrebase_config)
+        shared_managers = get_shared_managers()
     except Exception as e:
         st.error(f"Lỗi nghiêm trọng khi khởi tạo Firebase: {e}")
         st.stop()
 
-    fb_client = st.session_state.firebase_client
-
-    st.session_state.branch_mgr = BranchManager(fb_client)
-    st.session_state.settings_mgr = SettingsManager(fb_client)
-    st.session_state.inventory_mgr = InventoryManager(fb_client)
-    st.session_state.customer_mgr = CustomerManager(fb_client)
-    st.session_state.promotion_mgr = PromotionManager(fb_client)
-    st.session_state.cost_mgr = CostManager(fb_client)
-    st.session_state.price_mgr = PriceManager(fb_client)
-    st.session_state.product_mgr = ProductManager(fb_client)
-    st.session_state.auth_mgr = AuthManager(fb_client, st.session_state.settings_mgr)
-    st.session_state.report_mgr = ReportManager(fb_client, st.session_state.cost_mgr)
-    st.session_state.pos_mgr = POSManager(
-        firebase_client=fb_client, inventory_mgr=st.session_state.inventory_mgr,
-        customer_mgr=st.session_state.customer_mgr, promotion_mgr=st.session_state.promotion_mgr,
-        price_mgr=st.session_state.price_mgr, cost_mgr=st.session_state.cost_mgr
+    for name, manager in shared_managers.items():
+        st.session_state[name] = manager
+
+    # AuthManager holds the cookie manager and pyrebase auth state of one browser, so it stays per-session
+    st.session_state.auth_mgr = instrument_manager(
+        AuthManager(st.session_state.firebase_client, st.session_state.settings_mgr),
+        st.session_state.firestore_metrics
     )
     
     st.session_state.managers_initialized = True
@@ -211,7 +279,8 @@ def main():
     # Render the selected page
     renderer = page_renderers.get(page)
     if renderer:
-        renderer()
+        with st.session_state.firestore_metrics.scope(f"page:{page}"):
+            renderer()
     else:
         st.warning(f"Trang '{page}' đang được phát triển hoặc không tồn tại.")
 
@@ -0,0 +1,8 @@
+"""
+Benchmark cho các hàm manager chạy trên backend Firestore giả lập (managers/memory_firestore.py).
+
+    python -m benchmarks.run --scale small --output bench.json
+
+Kết quả là JSON gồm độ trễ và số document đọc/ghi cho mỗi lần gọi, để so sánh giữa các lần thay đổi
+và ước lượng giới hạn khi số chi nhánh/đơn hàng tăng.
+"""
@@ -0,0 +1,350 @@
+"""
+Sinh bộ dữ liệu bán lẻ giả lập theo đúng cấu trúc document mà các manager ghi ra:
+chi nhánh, danh mục, sản phẩm, giá theo chi nhánh, tồn kho, khách hàng, đơn hàng,
+chi phí (thường, trả trước có khấu hao, đã phân bổ), phiếu chuyển kho và chương trình giá.
+"""
+import bisect
+import itertools
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from dateutil.relativedelta import relativedelta
+
+from managers.daily_sales import add_order_to_rollup, empty_rollup, rollup_doc_id
+
+# Quy mô dữ liệu. 'orders' là tổng số đơn của mọi chi nhánh trong 'days' ngày gần nhất.
+SCALES = {
+    'tiny': dict(branches=2, categories=5, skus=300, customers=200, orders=2_000, days=60,
+                 cost_entries=200, transfers=100),
+    'small': dict(branches=3, categories=12, skus=5_000, customers=2_000, orders=20_000, days=180,
+                  cost_entries=1_500, transfers=1_000),
+    'medium': dict(branches=5, categories=30, skus=20_000, customers=10_000, orders=200_000, days=365,
+                   cost_entries=6_000, transfers=5_000),
+    'large': dict(branches=10, categories=50, skus=50_000, customers=50_000, orders=500_000, days=365,
+                  cost_entries=15_000, transfers=15_000),
+}
+
+BATCH_SIZE = 500
+
+_CATEGORY_NAMES = [
+    "Áo thun", "Áo sơ mi", "Quần jean", "Quần tây", "Váy", "Đầm", "Áo khoác", "Giày", "Dép", "Túi xách",
+    "Ví", "Thắt lưng", "Mũ", "Kính", "Đồng hồ", "Trang sức", "Đồ lót", "Đồ ngủ", "Đồ thể thao", "Phụ kiện",
+]
+_LAST_NAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ"]
+_MIDDLE_NAMES = ["Văn", "Thị", "Minh", "Ngọc", "Thanh", "Quốc", "Hữu", "Thu", "Gia", "Bảo"]
+_FIRST_NAMES = ["An", "Bình", "Châu", "Dũng", "Giang", "Hà", "Hải", "Hương", "Khoa", "Lan", "Linh", "Long",
+                "Mai", "Nam", "Phong", "Quân", "Sơn", "Tâm", "Trang", "Tuấn", "Vy", "Yến"]
+_COST_GROUPS = [
+    ("rent", "Thuê mặt bằng"), ("salary", "Lương nhân viên"), ("utilities", "Điện nước"),
+    ("marketing", "Marketing"), ("equipment", "Trang thiết bị"), ("other", "Chi phí khác"),
+]
+
+
+class _BatchWriter:
+    """Gom thao tác ghi thành các batch tối đa BATCH_SIZE document."""
+    def __init__(self, db):
+        self.db = db
+        self.batch = db.batch()
+        self.pending = 0
+        self.counts = {}
+
+    def set(self, collection: str, doc_id: str, data: dict):
+        self.batch.set(self.db.collection(collection).document(doc_id), data)
+        self.counts[collection] = self.counts.get(collection, 0) + 1
+        self.pending += 1
+        if self.pending >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.batch.commit()
+            self.batch = self.db.batch()
+            self.pending = 0
+
+
+def _round_thousand(value: float) -> int:
+    return max(1000, int(round(value / 1000)) * 1000)
+
+
+def generate_dataset(db, scale='small', seed: int = 42, end_date: datetime = None) -> dict:
+    """
+    Ghi bộ dữ liệu vào db (client Firestore hoặc memory_firestore.Client).
+
+    Args:
+        scale: tên quy mô trong SCALES hoặc dict cùng các khóa.
+        end_date: ngày cuối cùng có đơn hàng (mặc định: hôm nay).
+
+    Returns:
+        dict mô tả bộ dữ liệu: số document theo collection, danh sách chi nhánh, SKU, khách hàng
+        và khoảng thời gian của đơn hàng — runner dùng để dựng tham số cho từng benchmark.
+    """
+    params = SCALES[scale] if isinstance(scale, str) else dict(scale)
+    rng = random.Random(seed)
+    writer = _BatchWriter(db)
+    end_date = (end_date or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    start_date = end_date - timedelta(days=params['days'] - 1)
+
+    # --- Chi nhánh ---
+    branch_ids = [f"BR-{i + 1:03d}" for i in range(params['branches'])]
+    for i, branch_id in enumerate(branch_ids):
+        writer.set('branches', branch_id, {
+            'id': branch_id, 'name': f"Chi nhánh {i + 1}", 'address': f"{rng.randint(1, 500)} Đường số {i + 1}",
+            'phone': f"028{rng.randint(1000000, 9999999)}", 'active': True,
+            'created_at': (start_date - timedelta(days=400)).isoformat(),
+        })
+
+    # --- Người dùng ---
+    user_ids = ["USR-ADMIN"]
+    writer.set('users', "USR-ADMIN", {
+        'uid': "USR-ADMIN", 'email': "admin@example.com", 'display_name': "Quản trị viên",
+        'role': 'admin', 'branch_ids': [], 'active': True,
+    })
+    for branch_id in branch_ids:
+        for j in range(3):
+            uid = f"USR-{branch_id}-{j + 1}"
+            user_ids.append(uid)
+            writer.set('users', uid, {
+                'uid': uid, 'email': f"{uid.lower()}@example.com", 'display_name': _random_name(rng),
+                'role': 'manager' if j == 0 else 'staff', 'branch_ids': [branch_id], 'active': True,
+            })
+
+    # --- Danh mục, đơn vị, sản phẩm ---
+    category_ids = []
+    skus_per_category = {}
+    for i in range(params['categories']):
+        category_id = f"CAT-{i + 1:03d}"
+        category_ids.append(category_id)
+        skus_per_category[category_id] = 0
+    for unit_id, name in (("UNIT-PCS", "Cái"), ("UNIT-PAIR", "Đôi"), ("UNIT-SET", "Bộ")):
+        writer.set('units', unit_id, {'id': unit_id, 'name': name, 'created_at': start_date})
+
+    products = []
+    for i in range(params['skus']):
+        category_id = category_ids[i % len(category_ids)]
+        skus_per_category[category_id] += 1
+        prefix = f"C{category_ids.index(category_id) + 1:02d}"
+        sku = f"{prefix}-{skus_per_category[category_id]:04d}"
+        cost_price = _round_thousand(rng.uniform(20_000, 500_000))
+        product = {
+            'sku': sku,
+            'name': f"{_CATEGORY_NAMES[i % len(_CATEGORY_NAMES)]} mẫu {i + 1}",
+            'category_id': category_id,
+            'unit_id': rng.choice(["UNIT-PCS", "UNIT-PAIR", "UNIT-SET"]),
+            'barcode': f"893{rng.randint(10 ** 9, 10 ** 10 - 1)}",
+            'cost_price': cost_price,
+            'price_default': _round_thousand(cost_price * rng.uniform(1.3, 2.2)),
+            'active': rng.random() < 0.95,
+            'image_id': "",
+            'created_at': datetime(2023, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=i * 7),
+            'updated_at': datetime(2023, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=i * 7),
+        }
+        products.append(product)
+        writer.set('products', sku, product)
+
+    for i, category_id in enumerate(category_ids):
+        writer.set('categories', category_id, {
+            'id': category_id, 'name': _CATEGORY_NAMES[i % len(_CATEGORY_NAMES)] + (f" {i // 20 + 1}" if i >= 20 else ""),
+            'prefix': f"C{i + 1:02d}", 'current_seq': skus_per_category[category_id], 'active': True,
+            'created_at': start_date,
+        })
+
+    # --- Giá và tồn kho theo chi nhánh ---
+    listed = {}   # branch_id -> [(sku, price, cost_price, name, category_id)]
+    for branch_id in branch_ids:
+        listed[branch_id] = []
+        for product in products:
+            if rng.random() > 0.9:
+                continue
+            sku = product['sku']
+            price = _round_thousand(product['price_default'] * rng.uniform(0.95, 1.05))
+            is_active = rng.random() < 0.97
+            writer.set('branch_prices', f"{branch_id}_{sku}", {
+                'branch_id': branch_id, 'sku': sku, 'price': price, 'is_active': is_active,
+                'updated_at': (end_date - timedelta(days=rng.randint(0, 90))).isoformat(),
+            })
+            writer.set('inventory', f"{sku.upper()}_{branch_id}", {
+                'branch_id': branch_id, 'sku': sku, 'stock_quantity': rng.randint(0, 200),
+                'last_updated': (end_date - timedelta(days=rng.randint(0, 30))).isoformat(),
+            })
+            if is_active and product['active']:
+                listed[branch_id].append((sku, price, product['cost_price'], product['name'], product['category_id']))
+
+    # --- Khách hàng ---
+    customer_ids = []
+    for i in range(params['customers']):
+        customer_id = f"CUS-{i + 1:06d}"
+        customer_ids.append(customer_id)
+        writer.set('customers', customer_id, {
+            'id': customer_id, 'name': _random_name(rng), 'phone': f"09{rng.randint(10 ** 7, 10 ** 8 - 1)}",
+            'total_spent': 0, 'points': 0, 'rank': 'Đồng',
+            'created_at': (start_date - timedelta(days=rng.randint(0, 365))).isoformat(),
+        })
+
+    # --- Đơn hàng (độ phổ biến SKU theo phân phối đuôi dài) ---
+    popularity = {
+        branch_id: list(itertools.accumulate(1 / (rank + 1) ** 0.8 for rank in range(len(items))))
+        for branch_id, items in listed.items()
+    }
+    # Tổng hợp theo ngày như sau khi đã backfill (xem DailySalesRollup)
+    rollups = {}
+    for _ in range(params['orders']):
+        branch_id = rng.choice(branch_ids)
+        items = listed[branch_id]
+        if not items:
+            continue
+        created_at = start_date + timedelta(seconds=rng.randint(0, params['days'] * 86400 - 1))
+        cum_weights = popularity[branch_id]
+        lines = {}
+        for _ in range(rng.choices((1, 2, 3, 4, 5), weights=(35, 30, 18, 10, 7))[0]):
+            index = bisect.bisect_left(cum_weights, rng.random() * cum_weights[-1])
+            sku, price, cost_price, name, _category = items[min(index, len(items) - 1)]
+            line = lines.setdefault(sku, {'sku': sku, 'name': name, 'quantity': 0, 'original_price': price, 'cost_price': cost_price})
+            line['quantity'] += rng.choice((1, 1, 1, 2, 3))
+
+        subtotal = sum(l['original_price'] * l['quantity'] for l in lines.values())
+        manual_discount = subtotal * 0.05 if rng.random() < 0.1 else 0
+        order_items = []
+        for line in lines.values():
+            line_total = line['original_price'] * line['quantity']
+            share = manual_discount * line_total / subtotal if subtotal else 0
+            order_items.append({
+                **line,
+                'line_cogs': line['cost_price'] * line['quantity'],
+                'auto_discount_applied': 0,
+                'manual_discount_applied': share,
+                'final_price': (line_total - share) / line['quantity'],
+            })
+
+        order_id = f"{branch_id}-{created_at.strftime('%y%m%d')}-{uuid.UUID(int=rng.getrandbits(128)).hex[:6].upper()}"
+        order = {
+            'id': order_id,
+            'branch_id': branch_id,
+            'seller_id': rng.choice(user_ids),
+            'customer_id': rng.choice(customer_ids) if customer_ids and rng.random() < 0.4 else None,
+            'items': order_items,
+            'subtotal': subtotal,
+            'total_auto_discount': 0,
+            'total_manual_discount': manual_discount,
+            'grand_total': subtotal - manual_discount,
+            'total_cogs': sum(i['line_cogs'] for i in order_items),
+            'promotion_id': None,
+            'created_at': created_at.isoformat(),
+            'status': 'COMPLETED',
+        }
+        writer.set('orders', order_id, order)
+        day = created_at.date()
+        add_order_to_rollup(rollups.setdefault((branch_id, day), empty_rollup(branch_id, day)), order)
+
+    for (branch_id, day), rollup in rollups.items():
+        writer.set('daily_sales', rollup_doc_id(branch_id, day), rollup)
+    writer.set('settings', 'daily_sales', {'complete_from': start_date.date().isoformat()})
+
+    # --- Chi phí ---
+    for group_id, group_name in _COST_GROUPS:
+        writer.set('cost_groups', group_id, {'id': group_id, 'group_name': group_name, 'group_type': 'OPEX'})
+    writer.set('cost_allocation_rules', 'RULE-EQUAL', {
+        'id': 'RULE-EQUAL', 'name': "Chia đều các chi nhánh", 'description': "",
+        'splits': [{'branch_id': b, 'percentage': 100 / len(branch_ids)} for b in branch_ids],
+    })
+
+    written_entries = 0
+    while written_entries < params['cost_entries']:
+        kind = rng.random()
+        branch_id = rng.choice(branch_ids)
+        group_id, group_name = rng.choice(_COST_GROUPS)
+        entry_date = start_date + timedelta(days=rng.randint(0, params['days'] - 1))
+        base = {
+            'branch_id': branch_id, 'group_id': group_id, 'name': group_name,
+            'amount': _round_thousand(rng.uniform(500_000, 30_000_000)), 'entry_date': entry_date.isoformat(),
+            'created_by': rng.choice(user_ids), 'classification': 'CAPEX' if group_id == 'equipment' else 'OPEX',
+            'receipt_url': None, 'is_amortized': False, 'amortization_months': 0,
+            'created_at': entry_date.isoformat(), 'status': 'ACTIVE', 'source_entry_id': None,
+        }
+        if kind < 0.8:
+            entry_id = _cost_entry_id(rng)
+            writer.set('cost_entries', entry_id, {**base, 'id': entry_id})
+            written_entries += 1
+        elif kind < 0.9:
+            # Chi phí trả trước: 1 bản ghi gốc + các kỳ khấu hao hàng tháng
+            months = rng.choice((3, 6, 12))
+            source_id = _cost_entry_id(rng)
+            writer.set('cost_entries', source_id, {
+                **base, 'id': source_id, 'name': f"[TRẢ TRƯỚC] {group_name}", 'status': 'AMORTIZED_SOURCE',
+                'is_amortized': True, 'amortize_months': months,
+            })
+            for i in range(months):
+                child_id = _cost_entry_id(rng)
+                writer.set('cost_entries', child_id, {
+                    **base, 'id': child_id, 'name': f"{group_name} (Tháng {i + 1}/{months})",
+                    'amount': round(base['amount'] / months, 2),
+                    'entry_date': (entry_date + relativedelta(months=i)).isoformat(),
+                    'source_entry_id': source_id,
+                })
+            written_entries += months + 1
+        else:
+            # Chi phí chung đã phân bổ cho các chi nhánh
+            source_id = _cost_entry_id(rng)
+            writer.set('cost_entries', source_id, {**base, 'id': source_id, 'status': 'ALLOCATED'})
+            for target_branch in branch_ids:
+                child_id = _cost_entry_id(rng)
+                writer.set('cost_entries', child_id, {
+                    **base, 'id': child_id, 'branch_id': target_branch,
+                    'amount': base['amount'] / len(branch_ids), 'source_entry_id': source_id,
+                    'notes': f"Phân bổ từ {source_id} theo quy tắc Chia đều các chi nhánh",
+                })
+            written_entries += len(branch_ids) + 1
+
+    # --- Phiếu chuyển kho ---
+    if len(branch_ids) > 1:
+        for i in range(params['transfers']):
+            from_branch, to_branch = rng.sample(branch_ids, 2)
+            created_at = start_date + timedelta(seconds=rng.randint(0, params['days'] * 86400 - 1))
+            status = rng.choices(('PENDING', 'SHIPPED', 'COMPLETED'), weights=(10, 10, 80))[0]
+            candidates = listed[from_branch] or [(p['sku'],) for p in products[:10]]
+            items = [{'sku': c[0], 'quantity': rng.randint(1, 20)} for c in rng.sample(candidates, min(len(candidates), rng.randint(1, 6)))]
+            transfer_id = f"TRF-{i + 1:010d}"
+            history = [{'status': 'PENDING', 'updated_at': created_at.isoformat(), 'user_id': user_ids[0]}]
+            if status != 'PENDING':
+                history.append({'status': 'SHIPPED', 'updated_at': (created_at + timedelta(hours=2)).isoformat(), 'user_id': user_ids[0]})
+            if status == 'COMPLETED':
+                history.append({'status': 'COMPLETED', 'updated_at': (created_at + timedelta(days=1)).isoformat(), 'user_id': user_ids[0]})
+            writer.set('stock_transfers', transfer_id, {
+                'id': transfer_id, 'from_branch_id': from_branch, 'to_branch_id': to_branch, 'items': items,
+                'created_by': user_ids[0], 'created_at': created_at.isoformat(), 'status': status,
+                'history': history, 'notes': "",
+            })
+
+    # --- Chương trình giá đang chạy ---
+    now = datetime.now(timezone.utc)
+    writer.set('promotions', 'PROMO-BENCH', {
+        'name': "Giảm giá toàn cửa hàng", 'description': "", 'is_active': True,
+        'start_datetime': (now - timedelta(days=7)).isoformat(), 'end_datetime': (now + timedelta(days=30)).isoformat(),
+        'priority': 100, 'stacking_rule': "EXCLUSIVE", 'promotion_type': "PRICE_PROGRAM",
+        'scope': {'type': 'CATEGORY', 'ids': category_ids[::3]},
+        'rules': {'auto_discount': {'type': 'PERCENT', 'value': 10}, 'manual_extra_limit': {'type': 'PERCENT', 'value': 5}},
+        'constraints': {'min_margin_floor_percent': 10, 'per_line_cap_vnd': 500000},
+        'created_at': (now - timedelta(days=8)).isoformat(),
+    })
+
+    writer.flush()
+    return {
+        'scale': params,
+        'seed': seed,
+        'counts': writer.counts,
+        'branch_ids': branch_ids,
+        'category_ids': category_ids,
+        'customer_ids': customer_ids,
+        'user_ids': user_ids,
+        'listed': {branch_id: [item[0] for item in items] for branch_id, items in listed.items()},
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+
+
+def _random_name(rng) -> str:
+    return f"{rng.choice(_LAST_NAMES)} {rng.choice(_MIDDLE_NAMES)} {rng.choice(_FIRST_NAMES)}"
+
+
+def _cost_entry_id(rng) -> str:
+    return f"CE-{uuid.UUID(int=rng.getrandbits(128)).hex[:8].upper()}"
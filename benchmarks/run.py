@@ -0,0 +1,302 @@
+"""
+Chạy benchmark các hàm manager trên backend Firestore giả lập và xuất kết quả dạng JSON.
+
+    python -m benchmarks.run --scale small
+    python -m benchmarks.run --scale medium --latency-ms 20 --cases create_order,pnl_30_days --output bench.json
+
+Mỗi benchmark gồm bước chuẩn bị tham số (không tính) và lời gọi manager (được đo), chạy lặp N lần.
+Số đọc/ghi lấy từ FirestoreMetrics, nên 'reads_per_call' chính là số document Firestore sẽ tính phí
+cho một lần gọi trên dữ liệu thật cùng quy mô.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.dataset import SCALES, generate_dataset
+from managers.firebase_client import FirebaseClient
+from managers.firestore_metrics import FirestoreMetrics, instrument_manager
+from managers.reference_cache import reference_cache
+from managers.inventory_manager import InventoryManager
+from managers.customer_manager import CustomerManager
+from managers.promotion_manager import PromotionManager
+from managers.cost_manager import CostManager
+from managers.price_manager import PriceManager
+from managers.product_manager import ProductManager
+from managers.report_manager import ReportManager, REPORT_SOURCE_ANALYTICS
+from managers.report_cache import ReportDayCache
+from managers.analytics_store import AnalyticsStore
+from managers.pos_manager import POSManager
+from managers.product_search import ProductSearchIndex
+
+BENCH_SCOPE = "bench"
+
+# Sản phẩm có từ dài hơn MAX_PREFIX_LENGTH (tên trong bộ dữ liệu không có), để case tìm kiếm
+# đi qua nhánh lọc theo từ đầy đủ: (từ khóa, sản phẩm phải có trong kết quả)
+_LONG_TERM_PRODUCTS = [
+    ("headphones", {'sku': "BENCH-LONG-1", 'name': "Tai nghe Headphones", 'category_id': None}),
+    ("chuyenbiet", {'sku': "BENCH-LONG-2", 'name': "Giày chuyênbiệt chạy bộ", 'category_id': None}),
+]
+
+
+def build_managers(fb_client, metrics: FirestoreMetrics) -> dict:
+    """Khởi tạo các manager giống get_shared_managers() trong app.py (không có Drive)."""
+    inventory_mgr = InventoryManager(fb_client)
+    customer_mgr = CustomerManager(fb_client)
+    promotion_mgr = PromotionManager(fb_client)
+    cost_mgr = CostManager(fb_client)
+    price_mgr = PriceManager(fb_client)
+    product_mgr = ProductManager(fb_client)
+    report_mgr = ReportManager(fb_client, cost_mgr)
+    # Cùng báo cáo nhưng lưu P&L của các ngày đã đóng vào SQLite tạm và có kho phân tích Parquet tạm (như app.py)
+    cache_dir = tempfile.mkdtemp()
+    cached_report_mgr = ReportManager(
+        fb_client, cost_mgr, day_cache=ReportDayCache(os.path.join(cache_dir, 'report_cache.sqlite3')),
+        analytics_store=AnalyticsStore(fb_client.db, os.path.join(cache_dir, 'analytics')),
+    )
+    pos_mgr = POSManager(fb_client, inventory_mgr, customer_mgr, promotion_mgr, cost_mgr, price_mgr)
+    managers = {
+        'inventory_mgr': inventory_mgr, 'customer_mgr': customer_mgr, 'promotion_mgr': promotion_mgr,
+        'cost_mgr': cost_mgr, 'price_mgr': price_mgr, 'product_mgr': product_mgr,
+        'report_mgr': report_mgr, 'cached_report_mgr': cached_report_mgr, 'pos_mgr': pos_mgr,
+    }
+    for manager in managers.values():
+        instrument_manager(manager, metrics)
+    return managers
+
+
+def _random_cart(fb_db, dataset, rng, branch_id, lines=5):
+    """Giỏ hàng cùng định dạng st.session_state.pos_cart, dựng trực tiếp từ dữ liệu (không đo)."""
+    listed = dataset['listed'][branch_id]
+    cart = {}
+    # create_order kiểm tra tồn kho thật, nên chỉ lấy các SKU còn đủ hàng
+    for sku in rng.sample(listed, len(listed)):
+        if len(cart) >= lines:
+            break
+        inventory = fb_db.collection('inventory').document(f"{sku.upper()}_{branch_id}").get().to_dict() or {}
+        stock = inventory.get('stock_quantity', 0)
+        if stock < 1:
+            continue
+        product = fb_db.collection('products').document(sku).get().to_dict()
+        price = fb_db.collection('branch_prices').document(f"{branch_id}_{sku}").get().to_dict()
+        cart[sku] = {
+            "sku": sku, "name": product['name'], "category_id": product.get('category_id'),
+            "original_price": price['price'], "cost_price": product.get('cost_price', 0),
+            "quantity": rng.randint(1, min(3, stock)), "stock": stock, "image_url": None,
+        }
+    return cart
+
+
+def define_cases(m: dict, raw_db, dataset: dict, rng) -> dict:
+    """
+    Danh sách benchmark: tên -> (số lần lặp, hàm chuẩn bị tham số, hàm được đo).
+    raw_db là client chưa gắn metrics, dùng cho bước chuẩn bị.
+    """
+    branch_ids = dataset['branch_ids']
+    end = dataset['end_date'] + timedelta(days=1) - timedelta(microseconds=1)
+    promo = raw_db.collection('promotions').document('PROMO-BENCH').get().to_dict()
+
+    def cart_args(_):
+        branch_id = rng.choice(branch_ids)
+        return branch_id, _random_cart(raw_db, dataset, rng, branch_id)
+
+    def search_args(i):
+        query, expected = _LONG_TERM_PRODUCTS[i % len(_LONG_TERM_PRODUCTS)]
+        return search_index, query, expected['sku']
+
+    search_index = ProductSearchIndex()
+    search_index.sync(
+        [doc.to_dict() for doc in raw_db.collection('products').stream()]
+        + [product for _, product in _LONG_TERM_PRODUCTS]
+    )
+
+    def order_args(_):
+        branch_id, cart = cart_args(_)
+        customer_id = rng.choice(dataset['customer_ids']) if dataset['customer_ids'] and rng.random() < 0.4 else "-"
+        cart_state = m['pos_mgr'].calculate_cart_state(cart, customer_id, {"type": "PERCENT", "value": 0})
+        return cart_state, customer_id, branch_id
+
+    return {
+        'calculate_cart_state': (
+            50, cart_args,
+            lambda a: m['pos_mgr'].calculate_cart_state(a[1], "-", {"type": "PERCENT", "value": 0}),
+        ),
+        'create_order': (
+            50, order_args,
+            lambda a: _expect_success(m['pos_mgr'].create_order(a[0], a[1], a[2], dataset['user_ids'][0])),
+        ),
+        'get_inventory_by_branch': (
+            5, lambda i: branch_ids[i % len(branch_ids)],
+            lambda branch_id: m['inventory_mgr'].get_inventory_by_branch(branch_id),
+        ),
+        'get_transfers_branch_all': (
+            10, lambda i: branch_ids[i % len(branch_ids)],
+            lambda branch_id: m['inventory_mgr'].get_transfers(branch_id=branch_id, direction='all'),
+        ),
+        'get_transfers_admin': (
+            10, lambda i: None,
+            lambda _: m['inventory_mgr'].get_transfers(),
+        ),
+        'query_cost_entries': (
+            5, lambda i: {
+                'branch_id': branch_ids[i % len(branch_ids)],
+                'start_date': (end - timedelta(days=30)).isoformat(), 'end_date': end.isoformat(),
+            },
+            lambda filters: m['cost_mgr'].query_cost_entries(filters=filters),
+        ),
+        'pnl_30_days': (
+            3, lambda i: (end - timedelta(days=30), end, branch_ids[i % len(branch_ids)]),
+            lambda a: m['report_mgr'].get_profit_loss_statement(*a),
+        ),
+        'pnl_full_range_all_branches': (
+            2, lambda i: (dataset['start_date'], end, None),
+            lambda a: m['report_mgr'].get_profit_loss_statement(*a),
+        ),
+        # Lần đầu tính cả 90 ngày, các lần sau chỉ tính lại hôm nay
+        'pnl_90_days_cached': (
+            4, lambda i: (dataset['end_date'] - timedelta(days=89), end, branch_ids[0]),
+            lambda a: m['cached_report_mgr'].get_profit_loss_statement(*a),
+        ),
+        'revenue_report_quarter': (
+            2, lambda i: (end - timedelta(days=90) + timedelta(microseconds=1), end, branch_ids),
+            lambda a: _expect_success(m['report_mgr'].get_revenue_report(*a)[::2]),
+        ),
+        # Đồng bộ kho phân tích ở bước chuẩn bị (không đo); lời gọi được đo không đọc Firestore
+        'revenue_report_quarter_analytics': (
+            2, lambda i: (
+                m['cached_report_mgr'].analytics_store.sync(),
+                (end - timedelta(days=90) + timedelta(microseconds=1), end, branch_ids, REPORT_SOURCE_ANALYTICS),
+            )[1],
+            lambda a: _expect_success(m['cached_report_mgr'].get_revenue_report(*a)[::2]),
+        ),
+        # Từ khóa dài hơn MAX_PREFIX_LENGTH ký tự: lỗi nếu sản phẩm chứa từ đó không có trong kết quả
+        'search_long_terms': (
+            len(_LONG_TERM_PRODUCTS), search_args,
+            lambda a: _expect_found(a[0].search_skus(a[1]), a[2], a[1]),
+        ),
+        'simulate_price_program_impact': (
+            3, lambda i: promo,
+            lambda p: m['promotion_mgr'].simulate_price_program_impact(p, m['product_mgr']),
+        ),
+    }
+
+
+def _expect_success(result):
+    success, message = result
+    if not success:
+        raise RuntimeError(message)
+    return result
+
+
+def _expect_found(skus: list, sku: str, query: str):
+    if sku not in skus:
+        raise RuntimeError(f"'{query}' không tìm thấy {sku}")
+    return skus
+
+
+def run_case(metrics: FirestoreMetrics, iterations: int, prepare, call) -> dict:
+    metrics.reset()
+    errors = []
+    for i in range(iterations):
+        args = prepare(i)
+        try:
+            with metrics.scope(BENCH_SCOPE):
+                call(args)
+        except Exception as e:
+            errors.append(str(e))
+
+    rows = metrics.snapshot()
+    total = next(r for r in rows if r['scope'] == BENCH_SCOPE)
+    return {
+        "iterations": iterations,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "reads_per_call": total['reads_per_call'],
+        "writes_per_call": total['writes_per_call'],
+        "streamed_docs_per_call": round(total['streamed_docs'] / iterations, 2),
+        "transactions": total['transactions'],
+        "avg_ms": total['avg_ms'],
+        "p50_ms": total['p50_ms'],
+        "p95_ms": total['p95_ms'],
+        "p99_ms": total['p99_ms'],
+        # Chi tiết theo hàm manager được gọi bên trong (lồng nhau)
+        "breakdown": [
+            {k: r[k] for k in ('scope', 'calls', 'reads', 'writes', 'reads_per_call', 'avg_ms')}
+            for r in rows if r['scope'] not in (BENCH_SCOPE, "listener")
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark các hàm manager trên Firestore giả lập.")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-ms', type=float, default=0, help="Độ trễ giả lập mỗi round-trip Firestore.")
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--abort-rate', type=float, default=0.0)
+    parser.add_argument('--cases', help="Danh sách benchmark cách nhau bởi dấu phẩy (mặc định: tất cả).")
+    parser.add_argument('--iterations', type=float, default=1.0, help="Hệ số nhân số lần lặp của mỗi benchmark.")
+    parser.add_argument('--output', help="Ghi JSON ra file thay vì stdout.")
+    args = parser.parse_args(argv)
+
+    fb_client = FirebaseClient.in_memory(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, abort_rate=args.abort_rate, seed=args.seed,
+    )
+    raw_db = fb_client.db
+
+    # Sinh dữ liệu không tính độ trễ giả lập
+    latency, jitter = raw_db.latency_ms, raw_db.jitter_ms
+    raw_db.latency_ms = raw_db.jitter_ms = 0
+    setup_started = time.perf_counter()
+    dataset = generate_dataset(raw_db, args.scale, seed=args.seed)
+    setup_seconds = time.perf_counter() - setup_started
+    raw_db.latency_ms, raw_db.jitter_ms = latency, jitter
+
+    metrics = FirestoreMetrics()
+    fb_client.enable_instrumentation(metrics)
+    reference_cache.clear()
+    managers = build_managers(fb_client, metrics)
+
+    rng = random.Random(args.seed)
+    cases = define_cases(managers, raw_db, dataset, rng)
+    selected = [c.strip() for c in args.cases.split(',')] if args.cases else list(cases)
+    unknown = [c for c in selected if c not in cases]
+    if unknown:
+        parser.error(f"Unknown cases: {', '.join(unknown)}. Available: {', '.join(cases)}")
+
+    results = {}
+    for name in selected:
+        iterations, prepare, call = cases[name]
+        iterations = max(1, int(iterations * args.iterations))
+        print(f"[bench] {name} x{iterations}...", file=sys.stderr)
+        results[name] = run_case(metrics, iterations, prepare, call)
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "backend": {
+            "type": "memory", "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms,
+            "abort_rate": args.abort_rate,
+        },
+        "dataset": {
+            "scale": args.scale, "seed": args.seed, "params": dataset['scale'], "counts": dataset['counts'],
+            "start_date": dataset['start_date'].isoformat(), "end_date": dataset['end_date'].isoformat(),
+            "setup_seconds": round(setup_seconds, 2),
+        },
+        "cases": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
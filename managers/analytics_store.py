@@ -0,0 +1,329 @@
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+from urllib.parse import quote, unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from managers.report_cache import ANALYTICS_SYNC_OVERLAP_SECONDS, ReportInvalidations
+
+# Số đơn đọc mỗi trang khi đồng bộ; watermark được lưu sau mỗi trang nên backfill dở dang chạy tiếp được
+ANALYTICS_SYNC_BATCH = 2000
+ANALYTICS_SYNC_INTERVAL_SECONDS = 300
+
+ORDER_SCHEMA = pa.schema([
+    ('order_id', pa.string()),
+    ('created_at', pa.timestamp('us')),
+    ('day', pa.string()),
+    ('status', pa.string()),
+    ('customer_id', pa.string()),
+    ('seller_id', pa.string()),
+    ('promotion_id', pa.string()),
+    ('subtotal', pa.float64()),
+    ('total_auto_discount', pa.float64()),
+    ('total_manual_discount', pa.float64()),
+    ('grand_total', pa.float64()),
+    ('total_cogs', pa.float64()),
+])
+ITEM_SCHEMA = pa.schema([
+    ('order_id', pa.string()),
+    ('created_at', pa.timestamp('us')),
+    ('day', pa.string()),
+    ('status', pa.string()),
+    ('sku', pa.string()),
+    ('name', pa.string()),
+    ('quantity', pa.float64()),
+    ('original_price', pa.float64()),
+    ('cost_price', pa.float64()),
+    ('line_cogs', pa.float64()),
+    ('auto_discount_applied', pa.float64()),
+    ('manual_discount_applied', pa.float64()),
+    ('final_price', pa.float64()),
+    ('revenue', pa.float64()),
+])
+# Thư mục phân vùng kiểu Hive: {table}/branch_id=.../month=YYYY-MM/data.parquet
+_PARTITIONING = ds.partitioning(pa.schema([('branch_id', pa.string()), ('month', pa.string())]), flavor='hive')
+_TABLES = {'orders': ORDER_SCHEMA, 'order_items': ITEM_SCHEMA}
+
+
+class AnalyticsStore:
+    """
+    Bản sao cột (Parquet) của 'orders' trên đĩa cục bộ cho báo cáo và phân tích, không đọc Firestore.
+
+    - orders: một dòng mỗi đơn; order_items: một dòng mỗi dòng hàng (revenue = final_price * quantity).
+    - Phân vùng theo chi nhánh và tháng của created_at, nên truy vấn theo kỳ/chi nhánh chỉ mở các file liên quan.
+    - sync() đọc các đơn mới theo watermark (created_at, mã đơn), bắt đầu từ ANALYTICS_SYNC_OVERLAP_SECONDS
+      trước watermark để nhận cả đơn ghi muộn vài phút so với created_at, rồi đọc lại trọn ngày nào có thế hệ
+      đổi trong ReportInvalidations (đơn offline đồng bộ muộn...). Mỗi phân vùng chạm tới được ghi lại
+      nguyên file (tạm rồi os.replace), loại trùng theo order_id.
+    """
+    def __init__(self, db, root_dir: str):
+        self.db = db
+        self.orders_col = db.collection('orders')
+        self.invalidations = ReportInvalidations(db)
+        self.root_dir = root_dir
+        self._state_path = os.path.join(root_dir, '_state.json')
+        self._sync_lock = threading.Lock()
+        self.syncer = None  # AnalyticsSyncer chạy nền (app.py), nếu có
+        os.makedirs(root_dir, exist_ok=True)
+
+    # --------------------------------------------------------------------------
+    # ĐỒNG BỘ
+    # --------------------------------------------------------------------------
+
+    def sync(self, batch_size: int = ANALYTICS_SYNC_BATCH) -> tuple:
+        """Đồng bộ từ Firestore. Trả về (số đơn mới, số ngày đã đọc lại)."""
+        with self._sync_lock:
+            state = self._load_state()
+            if not state.get('first_day'):
+                first = list(self.orders_col.order_by('created_at').limit(1).select(['created_at']).stream())
+                if not first:
+                    return 0, 0
+                state['first_day'] = first[0].to_dict()['created_at'][:10]
+
+            # Đọc thế hệ trước khi đọc đơn: ngày bị sửa trong lúc đồng bộ sẽ được đọc lại ở lần sau
+            generations = self.invalidations.get_generations(date.fromisoformat(state['first_day']), datetime.now().date())
+            known = state.get('generations', {})
+            watermark = state.get('watermark')
+            changed_days = sorted(
+                day for day, generation in generations.items()
+                if generation != known.get(day, 0) and watermark and day <= watermark['created_at'][:10]
+            )
+
+            # Quét lại từ trước watermark một khoảng: đơn đã có được ghi đè theo order_id
+            previous = (watermark['created_at'], watermark['order_id']) if watermark else None
+            scan_from = None
+            if watermark:
+                scan_from = (datetime.fromisoformat(watermark['created_at'])
+                             - timedelta(seconds=ANALYTICS_SYNC_OVERLAP_SECONDS)).isoformat()
+            new_orders = 0
+            cursor = None
+            while True:
+                query = self.orders_col.order_by('created_at').order_by('__name__')
+                if scan_from:
+                    query = query.where('created_at', '>=', scan_from)
+                if cursor:
+                    query = query.start_after(cursor)
+                docs = list(query.limit(batch_size).stream())
+                if not docs:
+                    break
+                orders = [{**doc.to_dict(), 'id': doc.id} for doc in docs]
+                self._write_orders(orders)
+                new_orders += sum(1 for order in orders if previous is None or (order['created_at'], order['id']) > previous)
+                last = orders[-1]
+                cursor = {'created_at': last['created_at'], '__name__': self.orders_col.document(last['id'])}
+                if watermark is None or (last['created_at'], last['id']) > (watermark['created_at'], watermark['order_id']):
+                    watermark = {'created_at': last['created_at'], 'order_id': last['id']}
+                    state['watermark'] = watermark
+                    self._save_state(state)
+                if len(docs) < batch_size:
+                    break
+
+            for day in changed_days:
+                query = self.orders_col.where('created_at', '>=', f"{day}T00:00:00")\
+                                       .where('created_at', '<=', f"{day}T23:59:59.999999")
+                self._write_orders([{**doc.to_dict(), 'id': doc.id} for doc in query.stream()], replace_day=day)
+
+            state['generations'] = generations
+            state['synced_at'] = datetime.now().isoformat()
+            self._save_state(state)
+            if new_orders or changed_days:
+                logging.info(f"Analytics store synced {new_orders} new orders, {len(changed_days)} changed days")
+            return new_orders, len(changed_days)
+
+    def get_status(self) -> dict:
+        """{'synced_at', 'watermark', 'first_day'} của lần đồng bộ gần nhất (rỗng nếu chưa đồng bộ)."""
+        state = self._load_state()
+        return {key: state.get(key) for key in ('synced_at', 'watermark', 'first_day')}
+
+    def _write_orders(self, orders: list, replace_day: str = None):
+        """
+        Gộp các đơn vào phân vùng của chúng. replace_day: các dòng cũ của ngày này (ở mọi chi nhánh)
+        được thay bằng orders, kể cả khi ngày đó không còn đơn nào.
+        """
+        order_rows, item_rows = {}, {}
+        for order in orders:
+            if not order.get('created_at') or not order.get('branch_id'):
+                continue
+            key = (order['branch_id'], order['created_at'][:7])
+            order_row, items = _flatten_order(order)
+            order_rows.setdefault(key, []).append(order_row)
+            item_rows.setdefault(key, []).extend(items)
+
+        partitions = set(order_rows)
+        if replace_day:
+            month = replace_day[:7]
+            partitions.update((branch_id, month) for branch_id in self._branches_with_month('orders', month))
+        for branch_id, month in partitions:
+            ids = [row['order_id'] for row in order_rows.get((branch_id, month), [])]
+            for table, rows in (('orders', order_rows), ('order_items', item_rows)):
+                new_rows = pa.Table.from_pylist(rows.get((branch_id, month), []), schema=_TABLES[table])
+                self._merge_partition(table, branch_id, month, new_rows, ids, replace_day)
+
+    def _merge_partition(self, table: str, branch_id: str, month: str, new_rows: pa.Table, order_ids: list, replace_day: str):
+        path = self._partition_file(table, branch_id, month)
+        if os.path.exists(path):
+            existing = pq.read_table(path, schema=_TABLES[table])
+            keep = pc.invert(pc.is_in(existing['order_id'], value_set=pa.array(order_ids, pa.string())))
+            if replace_day:
+                keep = pc.and_(keep, pc.not_equal(existing['day'], replace_day))
+            merged = pa.concat_tables([existing.filter(keep), new_rows])
+        else:
+            merged = new_rows
+        if merged.num_rows == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        merged = merged.sort_by('created_at')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        pq.write_table(merged, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _partition_file(self, table: str, branch_id: str, month: str) -> str:
+        return os.path.join(self.root_dir, table, f"branch_id={quote(branch_id, safe='')}", f"month={month}", 'data.parquet')
+
+    def _branches_with_month(self, table: str, month: str) -> list:
+        table_dir = os.path.join(self.root_dir, table)
+        if not os.path.isdir(table_dir):
+            return []
+        branches = []
+        for name in os.listdir(table_dir):
+            if name.startswith('branch_id=') and os.path.exists(os.path.join(table_dir, name, f"month={month}", 'data.parquet')):
+                branches.append(unquote(name[len('branch_id='):]))
+        return branches
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self._state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save_state(self, state: dict):
+        tmp_path = f"{self._state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self._state_path)
+
+    # --------------------------------------------------------------------------
+    # TRUY VẤN
+    # --------------------------------------------------------------------------
+
+    def load_orders(self, start_date: datetime = None, end_date: datetime = None, branch_ids: list = None,
+                    columns: list = None, status: str = 'COMPLETED') -> pd.DataFrame:
+        """Các đơn trong kỳ (mặc định: chỉ COMPLETED) dưới dạng DataFrame, có thêm cột branch_id."""
+        return self._scan('orders', start_date, end_date, branch_ids, columns, status)
+
+    def load_items(self, start_date: datetime = None, end_date: datetime = None, branch_ids: list = None,
+                   columns: list = None, status: str = 'COMPLETED') -> pd.DataFrame:
+        """Các dòng hàng của đơn trong kỳ (cùng điều kiện với load_orders), có thêm cột branch_id."""
+        return self._scan('order_items', start_date, end_date, branch_ids, columns, status)
+
+    def _scan(self, table: str, start_date, end_date, branch_ids, columns, status) -> pd.DataFrame:
+        schema = _TABLES[table]
+        columns = list(columns) if columns else [*schema.names, 'branch_id']
+        table_dir = os.path.join(self.root_dir, table)
+        if not os.path.isdir(table_dir):
+            return _empty_frame(schema, columns)
+
+        # Điều kiện trên branch_id/month chỉ đọc tên thư mục, các phân vùng không khớp không được mở
+        condition = ds.scalar(True)
+        if branch_ids is not None:
+            condition &= ds.field('branch_id').isin(list(branch_ids))
+        if start_date is not None:
+            condition &= (ds.field('month') >= start_date.strftime('%Y-%m')) & (ds.field('created_at') >= pa.scalar(start_date, pa.timestamp('us')))
+        if end_date is not None:
+            condition &= (ds.field('month') <= end_date.strftime('%Y-%m')) & (ds.field('created_at') <= pa.scalar(end_date, pa.timestamp('us')))
+        if status is not None:
+            condition &= ds.field('status') == status
+
+        dataset = ds.dataset(table_dir, format='parquet', schema=_dataset_schema(schema), partitioning=_PARTITIONING)
+        return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+class AnalyticsSyncer:
+    """Luồng nền gọi AnalyticsStore.sync() theo chu kỳ."""
+    def __init__(self, store: AnalyticsStore, interval: float = ANALYTICS_SYNC_INTERVAL_SECONDS):
+        self.store = store
+        self.interval = interval
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="analytics-syncer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        """Đồng bộ ngay thay vì chờ hết chu kỳ."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.store.sync()
+            except Exception as e:
+                logging.error(f"Analytics store sync failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+def _flatten_order(order: dict) -> tuple:
+    """(dòng orders, [dòng order_items]) của một đơn hàng."""
+    created_at = datetime.fromisoformat(order['created_at']).replace(tzinfo=None)
+    common = {
+        'order_id': order['id'], 'created_at': created_at, 'day': order['created_at'][:10],
+        'status': order.get('status'),
+    }
+    order_row = {
+        **common,
+        'customer_id': order.get('customer_id'),
+        'seller_id': order.get('seller_id'),
+        'promotion_id': order.get('promotion_id'),
+        'subtotal': order.get('subtotal', 0),
+        'total_auto_discount': order.get('total_auto_discount', 0),
+        'total_manual_discount': order.get('total_manual_discount', 0),
+        'grand_total': order.get('grand_total', 0),
+        'total_cogs': order.get('total_cogs', 0),
+    }
+    items = []
+    for item in order.get('items', []):
+        quantity = item.get('quantity', 0)
+        items.append({
+            **common,
+            'sku': item['sku'],
+            'name': item.get('name', item['sku']),
+            'quantity': quantity,
+            'original_price': item.get('original_price', 0),
+            'cost_price': item.get('cost_price', 0),
+            'line_cogs': item.get('line_cogs', 0),
+            'auto_discount_applied': item.get('auto_discount_applied', 0),
+            'manual_discount_applied': item.get('manual_discount_applied', 0),
+            'final_price': item.get('final_price', 0),
+            'revenue': item.get('final_price', 0) * quantity,
+        })
+    return order_row, items
+
+
+def _dataset_schema(schema: pa.Schema) -> pa.Schema:
+    return pa.schema([*schema, pa.field('branch_id', pa.string()), pa.field('month', pa.string())])
+
+
+def _empty_frame(schema: pa.Schema, columns: list) -> pd.DataFrame:
+    return _dataset_schema(schema).empty_table().select(columns).to_pandas()
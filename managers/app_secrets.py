@@ -0,0 +1,12 @@
+import streamlit as st
+
+
+def get_secret(key: str, default=None):
+    """
+    Đọc một mục trong st.secrets, trả về default nếu không có.
+    Không báo lỗi khi chạy ngoài Streamlit hoặc chưa có secrets.toml (benchmark, script bảo trì).
+    """
+    try:
+        return st.secrets.get(key, default)
+    except FileNotFoundError:
+        return default
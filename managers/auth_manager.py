@@ -9,6 +9,8 @@ import pyrebase
 from streamlit_cookies_manager import EncryptedCookieManager
 import requests
 
+from managers.pagination import ASCENDING, DEFAULT_PAGE_SIZE, Page, paginate
+
 # Role hierarchy definition (lowest to highest)
 ROLES = ['staff', 'supervisor', 'manager', 'admin']
 ALLOWED_TO_CREATE = {
@@ -21,7 +23,8 @@ ALLOWED_TO_CREATE = {
 class AuthManager:
     def __init__(self, firebase_client, settings_mgr):
         self.db = firebase_client.db
-        self.auth = firebase_client.auth
+        # AuthManager là facade theo từng phiên, nên dùng Auth riêng thay vì Auth dùng chung của client
+        self.auth = firebase_client.new_auth_session()
         self.users_col = self.db.collection('users')
         self.sessions_col = self.db.collection('user_device_sessions')
         self.settings_mgr = settings_mgr
@@ -212,13 +215,21 @@ class AuthManager:
 
     def list_users(self):
         docs = self.users_col.order_by("display_name").stream()
-        users = []
-        for doc in docs:
-            user = doc.to_dict()
-            user.pop('password_hash', None)
-            user['uid'] = doc.id
-            users.append(user)
-        return users
+        return [self._public_user(doc) for doc in docs]
+
+    def list_users_page(self, page_size: int = DEFAULT_PAGE_SIZE, cursor: str = None) -> Page:
+        """Danh sách người dùng theo trang, sắp xếp theo tên hiển thị."""
+        return paginate(
+            self.users_col, self.users_col, [("display_name", ASCENDING)], page_size, cursor,
+            transform=self._public_user,
+        )
+
+    @staticmethod
+    def _public_user(doc) -> dict:
+        user = doc.to_dict()
+        user.pop('password_hash', None)
+        user['uid'] = doc.id
+        return user
 
     def create_user_record(self, data: dict, password: str):
         actor = self.get_current_user_info()
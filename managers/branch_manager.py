@@ -1,6 +1,8 @@
 import uuid
 from datetime import datetime
 
+from managers.reference_cache import reference_cache
+
 class BranchManager:
     def __init__(self, firebase_client):
         self.db = firebase_client.db
@@ -16,10 +18,14 @@ class BranchManager:
         new_data['created_at'] = datetime.now().isoformat()
         
         self.collection.document(branch_id).set(new_data)
+        reference_cache.invalidate('branches')
         return new_data
 
     def list_branches(self, active_only: bool = True):
-        """Lấy danh sách chi nhánh, có thể chỉ lấy các chi nhánh đang hoạt động."""
+        """Lấy danh sách chi nhánh, có thể chỉ lấy các chi nhánh đang hoạt động (có cache theo TTL)."""
+        return reference_cache.get_or_load(('branches', active_only), lambda: self._load_branches(active_only))
+
+    def _load_branches(self, active_only: bool):
         query = self.collection
         if active_only:
             query = query.where('active', '==', True)
@@ -40,4 +46,5 @@ class BranchManager:
         """Cập nhật thông tin cho một chi nhánh."""
         updates['updated_at'] = datetime.now().isoformat()
         self.collection.document(branch_id).update(updates)
+        reference_cache.invalidate('branches')
         return self.get_branch(branch_id) # Trả về dữ liệu đã cập nhật
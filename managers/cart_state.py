@@ -0,0 +1,93 @@
+class CartState:
+    """
+    Trạng thái tính tiền của giỏ hàng POS, giữ trong session_state và cập nhật từng dòng.
+
+    items là dict giỏ hàng gốc (st.session_state.pos_cart, sku -> dòng hàng); CartState giữ
+    các dòng đã tính (thành tiền, giảm giá tự động) cùng các tổng cộng dồn. Khi một dòng
+    thêm/sửa/xóa, refresh_line() trừ phần đóng góp cũ và cộng phần mới, nên chi phí là O(số dòng thay đổi).
+    Chỉ khi chương trình giá đổi thì toàn bộ giỏ mới được tính lại.
+    """
+    def __init__(self, promotion_mgr, items: dict, active_promo=None):
+        self.promotion_mgr = promotion_mgr
+        self.items = items
+        self.active_promo = active_promo
+        self.lines = {}
+        self.subtotal = 0
+        self.total_auto_discount = 0
+        self.total_items = 0
+        for sku in items:
+            self.refresh_line(sku)
+
+    def refresh_line(self, sku: str):
+        """Tính lại một dòng sau khi nó được thêm, đổi số lượng hoặc xóa khỏi items."""
+        old_line = self.lines.get(sku)
+        if old_line is not None:
+            self.subtotal -= old_line['original_line_total']
+            self.total_auto_discount -= old_line['auto_discount_applied']
+            self.total_items -= old_line['quantity']
+
+        item = self.items.get(sku)
+        if item is None:
+            self.lines.pop(sku, None)
+            return
+        # Gán đè giữ nguyên vị trí của dòng trong giỏ
+        line = self._price_line(item)
+        self.lines[sku] = line
+        self.subtotal += line['original_line_total']
+        self.total_auto_discount += line['auto_discount_applied']
+        self.total_items += line['quantity']
+
+    def set_promotion(self, active_promo):
+        """Đổi chương trình giá đang áp dụng; tính lại toàn bộ giỏ chỉ khi chương trình thực sự thay đổi."""
+        if active_promo == self.active_promo:
+            return
+        self.active_promo = active_promo
+        self.lines = {}
+        self.subtotal = 0
+        self.total_auto_discount = 0
+        self.total_items = 0
+        for sku in self.items:
+            self.refresh_line(sku)
+
+    def summary(self, manual_discount_input: dict) -> dict:
+        """Kết quả cùng định dạng với POSManager.calculate_cart_state (giảm giá thủ công tính O(1))."""
+        active_promo = self.active_promo
+        total_manual_discount = 0
+        limit_value = 0
+        manual_discount_exceeded = False
+        if active_promo and self.promotion_mgr.is_manual_discount_allowed(active_promo):
+            limit_rule = active_promo.get('rules', {}).get('manual_extra_limit', {})
+            limit_value = limit_rule.get('value', 0)
+            user_discount_value = manual_discount_input.get('value', 0)
+
+            if user_discount_value > limit_value:
+                manual_discount_exceeded = True
+            else:
+                total_manual_discount = (self.subtotal - self.total_auto_discount) * (user_discount_value / 100)
+
+        return {
+            "items": dict(self.lines),
+            "total_items": self.total_items,
+            "active_promotion": active_promo,
+            "subtotal": self.subtotal,
+            "total_auto_discount": self.total_auto_discount,
+            "total_manual_discount": total_manual_discount,
+            "manual_discount_input": manual_discount_input,
+            "manual_discount_limit": limit_value,
+            "manual_discount_exceeded": manual_discount_exceeded,
+            "grand_total": self.subtotal - self.total_auto_discount - total_manual_discount
+        }
+
+    def _price_line(self, item: dict) -> dict:
+        original_line_total = item['original_price'] * item['quantity']
+        auto_discount_value = 0
+        if self.promotion_mgr.is_item_eligible_for_program(item, self.active_promo):
+            auto_discount_rule = self.active_promo.get('rules', {}).get('auto_discount', {})
+            if auto_discount_rule.get('type') == 'PERCENT':
+                auto_discount_value = original_line_total * (auto_discount_rule.get('value', 0) / 100)
+        return {
+            **item,
+            'original_line_total': original_line_total,
+            'auto_discount_applied': auto_discount_value,
+            'line_total_after_auto_discount': original_line_total - auto_discount_value
+        }
@@ -0,0 +1,340 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from managers.inventory_manager import STOCK_SHARDS_COLLECTION
+from managers.product_search import ProductSearchIndex
+
+# Thời gian tối đa chờ snapshot đầu tiên của listener trước khi tự đọc trực tiếp
+READY_TIMEOUT_SECONDS = 10
+# Khi không mở được listener, dữ liệu được đọc lại theo chu kỳ này
+POLL_INTERVAL_SECONDS = 30
+# Sau khi không nhận được snapshot lẫn không đọc trực tiếp được (mất kết nối), các lần gọi tiếp theo
+# trả ngay dữ liệu đang có (hoặc báo lỗi nếu chưa có gì) thay vì chờ lại, cho tới hết khoảng này
+LOAD_RETRY_SECONDS = 60
+# Số kết quả tìm kiếm gần nhất được giữ lại (theo chi nhánh + bộ lọc), để các lần rerun
+# chỉ chuyển trang không phải lọc lại toàn bộ catalog
+SEARCH_CACHE_SIZE = 64
+
+
+class CatalogMirror:
+    """
+    Bản sao trong bộ nhớ của catalog bán hàng (products + branch_prices + inventory),
+    dùng chung cho cả process và được cập nhật bằng listener on_snapshot của Firestore.
+
+    Trang POS đọc dict cục bộ thay vì stream toàn bộ collection ở mỗi lần rerun;
+    thay đổi tồn kho từ quầy khác được đẩy về qua listener trong khoảng một giây.
+    """
+    def __init__(self, firebase_client, ready_timeout: float = READY_TIMEOUT_SECONDS):
+        self.db = firebase_client.db
+        self.products_col = self.db.collection('products')
+        self.prices_col = self.db.collection('branch_prices')
+        self.inventory_col = self.db.collection('inventory')
+        self.ready_timeout = ready_timeout
+
+        self._lock = threading.RLock()
+        self._products = {}    # sku -> product (chỉ sản phẩm active)
+        self._prices = {}      # branch_id -> {sku: bản ghi giá}
+        self._inventory = {}   # branch_id -> {sku: bản ghi tồn kho}
+        self._stock_shards = {}  # branch_id -> {đường dẫn shard: bản ghi shard} (SKU bán chạy, xem InventoryManager)
+
+        self._watches = {}     # watch key -> Watch (hoặc None nếu đang dùng polling)
+        self._ready = {}       # watch key -> threading.Event
+        self._polled_at = {}   # watch key -> thời điểm đọc trực tiếp gần nhất
+        self._loaded = set()   # watch key đã có dữ liệu (từ listener hoặc đọc trực tiếp)
+        self._failed = {}      # watch key -> (thời điểm được thử lại, lỗi) sau lần tải thất bại
+
+        # Phiên bản dữ liệu để biết khi nào cần join lại catalog của chi nhánh
+        self._products_version = 0
+        self._branch_versions = {}
+        self._joined = {}      # branch_id -> (products_version, branch_version, list, {sku: sản phẩm})
+
+        # Chỉ mục tìm kiếm dùng chung cho mọi chi nhánh (lập lại từng phần khi products thay đổi)
+        self._search_index = ProductSearchIndex()
+        self._search_version = None
+        self._search_results = OrderedDict()  # (branch_id, query, category_id, in_stock_only) -> (versions, list)
+
+    # --------------------------------------------------------------------------
+    # API CHO TRANG POS
+    # --------------------------------------------------------------------------
+
+    def get_branch_catalog(self, branch_id: str) -> list:
+        """
+        Trả về danh sách sản phẩm đang kinh doanh tại chi nhánh, đã join sẵn
+        giá bán ('selling_price') và tồn kho ('stock_quantity'), sắp xếp theo ngày tạo mới nhất.
+        Danh sách được dùng chung giữa các phiên, người gọi không được sửa trực tiếp.
+        """
+        if not branch_id:
+            return []
+        self._ensure_branch(branch_id)
+        with self._lock:
+            versions = (self._products_version, self._branch_versions.get(branch_id, 0))
+            cached = self._joined.get(branch_id)
+            if cached and cached[:2] == versions:
+                return cached[2]
+
+            prices = self._prices.get(branch_id, {})
+            stock = self._branch_stock(branch_id)
+            catalog = []
+            for sku, product in self._products.items():
+                price_info = prices.get(sku)
+                # Chỉ các sản phẩm đã niêm yết và đang bán tại chi nhánh
+                if not price_info or not price_info.get('is_active', True):
+                    continue
+                catalog.append({
+                    **product,
+                    'selling_price': price_info.get('price', 0),
+                    'stock_quantity': stock.get(sku, 0),
+                })
+            catalog.sort(key=_created_at_sort_key, reverse=True)
+            self._joined[branch_id] = (*versions, catalog, {p['sku']: p for p in catalog})
+            return catalog
+
+    def search_branch_catalog(self, branch_id: str, query: str = "", category_id: str = None,
+                              in_stock_only: bool = False) -> list:
+        """
+        Tìm trong catalog của chi nhánh theo tên/SKU (không phân biệt dấu) và danh mục,
+        kết quả đã xếp hạng (xem ProductSearchIndex). Không đọc Firestore.
+        Kết quả được giữ lại cho tới khi catalog chi nhánh thay đổi, nên gọi lại với cùng bộ lọc
+        (VD: chuyển trang gallery) chỉ tốn một lần tra dict. Danh sách trả về không được sửa trực tiếp.
+        """
+        catalog = self.get_branch_catalog(branch_id)
+        query = (query or "").strip()
+        if not catalog or (not query and not category_id and not in_stock_only):
+            return catalog
+
+        cache_key = (branch_id, query, category_id, in_stock_only)
+        with self._lock:
+            versions = (self._products_version, self._branch_versions.get(branch_id, 0))
+            cached = self._search_results.get(cache_key)
+            if cached and cached[0] == versions:
+                self._search_results.move_to_end(cache_key)
+                return cached[1]
+
+        if query or category_id:
+            branch_items = self._sync_search_index(branch_id)
+            skus = self._search_index.search_skus(query, category_id)
+            results = [branch_items[sku] for sku in skus if sku in branch_items]
+        else:
+            results = catalog
+        if in_stock_only:
+            results = [p for p in results if p.get('stock_quantity', 0) > 0]
+
+        with self._lock:
+            self._search_results[cache_key] = (versions, results)
+            self._search_results.move_to_end(cache_key)
+            while len(self._search_results) > SEARCH_CACHE_SIZE:
+                self._search_results.popitem(last=False)
+        return results
+
+    def resolve_scan_code(self, branch_id: str, code: str):
+        """
+        Sản phẩm (đã join giá/tồn kho) của chi nhánh có barcode hoặc SKU trùng mã quét; None nếu không có
+        hoặc sản phẩm không kinh doanh tại chi nhánh. Tra bảng O(1), không đọc Firestore.
+        """
+        if not self.get_branch_catalog(branch_id):
+            return None
+        branch_items = self._sync_search_index(branch_id)
+        sku = self._search_index.lookup_code(code)
+        return branch_items.get(sku) if sku else None
+
+    def _sync_search_index(self, branch_id: str) -> dict:
+        """Đồng bộ chỉ mục tìm kiếm với products hiện tại; trả về {sku: sản phẩm} của catalog chi nhánh."""
+        with self._lock:
+            products_version = self._products_version
+            needs_sync = self._search_version != products_version
+            if needs_sync:
+                products = sorted(self._products.values(), key=_created_at_sort_key, reverse=True)
+            branch_items = self._joined[branch_id][3]
+        if needs_sync:
+            # Lập chỉ mục ngoài khóa của mirror để không chặn listener
+            self._search_index.sync(products)
+            with self._lock:
+                self._search_version = products_version
+        return branch_items
+
+    def get_branch_inventory(self, branch_id: str) -> dict:
+        """Tồn kho của chi nhánh dạng {sku: bản ghi tồn kho}, cùng định dạng với InventoryManager.get_inventory_by_branch."""
+        if not branch_id:
+            return {}
+        self._ensure_branch(branch_id)
+        with self._lock:
+            stock = self._branch_stock(branch_id)
+            return {
+                sku: {**record, 'stock_quantity': stock.get(sku, 0)}
+                for sku, record in self._inventory.get(branch_id, {}).items()
+            }
+
+    def get_stock_quantity(self, sku: str, branch_id: str) -> int:
+        self._ensure_branch(branch_id)
+        with self._lock:
+            return self._branch_stock(branch_id).get(sku, 0)
+
+    def _branch_stock(self, branch_id: str) -> dict:
+        """{sku: tồn kho} = document chính + các shard; gọi khi đang giữ self._lock."""
+        stock = {sku: record.get('stock_quantity', 0) for sku, record in self._inventory.get(branch_id, {}).items()}
+        for shard in self._stock_shards.get(branch_id, {}).values():
+            sku = shard.get('sku')
+            if sku:
+                stock[sku] = stock.get(sku, 0) + shard.get('stock_quantity', 0)
+        return stock
+
+    def close(self):
+        """Hủy toàn bộ listener (dùng khi tắt server hoặc trong benchmark)."""
+        with self._lock:
+            watches = list(self._watches.values())
+            self._watches.clear()
+            self._ready.clear()
+        for watch in watches:
+            if watch is not None:
+                try:
+                    watch.unsubscribe()
+                except Exception as e:
+                    logging.warning(f"Error closing catalog listener: {e}")
+
+    # --------------------------------------------------------------------------
+    # LISTENER & ĐỒNG BỘ
+    # --------------------------------------------------------------------------
+
+    def _ensure_branch(self, branch_id: str):
+        self._ensure_watch(
+            'products',
+            self.products_col.where(filter=FieldFilter('active', '==', True)),
+            lambda snapshot: snapshot.id,
+            self._apply_product_changes,
+        )
+        self._ensure_watch(
+            ('prices', branch_id),
+            self.prices_col.where(filter=FieldFilter('branch_id', '==', branch_id)),
+            lambda snapshot: (snapshot.to_dict() or {}).get('sku'),
+            lambda changes: self._apply_branch_changes(self._prices, branch_id, changes),
+        )
+        self._ensure_watch(
+            ('inventory', branch_id),
+            self.inventory_col.where(filter=FieldFilter('branch_id', '==', branch_id)),
+            lambda snapshot: (snapshot.to_dict() or {}).get('sku'),
+            lambda changes: self._apply_branch_changes(self._inventory, branch_id, changes),
+        )
+        # Cần bật index collection group cho stock_shards.branch_id
+        self._ensure_watch(
+            ('stock_shards', branch_id),
+            self.db.collection_group(STOCK_SHARDS_COLLECTION).where(filter=FieldFilter('branch_id', '==', branch_id)),
+            lambda snapshot: snapshot.reference.path,
+            lambda changes: self._apply_branch_changes(self._stock_shards, branch_id, changes),
+        )
+
+    def _ensure_watch(self, key, query, key_func, apply_changes):
+        with self._lock:
+            watch = self._watches.get(key)
+            ready = self._ready.get(key)
+            failed = self._failed.get(key)
+            if failed and time.monotonic() < failed[0] and not (ready is not None and ready.is_set()):
+                # Lần tải trước đã thất bại: không chờ lại cho tới lúc được thử lại
+                if key in self._loaded:
+                    return
+                raise failed[1]
+            is_live = watch is not None and getattr(watch, 'is_active', True)
+            polled_at = self._polled_at.get(key)
+            if ready is not None and is_live:
+                needs_start = False
+            elif ready is not None and polled_at and time.monotonic() - polled_at < POLL_INTERVAL_SECONDS:
+                needs_start = False
+            else:
+                needs_start = True
+                ready = threading.Event()
+                self._ready[key] = ready
+                # Listener cũ đã dừng: hủy hẳn trước khi mở listener mới
+                stale_watch = self._watches.pop(key, None)
+
+        if needs_start:
+            if stale_watch is not None:
+                try:
+                    stale_watch.unsubscribe()
+                except Exception as e:
+                    logging.warning(f"Error closing catalog listener {key}: {e}")
+
+            is_first_snapshot = [True]
+
+            def on_snapshot(docs, changes, read_time):
+                batch = [
+                    (change.type.name, key_func(change.document), change.document)
+                    for change in changes
+                ]
+                if is_first_snapshot[0]:
+                    # Snapshot đầu tiên chứa toàn bộ kết quả: bỏ dữ liệu cũ của listener trước (nếu có)
+                    batch.insert(0, ('RESET', None, None))
+                    is_first_snapshot[0] = False
+                apply_changes(batch)
+                self._mark_loaded(key)
+                ready.set()
+
+            try:
+                new_watch = query.on_snapshot(on_snapshot)
+                with self._lock:
+                    self._watches[key] = new_watch
+            except Exception as e:
+                logging.warning(f"Cannot open catalog listener {key}, falling back to polling: {e}")
+                with self._lock:
+                    self._watches[key] = None
+                self._load_once(key, query, key_func, apply_changes, ready)
+                return
+
+        if not ready.wait(self.ready_timeout):
+            # Listener chưa trả snapshot đầu tiên (hoặc không mở được): đọc trực tiếp một lần
+            self._load_once(key, query, key_func, apply_changes, ready)
+
+    def _load_once(self, key, query, key_func, apply_changes, ready):
+        try:
+            docs = list(query.stream())
+        except Exception as e:
+            with self._lock:
+                self._failed[key] = (time.monotonic() + LOAD_RETRY_SECONDS, e)
+                has_data = key in self._loaded
+            logging.warning(f"Cannot load catalog {key}, retrying in {LOAD_RETRY_SECONDS}s: {e}")
+            if has_data:
+                return
+            raise
+        apply_changes([('RESET', None, None)] + [('ADDED', key_func(doc), doc) for doc in docs])
+        with self._lock:
+            self._polled_at[key] = time.monotonic()
+        self._mark_loaded(key)
+        ready.set()
+
+    def _mark_loaded(self, key):
+        with self._lock:
+            self._loaded.add(key)
+            self._failed.pop(key, None)
+
+    def _apply_product_changes(self, changes):
+        with self._lock:
+            for change_type, sku, snapshot in changes:
+                if change_type == 'RESET':
+                    self._products.clear()
+                elif change_type == 'REMOVED':
+                    self._products.pop(sku, None)
+                elif sku:
+                    self._products[sku] = {"id": snapshot.id, **snapshot.to_dict()}
+            self._products_version += 1
+
+    def _apply_branch_changes(self, target: dict, branch_id: str, changes):
+        with self._lock:
+            branch_data = target.setdefault(branch_id, {})
+            for change_type, sku, snapshot in changes:
+                if change_type == 'RESET':
+                    branch_data.clear()
+                elif change_type == 'REMOVED':
+                    branch_data.pop(sku, None)
+                elif sku:
+                    branch_data[sku] = snapshot.to_dict()
+            self._branch_versions[branch_id] = self._branch_versions.get(branch_id, 0) + 1
+
+
+def _created_at_sort_key(product: dict):
+    created_at = product.get('created_at')
+    if isinstance(created_at, datetime):
+        return created_at if created_at.tzinfo else created_at.replace(tzinfo=timezone.utc)
+    return datetime.min.replace(tzinfo=timezone.utc)
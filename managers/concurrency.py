@@ -0,0 +1,59 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Số luồng tối đa dùng chung cho cả process (mỗi luồng giữ một RPC Firestore đang chờ)
+MAX_WORKERS = 8
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Đánh dấu đang chạy bên trong một tác vụ fan_out, để lời gọi lồng nhau chạy tuần tự
+# thay vì chờ luồng của chính pool (có thể gây deadlock khi pool đã đầy).
+_in_worker = contextvars.ContextVar('fan_out_worker', default=False)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="firestore-fanout")
+    return _executor
+
+
+def _run_in_worker(func):
+    _in_worker.set(True)
+    return func()
+
+
+def fan_out(calls: dict) -> dict:
+    """
+    Chạy song song các truy vấn Firestore độc lập và trả về {tên: kết quả} theo đúng các khóa của calls.
+
+    Args:
+        calls: {tên: hàm không tham số}. Mỗi hàm chạy trên một luồng của pool dùng chung
+            với bản sao contextvars của luồng gọi (nên phạm vi FirestoreMetrics vẫn được cộng dồn đúng).
+            Các hàm không được gọi st.* (luồng phụ không có ngữ cảnh script của Streamlit).
+
+    Thời gian chờ xấp xỉ bằng truy vấn chậm nhất thay vì tổng các truy vấn.
+    Nếu có hàm lỗi, ngoại lệ đầu tiên (theo thứ tự của calls) được ném lại sau khi mọi hàm đã kết thúc.
+    """
+    if len(calls) <= 1 or _in_worker.get():
+        return {name: func() for name, func in calls.items()}
+
+    executor = _get_executor()
+    futures = {
+        name: executor.submit(contextvars.copy_context().run, _run_in_worker, func)
+        for name, func in calls.items()
+    }
+    results, first_error = {}, None
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            if first_error is None:
+                first_error = e
+    if first_error is not None:
+        raise first_error
+    return results
@@ -7,22 +7,29 @@ from google.cloud import firestore
 from dateutil.relativedelta import relativedelta
 
 # Corrected import path to be absolute
+from managers.app_secrets import get_secret
 from managers.image_handler import ImageHandler
+from managers.reference_cache import reference_cache
+from managers.report_cache import ReportInvalidations
 
 class CostManager:
-    def __init__(self, firebase_client):
+    def __init__(self, firebase_client, image_handler: ImageHandler = None):
         self.db = firebase_client.db
         self.group_col = self.db.collection('cost_groups')
         self.entry_col = self.db.collection('cost_entries')
         self.allocation_rules_col = self.db.collection('cost_allocation_rules')
-        self.image_handler = self._initialize_image_handler()
+        # Chi phí ghi vào ngày đã qua làm đổi báo cáo đã lưu của ngày đó
+        self.report_invalidations = ReportInvalidations(self.db)
+        # Ưu tiên handler dùng chung (đã build Drive client một lần cho cả process)
+        self.image_handler = image_handler or self._initialize_image_handler()
         # Flexible folder ID: specific first, then general
-        self.receipt_image_folder_id = st.secrets.get("drive_receipt_folder_id") or st.secrets.get("drive_folder_id")
+        self.receipt_image_folder_id = get_secret("drive_receipt_folder_id") or get_secret("drive_folder_id")
 
     def _initialize_image_handler(self):
-        if "drive_oauth" in st.secrets:
+        drive_oauth = get_secret("drive_oauth")
+        if drive_oauth:
             try:
-                creds_info = dict(st.secrets["drive_oauth"])
+                creds_info = dict(drive_oauth)
                 if creds_info.get('refresh_token'):
                     return ImageHandler(credentials_info=creds_info)
                 else:
@@ -49,7 +56,10 @@ class CostManager:
             return None
 
     def get_cost_groups(self):
-        return [doc.to_dict() for doc in self.group_col.order_by("group_name").stream()]
+        return reference_cache.get_or_load(
+            ('cost_groups',),
+            lambda: [doc.to_dict() for doc in self.group_col.order_by("group_name").stream()]
+        )
 
     def create_cost_entry(self, **kwargs):
         """Creates a cost entry, now expecting receipt_url to be passed in."""
@@ -62,7 +72,10 @@ class CostManager:
                 'status': 'ACTIVE',
                 'source_entry_id': None
             }
-            self.entry_col.document(entry_id).set(entry_data)
+            batch = self.db.batch()
+            batch.set(self.entry_col.document(entry_id), entry_data)
+            self.report_invalidations.invalidate_days([_entry_day(entry_data)], writer=batch)
+            batch.commit()
             return [entry_data]
         else:
             # Amortization logic remains the same
@@ -81,6 +94,7 @@ class CostManager:
 
             monthly_amount = round(kwargs['amount'] / kwargs['amortize_months'], 2)
             start_date = datetime.fromisoformat(kwargs['entry_date'])
+            entry_days = [_entry_day(source_entry_data)]
             for i in range(kwargs['amortize_months']):
                 child_id = f"CE-{uuid.uuid4().hex[:8].upper()}"
                 child_ref = self.entry_col.document(child_id)
@@ -94,6 +108,8 @@ class CostManager:
                     'source_entry_id': source_entry_id
                 }
                 batch.set(child_ref, child_data)
+                entry_days.append(_entry_day(child_data))
+            self.report_invalidations.invalidate_days(entry_days, writer=batch)
             batch.commit()
             st.success(f"Đã tạo chi phí trả trước và {kwargs['amortize_months']} kỳ khấu hao.")
             return [source_entry_data]
@@ -102,9 +118,19 @@ class CostManager:
         doc = self.entry_col.document(entry_id).get()
         return doc.to_dict() if doc.exists else None
 
-    def query_cost_entries(self, filters=None):
+    def query_cost_entries(self, filters=None, fields: list = None):
+        """
+        Lọc chi phí theo filters. fields: chỉ lấy các trường này (projection select() phía Firestore);
+        phải bao gồm các trường mà filters dùng tới (branch_id, status, entry_date...).
+        """
         try:
-            all_entries = [doc.to_dict() for doc in self.entry_col.stream()]
+            query = self.entry_col.select(fields) if fields else self.entry_col
+            # Khoảng entry_date lọc phía Firestore (index một field), các điều kiện còn lại lọc bên dưới
+            if filters and filters.get('start_date'):
+                query = query.where('entry_date', '>=', filters['start_date'])
+            if filters and filters.get('end_date'):
+                query = query.where('entry_date', '<=', filters['end_date'])
+            all_entries = [doc.to_dict() for doc in query.stream()]
         except Exception as e:
             logging.error(f"Error fetching all cost entries from Firestore: {e}")
             return []
@@ -138,9 +164,13 @@ class CostManager:
         self.allocation_rules_col.document(rule_id).set({
             'id': rule_id, 'name': rule_name, 'description': description, 'splits': splits
         })
+        reference_cache.invalidate('cost_allocation_rules')
 
     def get_allocation_rules(self):
-        return [doc.to_dict() for doc in self.allocation_rules_col.order_by("name").stream()]
+        return reference_cache.get_or_load(
+            ('cost_allocation_rules',),
+            lambda: [doc.to_dict() for doc in self.allocation_rules_col.order_by("name").stream()]
+        )
 
     @firestore.transactional
     def _apply_allocation_transaction(self, transaction, source_entry_id, rule_id, user_id):
@@ -166,8 +196,14 @@ class CostManager:
                 'created_by': user_id, 'notes': f"Phân bổ từ {source_entry_id} theo quy tắc {rule['name']}"
             })
 
+        if source_doc.get('entry_date'):
+            self.report_invalidations.invalidate_days([_entry_day(source_doc)], writer=transaction)
         transaction.update(source_ref, {'status': 'ALLOCATED', 'notes': f"Đã phân bổ theo quy tắc {rule['name']}"})
 
     def apply_allocation(self, source_entry_id, rule_id, user_id):
         transaction = self.db.transaction()
         self._apply_allocation_transaction(transaction, source_entry_id, rule_id, user_id)
+
+
+def _entry_day(entry: dict):
+    return datetime.fromisoformat(entry['entry_date']).date()
@@ -1,6 +1,89 @@
+import re
 import uuid
+import logging
 from datetime import datetime
 from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from managers.pagination import DEFAULT_PAGE_SIZE, DESCENDING, Page, paginate
+from managers.text_utils import tokenize
+
+# Tiền tố dài nhất được lưu trong search_tokens; từ khóa dài hơn được cắt để tra rồi lọc lại ở client
+MAX_TOKEN_PREFIX = 10
+# Số điện thoại chỉ được tra khi đã gõ ít nhất chừng này chữ số (tránh token quá phổ biến như "09")
+MIN_PHONE_PREFIX = 3
+SEARCH_RESULT_LIMIT = 10
+# Truy vấn nhiều từ: số ứng viên đọc về (theo từ đầu tiên) so với số kết quả cần, trước khi lọc các từ còn lại
+MULTI_TOKEN_FETCH_FACTOR = 5
+BACKFILL_BATCH_SIZE = 400
+
+_NON_DIGIT = re.compile(r"\D+")
+
+
+def normalize_phone(phone) -> str:
+    """Chỉ giữ chữ số, đổi đầu số quốc tế về dạng trong nước: "+84 912-345-678" -> "0912345678"."""
+    digits = _NON_DIGIT.sub('', str(phone or ''))
+    if digits.startswith('84') and len(digits) >= 11:
+        digits = '0' + digits[2:]
+    return digits
+
+
+def filter_customers(customers, query: str, limit: int = SEARCH_RESULT_LIMIT) -> list:
+    """
+    Như CustomerManager.search_customers nhưng lọc trên danh sách có sẵn (VD: bản sao offline của trang POS),
+    không đọc Firestore.
+    """
+    words, phone = _parse_search_query(query)
+    if not words:
+        return []
+    return _rank_customers(customers, words, phone, limit)
+
+
+def _parse_search_query(query: str):
+    """(các từ cần khớp, số điện thoại đã chuẩn hóa hoặc ''). Không có từ nào thì không cần tìm."""
+    words = tokenize(query)
+    phone = normalize_phone(query) if words and not any(c.isalpha() for c in query) else ''
+    if phone:
+        if len(phone) < MIN_PHONE_PREFIX:
+            return [], ''
+        words = [phone]
+    return words, phone
+
+
+def _rank_customers(customers, words: list, phone: str, limit: int) -> list:
+    """Trùng số điện thoại, rồi khớp đầu tên, rồi chi tiêu nhiều hơn."""
+    matches = []
+    for customer in customers:
+        if phone:
+            if not customer.get('phone_normalized', '').startswith(phone):
+                continue
+            rank = 0 if customer.get('phone_normalized') == phone else 1
+        else:
+            name_words = tokenize(customer.get('name'))
+            if not all(any(w.startswith(word) for w in name_words) for word in words):
+                continue
+            rank = 0 if name_words and name_words[0].startswith(words[0]) else 1
+        matches.append((rank, -customer.get('total_spent', 0), customer))
+    matches.sort(key=lambda m: m[:2])
+    return [customer for _, _, customer in matches[:limit]]
+
+
+def build_search_fields(data: dict) -> dict:
+    """
+    Các field phục vụ tìm kiếm của một khách hàng:
+    - phone_normalized: số điện thoại đã chuẩn hóa
+    - search_tokens: tiền tố (tối đa MAX_TOKEN_PREFIX ký tự) của từng từ trong tên (bỏ dấu) và của số điện thoại,
+      để tra bằng array_contains (index một field, không cần composite index)
+    """
+    tokens = set()
+    for word in tokenize(data.get('name')):
+        tokens.update(word[:length] for length in range(1, min(len(word), MAX_TOKEN_PREFIX) + 1))
+    phone = normalize_phone(data.get('phone'))
+    tokens.update(phone[:length] for length in range(MIN_PHONE_PREFIX, min(len(phone), MAX_TOKEN_PREFIX) + 1))
+    if len(phone) > MAX_TOKEN_PREFIX:
+        tokens.add(phone)
+    return {'phone_normalized': phone, 'search_tokens': sorted(tokens)}
+
 
 class CustomerManager:
     def __init__(self, firebase_client):
@@ -17,15 +100,61 @@ class CustomerManager:
         new_data.setdefault('total_spent', 0)
         new_data.setdefault('points', 0)
         new_data.setdefault('rank', 'Đồng')
+        new_data.update(build_search_fields(new_data))
 
         self.collection.document(customer_id).set(new_data)
         return new_data
 
+    def search_customers(self, query: str, limit: int = SEARCH_RESULT_LIMIT) -> list:
+        """
+        Tìm khách hàng theo tiền tố tên (không phân biệt dấu) hoặc số điện thoại, tối đa 'limit' kết quả.
+        Một truy vấn array_contains trên search_tokens, nên chi phí tỉ lệ với số kết quả chứ không với số khách hàng.
+        Thứ tự: trùng số điện thoại, rồi khớp đầu tên, rồi chi tiêu nhiều hơn.
+        """
+        words, phone = _parse_search_query(query)
+        if not words:
+            return []
+
+        lookup = words[0][:MAX_TOKEN_PREFIX] if len(words[0]) > MAX_TOKEN_PREFIX and not phone else words[0]
+        needs_filter = len(words) > 1 or lookup != words[0]
+        fetch_limit = limit * MULTI_TOKEN_FETCH_FACTOR if needs_filter else limit
+        docs = (
+            self.collection.where(filter=FieldFilter('search_tokens', 'array_contains', lookup))
+            .limit(fetch_limit).stream()
+        )
+        return _rank_customers((doc.to_dict() for doc in docs), words, phone, limit)
+
+    def backfill_search_fields(self, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+        """
+        Bổ sung/cập nhật phone_normalized và search_tokens cho các khách hàng tạo trước khi có tìm kiếm.
+        Đọc theo trang (start_after) và ghi theo batch; chỉ ghi document có field thay đổi. Trả về số document đã cập nhật.
+        """
+        updated = 0
+        last_doc = None
+        while True:
+            query = self.collection.order_by('__name__').limit(batch_size)
+            if last_doc is not None:
+                query = query.start_after(last_doc)
+            docs = list(query.stream())
+            if not docs:
+                return updated
+            batch = self.db.batch()
+            pending = 0
+            for doc in docs:
+                data = doc.to_dict()
+                fields = build_search_fields(data)
+                if any(data.get(key) != value for key, value in fields.items()):
+                    batch.update(doc.reference, fields)
+                    pending += 1
+            if pending:
+                batch.commit()
+                updated += pending
+            logging.info(f"Customer search backfill: {updated} updated so far")
+            last_doc = docs[-1]
+
     def list_customers(self, query: str | None = None):
         """Lấy danh sách khách hàng. Có thể tìm kiếm theo tên hoặc sđt."""
-        # Note: Firestore không hỗ trợ full-text search hiệu quả.
-        # Cách tiếp cận đơn giản là lấy tất cả và lọc bằng Python.
-        # Với lượng khách hàng lớn, cần giải pháp search mạnh hơn (VD: Algolia, Elasticsearch)
+        # Note: hàm này stream toàn bộ collection; trang POS dùng search_customers() thay thế.
         docs = self.collection.stream()
         results = []
         for doc in docs:
@@ -39,6 +168,13 @@ class CustomerManager:
             ]
         return results
 
+    def list_customers_page(self, page_size: int = DEFAULT_PAGE_SIZE, cursor: str = None) -> Page:
+        """Danh sách khách hàng theo trang, khách mới tạo trước."""
+        return paginate(
+            self.collection, self.collection, [('created_at', DESCENDING)], page_size, cursor,
+            transform=lambda doc: doc.to_dict(),
+        )
+
     def get_customer_by_id(self, customer_id: str):
         """Lấy thông tin chi tiết một khách hàng."""
         doc = self.collection.document(customer_id).get()
@@ -55,9 +191,9 @@ class CustomerManager:
 
         customer_ref = self.collection.document(customer_id)
         
-        # Dùng FieldValue.increment để đảm bảo an toàn
+        # Dùng firestore.Increment để đảm bảo an toàn
         transaction.update(customer_ref, {
-            'total_spent': firestore.FieldValue.increment(amount_spent_delta),
-            'points': firestore.FieldValue.increment(points_delta),
+            'total_spent': firestore.Increment(amount_spent_delta),
+            'points': firestore.Increment(points_delta),
             'last_purchase_date': datetime.now().isoformat()
         })
@@ -0,0 +1,161 @@
+import logging
+import threading
+from datetime import date, datetime, timedelta
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from managers.order_sequence import order_id_range
+
+DAILY_SALES_COLLECTION = 'daily_sales'
+# settings/daily_sales.complete_from: ngày đầu tiên mà rollup đã đủ (sau khi backfill);
+# báo cáo chỉ đọc rollup từ ngày này, trước đó vẫn đọc đơn hàng
+_META_DOC = ('settings', 'daily_sales')
+
+
+def rollup_doc_id(branch_id: str, day: date) -> str:
+    return f"{branch_id}_{day.isoformat()}"
+
+
+def empty_rollup(branch_id: str, day: date) -> dict:
+    return {
+        'branch_id': branch_id, 'date': day.isoformat(),
+        'revenue': 0, 'cogs': 0, 'order_count': 0, 'subtotal': 0,
+        'auto_discount': 0, 'manual_discount': 0, 'items': {},
+    }
+
+
+def _order_contribution(order: dict) -> dict:
+    """Phần đóng góp của một đơn vào rollup ngày (cùng các field với empty_rollup, trừ branch_id/date)."""
+    items = {}
+    for item in order.get('items', []):
+        line = items.setdefault(item['sku'], {'quantity': 0, 'revenue': 0})
+        line['quantity'] += item.get('quantity', 0)
+        line['revenue'] += item.get('final_price', 0) * item.get('quantity', 0)
+    return {
+        'revenue': order.get('grand_total', 0),
+        'cogs': order.get('total_cogs', 0),
+        'order_count': 1,
+        'subtotal': order.get('subtotal', 0),
+        'auto_discount': order.get('total_auto_discount', 0),
+        'manual_discount': order.get('total_manual_discount', 0),
+        'items': items,
+    }
+
+
+def add_order_to_rollup(rollup: dict, order: dict):
+    """Cộng một đơn hàng vào rollup dạng dict (dùng khi tính lại rollup từ đơn hàng)."""
+    contribution = _order_contribution(order)
+    for sku, line in contribution.pop('items').items():
+        total = rollup['items'].setdefault(sku, {'quantity': 0, 'revenue': 0})
+        total['quantity'] += line['quantity']
+        total['revenue'] += line['revenue']
+    for key, value in contribution.items():
+        rollup[key] += value
+
+
+class DailySalesRollup:
+    """
+    Tổng hợp bán hàng theo chi nhánh và ngày: daily_sales/{branch}_{YYYY-MM-DD}.
+
+    Mỗi đơn được cộng dồn (Increment) vào document của ngày trong cùng transaction tạo đơn, nên
+    báo cáo chỉ cần đọc một document cho mỗi chi nhánh-ngày thay vì toàn bộ đơn hàng.
+    Ngày là ngày local của created_at (cùng quy ước với mã đơn).
+    """
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.collection(DAILY_SALES_COLLECTION)
+        self.meta_ref = db.collection(_META_DOC[0]).document(_META_DOC[1])
+        self._meta_lock = threading.Lock()
+        self._complete_from = None  # cache của settings/daily_sales.complete_from (chỉ tiến về trước)
+
+    def record_order(self, transaction, order: dict):
+        """Cộng đơn hàng vào rollup ngày của nó. Ghi mù (không đọc), gọi bên trong transaction tạo đơn."""
+        day = datetime.fromisoformat(order['created_at']).date()
+        contribution = _order_contribution(order)
+        items = contribution.pop('items')
+        data = {key: firestore.Increment(value) for key, value in contribution.items()}
+        data['items'] = {
+            sku: {'quantity': firestore.Increment(line['quantity']), 'revenue': firestore.Increment(line['revenue'])}
+            for sku, line in items.items()
+        }
+        data.update(branch_id=order['branch_id'], date=day.isoformat())
+        transaction.set(self.collection.document(rollup_doc_id(order['branch_id'], day)), data, merge=True)
+
+    def get_complete_from(self):
+        """Ngày đầu tiên có rollup đầy đủ, hoặc None nếu chưa backfill."""
+        with self._meta_lock:
+            if self._complete_from is not None:
+                return self._complete_from
+        snapshot = self.meta_ref.get()
+        value = (snapshot.to_dict() or {}).get('complete_from') if snapshot.exists else None
+        complete_from = date.fromisoformat(value) if value else None
+        with self._meta_lock:
+            self._complete_from = complete_from
+        return complete_from
+
+    def load_days(self, start_day: date, end_day: date, branch_ids: list = None) -> list:
+        """
+        Các rollup từ start_day đến end_day. Có branch_ids: một get_all theo document ID
+        (chi nhánh-ngày không bán được gì thì không có document); không có: truy vấn khoảng ngày trên mọi chi nhánh.
+        """
+        if branch_ids is not None:
+            refs = []
+            day = start_day
+            while day <= end_day:
+                refs.extend(self.collection.document(rollup_doc_id(branch_id, day)) for branch_id in branch_ids)
+                day += timedelta(days=1)
+            if not refs:
+                return []
+            return [snapshot.to_dict() for snapshot in self.db.get_all(refs) if snapshot.exists]
+        query = self.collection.where(filter=FieldFilter('date', '>=', start_day.isoformat()))\
+                               .where(filter=FieldFilter('date', '<=', end_day.isoformat()))
+        return [doc.to_dict() for doc in query.stream()]
+
+    def rebuild(self, branch_ids: list, start_day: date, end_day: date = None) -> int:
+        """
+        Tính lại rollup của các chi nhánh từ start_day đến end_day (mặc định: hôm nay) từ đơn hàng.
+        Mỗi chi nhánh-ngày là một transaction đọc đơn của ngày (quét khoảng mã đơn) rồi ghi đè rollup,
+        nên chạy được khi quầy vẫn đang bán. Xong thì đánh dấu rollup đầy đủ từ start_day. Trả về số document đã ghi.
+        """
+        end_day = end_day or datetime.now().date()
+        written = 0
+        for branch_id in branch_ids:
+            day = start_day
+            while day <= end_day:
+                if self._rebuild_day(branch_id, day):
+                    written += 1
+                day += timedelta(days=1)
+            logging.info(f"Daily sales rollup rebuilt for {branch_id} ({written} documents so far)")
+
+        current = self.get_complete_from()
+        if current is None or start_day < current:
+            self.meta_ref.set({'complete_from': start_day.isoformat(), 'updated_at': datetime.now().isoformat()}, merge=True)
+            with self._meta_lock:
+                self._complete_from = start_day
+        return written
+
+    def _rebuild_day(self, branch_id: str, day: date) -> bool:
+        orders_col = self.db.collection('orders')
+        start_id, end_id = order_id_range(branch_id, day)
+        query = orders_col.where(filter=FieldFilter('status', '==', 'COMPLETED'))\
+                          .order_by('__name__')\
+                          .start_at({'__name__': orders_col.document(start_id)})\
+                          .end_before({'__name__': orders_col.document(end_id)})
+        rollup_ref = self.collection.document(rollup_doc_id(branch_id, day))
+
+        @firestore.transactional
+        def _rebuild(transaction):
+            # Đọc cả rollup để checkout đang ghi vào ngày này xung đột với (và chờ) transaction này
+            existing = rollup_ref.get(transaction=transaction)
+            rollup = empty_rollup(branch_id, day)
+            for doc in query.stream(transaction=transaction):
+                add_order_to_rollup(rollup, doc.to_dict())
+            if rollup['order_count'] == 0:
+                if existing.exists:
+                    transaction.delete(rollup_ref)
+                return False
+            transaction.set(rollup_ref, rollup)
+            return True
+
+        return _rebuild(self.db.transaction())
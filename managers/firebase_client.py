@@ -4,6 +4,8 @@ from firebase_admin import credentials, firestore, storage
 import pyrebase
 import streamlit as st
 
+from managers.firestore_metrics import instrument_db
+
 class FirebaseClient:
     def __init__(self, credentials_info, pyrebase_config):
         """
@@ -23,14 +25,45 @@ class FirebaseClient:
         self.db = firestore.client()
         self.bucket = storage.bucket()
         
-        # Initialize Pyrebase for Authentication
-        if not hasattr(st.session_state, 'pyrebase_app'):
-            try:
-                st.session_state.pyrebase_app = pyrebase.initialize_app(pyrebase_config)
-            except Exception as e:
-                raise e
+        # Initialize Pyrebase for Authentication.
+        # Client này được dùng chung cho cả process (xem get_shared_managers trong app.py),
+        # nên pyrebase app được giữ trên instance thay vì trong session_state.
+        try:
+            self.pyrebase_app = pyrebase.initialize_app(pyrebase_config)
+        except Exception as e:
+            raise e
         
-        self.auth = st.session_state.pyrebase_app.auth()
+        self.auth = self.pyrebase_app.auth()
+
+    @classmethod
+    def in_memory(cls, **options):
+        """
+        Tạo client dùng backend Firestore giả lập trong bộ nhớ (managers/memory_firestore.py),
+        không cần credentials. Dùng cho benchmark/kiểm thử; không có Storage và Authentication.
+        options được chuyển cho memory_firestore.Client (latency_ms, jitter_ms, abort_rate, seed).
+        """
+        from managers.memory_firestore import Client
+
+        client = cls.__new__(cls)
+        client.db = Client(**options)
+        client.bucket = None
+        client.pyrebase_app = None
+        client.auth = None
+        return client
+
+    def enable_instrumentation(self, metrics):
+        """
+        Bọc self.db để đếm số lượt đọc/ghi, document stream và transaction.
+        Phải gọi trước khi khởi tạo các manager, vì manager giữ tham chiếu tới db ngay trong __init__.
+        """
+        self.db = instrument_db(self.db, metrics)
+
+    def new_auth_session(self):
+        """
+        Tạo một đối tượng Auth riêng cho từng phiên người dùng.
+        Auth của pyrebase giữ trạng thái đăng nhập (current_user), nên không được dùng chung giữa các phiên.
+        """
+        return self.pyrebase_app.auth() if self.pyrebase_app else None
 
     def check_connection(self):
         try:
@@ -0,0 +1,247 @@
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Các loại đối tượng Firestore được bọc để đếm thao tác (so khớp theo tên lớp,
+# nên dùng được cho cả client thật lẫn backend giả lập có cùng tên lớp).
+_WRAPPED_KINDS = {
+    'Client', 'CollectionReference', 'DocumentReference', 'Query', 'CollectionGroup',
+    'Transaction', 'WriteBatch', 'AggregationQuery',
+}
+_WRITE_METHODS = {'set', 'update', 'delete', 'create'}
+_LATENCY_SAMPLES = 1000
+
+UNSCOPED = "(ngoài phạm vi)"
+LISTENER_SCOPE = "listener"
+
+_current_scopes = contextvars.ContextVar('firestore_metric_scopes', default=())
+
+
+class _ScopeStats:
+    __slots__ = ('calls', 'reads', 'writes', 'streamed_docs', 'transactions', 'latencies_ms')
+
+    def __init__(self):
+        self.calls = 0
+        self.reads = 0
+        self.writes = 0
+        self.streamed_docs = 0
+        self.transactions = 0
+        self.latencies_ms = deque(maxlen=_LATENCY_SAMPLES)
+
+
+class FirestoreMetrics:
+    """
+    Bộ đếm thao tác Firestore (đọc, ghi, số document stream, transaction) và độ trễ,
+    gom theo "phạm vi": một hàm của manager ('ProductManager.get_all_products')
+    hoặc một lần render trang ('page:Bán hàng (POS)'). Phạm vi lồng nhau đều được cộng dồn,
+    nên số đọc của trang đã bao gồm số đọc của các hàm manager mà trang gọi.
+    """
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.started_at = datetime.now()
+
+    @contextmanager
+    def scope(self, name: str):
+        parent = _current_scopes.get()
+        token = _current_scopes.set(parent + (name,))
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            _current_scopes.reset(token)
+            with self._lock:
+                stats = self._get_stats(name)
+                stats.calls += 1
+                stats.latencies_ms.append(elapsed_ms)
+
+    def record(self, reads=0, writes=0, streamed_docs=0, transactions=0, scope_name=None):
+        scopes = (scope_name,) if scope_name else (_current_scopes.get() or (UNSCOPED,))
+        with self._lock:
+            for name in set(scopes):
+                stats = self._get_stats(name)
+                stats.reads += reads
+                stats.writes += writes
+                stats.streamed_docs += streamed_docs
+                stats.transactions += transactions
+
+    def _get_stats(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = _ScopeStats()
+        return stats
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.started_at = datetime.now()
+
+    def snapshot(self) -> list:
+        """Trả về danh sách thống kê theo phạm vi, sắp xếp theo số đọc giảm dần."""
+        with self._lock:
+            items = [(name, stats, sorted(stats.latencies_ms)) for name, stats in self._stats.items()]
+
+        rows = []
+        for name, stats, latencies in items:
+            calls = stats.calls
+            rows.append({
+                "scope": name,
+                "kind": "page" if name.startswith("page:") else "method",
+                "calls": calls,
+                "reads": stats.reads,
+                "writes": stats.writes,
+                "streamed_docs": stats.streamed_docs,
+                "transactions": stats.transactions,
+                "reads_per_call": round(stats.reads / calls, 2) if calls else None,
+                "writes_per_call": round(stats.writes / calls, 2) if calls else None,
+                "avg_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+                "p50_ms": _percentile(latencies, 50),
+                "p95_ms": _percentile(latencies, 95),
+                "p99_ms": _percentile(latencies, 99),
+            })
+        rows.sort(key=lambda r: r['reads'], reverse=True)
+        return rows
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "started_at": self.started_at.isoformat(),
+            "exported_at": datetime.now().isoformat(),
+            "scopes": self.snapshot(),
+        }, ensure_ascii=False, indent=2)
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values) + 0.5) - 1))
+    return round(sorted_values[index], 2)
+
+
+# --------------------------------------------------------------------------
+# BỌC CLIENT FIRESTORE
+# --------------------------------------------------------------------------
+
+def instrument_db(db, metrics: FirestoreMetrics):
+    """Bọc client Firestore để mọi thao tác đi qua nó đều được đếm vào metrics."""
+    return _InstrumentedFirestore(db, metrics)
+
+
+def _unwrap(value):
+    if isinstance(value, _InstrumentedFirestore):
+        return value._target
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(v) for v in value)
+    return value
+
+
+class _InstrumentedFirestore:
+    """Proxy trong suốt cho Client/Reference/Query/Transaction/WriteBatch của Firestore."""
+    __slots__ = ('_target', '_metrics', '_kind')
+
+    def __init__(self, target, metrics, kind=None):
+        self._target = target
+        self._metrics = metrics
+        self._kind = kind or type(target).__name__
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith('_') or not callable(attr):
+            if name.startswith('_') and callable(attr):
+                # Giao thức nội bộ (VD: @firestore.transactional gọi _begin/_commit) - chỉ gỡ bọc tham số
+                return lambda *args, **kwargs: attr(*_unwrap(args), **{k: _unwrap(v) for k, v in kwargs.items()})
+            return attr
+
+        metrics = self._metrics
+        kind = self._kind
+
+        def call(*args, **kwargs):
+            args = _unwrap(args)
+            kwargs = {k: _unwrap(v) for k, v in kwargs.items()}
+            if name == 'on_snapshot' and args:
+                args = (_count_listener_changes(args[0], metrics),) + tuple(args[1:])
+
+            result = attr(*args, **kwargs)
+
+            if name in _WRITE_METHODS and kind in ('DocumentReference', 'Transaction', 'WriteBatch'):
+                metrics.record(writes=1)
+            elif name == 'add' and kind == 'CollectionReference':
+                metrics.record(writes=1)
+            elif name == 'transaction' and kind == 'Client':
+                metrics.record(transactions=1)
+
+            result_kind = type(result).__name__
+            if result_kind in _WRAPPED_KINDS:
+                return _InstrumentedFirestore(result, metrics, result_kind)
+            if kind == 'AggregationQuery' and name in ('get', 'stream'):
+                # Truy vấn tổng hợp được tính phí tối thiểu 1 lượt đọc
+                metrics.record(reads=1)
+                return result
+            if name == 'get' and kind == 'DocumentReference':
+                metrics.record(reads=1)
+                return result
+            if name in ('stream', 'get', 'get_all') and hasattr(result, '__next__'):
+                return _count_stream(result, metrics)
+            if name == 'get' and isinstance(result, list):
+                metrics.record(reads=max(1, len(result)), streamed_docs=len(result))
+            return result
+
+        return call
+
+    def __repr__(self):
+        return f"<instrumented {self._target!r}>"
+
+
+def _count_stream(iterator, metrics):
+    count = 0
+    try:
+        for item in iterator:
+            count += 1
+            metrics.record(reads=1, streamed_docs=1)
+            yield item
+    finally:
+        if count == 0:
+            # Truy vấn không có kết quả vẫn bị tính 1 lượt đọc
+            metrics.record(reads=1)
+
+
+def _count_listener_changes(callback, metrics):
+    @functools.wraps(callback)
+    def on_snapshot(docs, changes, read_time):
+        metrics.record(reads=len(changes), streamed_docs=len(changes), scope_name=LISTENER_SCOPE)
+        return callback(docs, changes, read_time)
+    return on_snapshot
+
+
+# --------------------------------------------------------------------------
+# BỌC MANAGER
+# --------------------------------------------------------------------------
+
+def instrument_manager(manager, metrics: FirestoreMetrics, name: str = None):
+    """
+    Gắn phạm vi đo cho mọi hàm public của một manager (trên chính instance đó),
+    để thao tác Firestore và độ trễ được gom theo 'TênManager.tên_hàm'.
+    """
+    prefix = name or type(manager).__name__
+    for attr_name in dir(type(manager)):
+        if attr_name.startswith('_'):
+            continue
+        if not inspect.isfunction(inspect.getattr_static(type(manager), attr_name)):
+            continue
+        bound = getattr(manager, attr_name)
+        setattr(manager, attr_name, _scoped(bound, metrics, f"{prefix}.{attr_name}"))
+    return manager
+
+
+def _scoped(func, metrics, scope_name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with metrics.scope(scope_name):
+            return func(*args, **kwargs)
+    return wrapper
@@ -7,14 +7,36 @@ from googleapiclient.http import MediaIoBaseUpload
 import io
 from PIL import Image
 import logging
+import threading
 import uuid
 
+from managers.app_secrets import get_secret
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class ImageHandler:
     def __init__(self, credentials_info):
         self.drive_service = self._initialize_drive_service(credentials_info)
+        # Drive service (httplib2) không thread-safe; handler được dùng chung giữa các phiên
+        # nên mọi lời gọi tới Drive đều đi qua lock này.
+        self._drive_lock = threading.Lock()
+
+    @classmethod
+    def from_secrets(cls):
+        """Khởi tạo handler từ mục 'drive_oauth' trong st.secrets. Trả về None nếu chưa cấu hình."""
+        drive_oauth = get_secret("drive_oauth")
+        if drive_oauth:
+            try:
+                creds_info = dict(drive_oauth)
+                if creds_info.get('refresh_token'):
+                    return cls(credentials_info=creds_info)
+                logger.warning("ImageHandler not initialized: 'refresh_token' is missing.")
+            except Exception as e:
+                logger.error(f"Failed to initialize ImageHandler: {e}")
+        else:
+            logger.warning("ImageHandler not initialized: 'drive_oauth' secret not found.")
+        return None
 
     def _initialize_drive_service(self, credentials_info):
         try:
@@ -53,6 +75,10 @@ class ImageHandler:
     def _upload_to_drive(self, folder_id, filename, image_bytes, update_existing=False):
         if not self.drive_service:
             raise Exception("Dịch vụ Google Drive chưa được khởi tạo.")
+        with self._drive_lock:
+            return self._upload_to_drive_locked(folder_id, filename, image_bytes, update_existing)
+
+    def _upload_to_drive_locked(self, folder_id, filename, image_bytes, update_existing):
 
         media = MediaIoBaseUpload(image_bytes, mimetype='image/jpeg', resumable=True)
         
@@ -108,13 +134,21 @@ class ImageHandler:
             return "assets/no-image.png"
         return f"https://drive.google.com/uc?id={file_id}"
 
+    @staticmethod
+    def get_thumbnail_url(file_id, width: int = 240):
+        """URL ảnh thu nhỏ (Drive tự resize theo chiều rộng) cho gallery; None nếu sản phẩm chưa có ảnh."""
+        if not file_id:
+            return None
+        return f"https://drive.google.com/thumbnail?id={file_id}&sz=w{width}"
+
     def delete_image_by_id(self, file_id):
         """Deletes a file from Google Drive using its file_id."""
         if not self.drive_service or not file_id:
             logger.warning("Drive service not initialized or file_id is missing. Cannot delete.")
             return
         try:
-            self.drive_service.files().delete(fileId=file_id).execute()
+            with self._drive_lock:
+                self.drive_service.files().delete(fileId=file_id).execute()
             logger.info(f"Deleted file with ID '{file_id}' from Drive.")
         except HttpError as e:
             if e.resp.status == 404:
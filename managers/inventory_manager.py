@@ -1,55 +1,208 @@
 
+import random
+import threading
+import time
 import uuid
 import logging
 from google.cloud import firestore
 from datetime import datetime
+from google.cloud.firestore_v1.base_query import And, FieldFilter, Or
+
+from managers.pagination import DEFAULT_PAGE_SIZE, DESCENDING, Page, paginate
+
+# Subcollection chứa các shard tồn kho của SKU bán chạy: inventory/{SKU}_{branch}/stock_shards/{0..N-1}
+STOCK_SHARDS_COLLECTION = 'stock_shards'
+# Mỗi document chỉ chịu được khoảng 1 lần ghi/giây liên tục, nên N shard cho phép ~N quầy cùng bán một SKU
+DEFAULT_SHARD_COUNT = 10
+# Danh sách SKU bán chạy được đọc lại sau khoảng này (thay đổi trong process này có hiệu lực ngay)
+HOT_SKU_REFRESH_SECONDS = 60
+
+
+class InsufficientStockError(Exception):
+    """Tồn kho không đủ cho một hoặc nhiều SKU. shortages: {sku: (số lượng cần, tồn kho hiện có)}."""
+    def __init__(self, shortages: dict):
+        self.shortages = shortages
+        details = ", ".join(f"{sku} (cần {needed}, còn {available})" for sku, (needed, available) in shortages.items())
+        super().__init__(f"Không đủ tồn kho: {details}")
 
 class InventoryManager:
+    """
+    Tồn kho theo chi nhánh, mỗi cặp (sku, chi nhánh) là một document inventory/{SKU}_{branch}.
+
+    SKU bán chạy (hot) có thể chuyển sang dạng bộ đếm phân tán: mỗi lần bán cộng dồn vào một
+    shard ngẫu nhiên trong subcollection stock_shards thay vì cùng một document, nên các quầy
+    không tranh chấp nhau trong transaction. Tồn kho thực = stock_quantity của document chính
+    + tổng các shard (đọc qua get_stock_quantities / get_inventory_by_branch, người gọi không cần biết về shard).
+    """
     def __init__(self, firebase_client):
         self.db = firebase_client.db
         self.inventory_col = self.db.collection('inventory')
         self.transfers_col = self.db.collection('stock_transfers')
         self.adjustments_col = self.db.collection('inventory_adjustments')
+        self._hot_lock = threading.Lock()
+        self._hot_skus = None  # (doc_id -> số shard, thời điểm nạp)
 
     def _get_doc_id(self, sku: str, branch_id: str):
         return f"{sku.upper()}_{branch_id}"
 
-    def update_inventory(self, sku: str, branch_id: str, delta: int, transaction: firestore.Transaction):
-        inv_doc_ref = self.inventory_col.document(self._get_doc_id(sku, branch_id))
+    def _shard_ref(self, doc_id: str, index: int):
+        return self.inventory_col.document(doc_id).collection(STOCK_SHARDS_COLLECTION).document(str(index))
+
+    def update_inventory(self, sku: str, branch_id: str, delta: int, transaction: firestore.Transaction, spread: bool = True):
+        """
+        Cộng delta vào tồn kho (ghi mù, không đọc). Với SKU bán chạy và spread=True, delta được
+        ghi vào một shard ngẫu nhiên; ngược lại ghi vào document chính. Cả hai đều được tính vào tồn kho.
+        """
+        doc_id = self._get_doc_id(sku, branch_id)
+        shard_count = self._get_hot_skus().get(doc_id) if spread else None
+        if shard_count:
+            inv_doc_ref = self._shard_ref(doc_id, random.randrange(shard_count))
+        else:
+            inv_doc_ref = self.inventory_col.document(doc_id)
         transaction.set(inv_doc_ref, {
-            'stock_quantity': firestore.FieldValue.increment(delta),
+            'stock_quantity': firestore.Increment(delta),
             'last_updated': datetime.now().isoformat(),
             'sku': sku, 
             'branch_id': branch_id
         }, merge=True)
 
-    @firestore.transactional
-    def _adjust_stock_transaction(self, transaction, sku, branch_id, new_quantity, user_id, reason, notes):
+    def _get_hot_skus(self) -> dict:
+        """{doc_id: số shard} của các SKU đang bật chế độ bán chạy, giữ trong bộ nhớ HOT_SKU_REFRESH_SECONDS."""
+        with self._hot_lock:
+            cached = self._hot_skus
+        if cached and time.monotonic() - cached[1] < HOT_SKU_REFRESH_SECONDS:
+            return cached[0]
+        try:
+            docs = self.inventory_col.where(filter=FieldFilter('hot', '==', True)).select(['shard_count']).stream()
+            hot_skus = {doc.id: doc.to_dict().get('shard_count', 0) for doc in docs}
+        except Exception as e:
+            # Không đọc được: ghi vào document chính vẫn đúng, chỉ mất lợi ích chia tải
+            logging.warning(f"Cannot load hot SKU list: {e}")
+            hot_skus = cached[0] if cached else {}
+        with self._hot_lock:
+            self._hot_skus = (hot_skus, time.monotonic())
+        return hot_skus
+
+    def _add_shard_totals(self, records: dict, transaction=None):
+        """Cộng tổng các shard vào 'stock_quantity' của các bản ghi {doc_id: dữ liệu} có shard_count (một lần get_all)."""
+        shard_refs, shard_owners = [], {}  # shard_owners: đường dẫn shard -> doc_id của document chính
+        for doc_id, data in records.items():
+            for i in range(data.get('shard_count', 0)):
+                ref = self._shard_ref(doc_id, i)
+                shard_refs.append(ref)
+                shard_owners[ref.path] = doc_id
+        if not shard_refs:
+            return records
+        for snapshot in self.db.get_all(shard_refs, transaction=transaction):
+            if snapshot.exists:
+                data = records[shard_owners[snapshot.reference.path]]
+                data['stock_quantity'] = data.get('stock_quantity', 0) + snapshot.to_dict().get('stock_quantity', 0)
+        return records
+
+    def set_hot_sku(self, sku: str, branch_id: str, shard_count: int = DEFAULT_SHARD_COUNT):
+        """Bật chế độ bán chạy: các lần bán sau được chia đều vào shard_count shard (không giảm số shard đã có)."""
+        if shard_count < 1:
+            raise ValueError("Số shard phải lớn hơn 0.")
+        inv_ref = self.inventory_col.document(self._get_doc_id(sku, branch_id))
+
+        @firestore.transactional
+        def _set_hot_transaction(transaction):
+            snapshot = inv_ref.get(transaction=transaction)
+            current = (snapshot.to_dict() or {}).get('shard_count', 0) if snapshot.exists else 0
+            # Shard cũ có thể còn số lượng, nên shard_count chỉ tăng để mọi shard luôn được cộng khi đọc
+            transaction.set(inv_ref, {
+                'hot': True, 'shard_count': max(current, shard_count),
+                'sku': sku, 'branch_id': branch_id, 'last_updated': datetime.now().isoformat()
+            }, merge=True)
+
+        _set_hot_transaction(self.db.transaction())
+        with self._hot_lock:
+            self._hot_skus = None
+
+    def unset_hot_sku(self, sku: str, branch_id: str):
+        """Tắt chế độ bán chạy: gộp số lượng các shard về document chính."""
         doc_id = self._get_doc_id(sku, branch_id)
         inv_ref = self.inventory_col.document(doc_id)
-        inv_snapshot = inv_ref.get(transaction=transaction)
-        current_quantity = inv_snapshot.to_dict().get('stock_quantity', 0) if inv_snapshot.exists else 0
-        delta = new_quantity - current_quantity
-        if delta == 0: return
-
-        self.update_inventory(sku, branch_id, delta, transaction)
-        adj_id = f"ADJ-{uuid.uuid4().hex[:8].upper()}"
-        adj_ref = self.adjustments_col.document(adj_id)
-        transaction.set(adj_ref, {
-            "id": adj_id, "sku": sku, "branch_id": branch_id, "user_id": user_id,
-            "timestamp": datetime.now().isoformat(), "quantity_before": current_quantity,
-            "quantity_after": new_quantity, "delta": delta, "reason": reason, "notes": notes
-        })
+
+        @firestore.transactional
+        def _unset_hot_transaction(transaction):
+            snapshot = inv_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return
+            data = snapshot.to_dict()
+            total = self._add_shard_totals({doc_id: dict(data)}, transaction=transaction)[doc_id].get('stock_quantity', 0)
+            # Giữ shard_count: quầy chưa nạp lại danh sách SKU bán chạy vẫn có thể ghi vào shard một thời gian
+            for i in range(data.get('shard_count', 0)):
+                transaction.set(self._shard_ref(doc_id, i), {'stock_quantity': 0}, merge=True)
+            transaction.set(inv_ref, {
+                'hot': False, 'stock_quantity': total, 'last_updated': datetime.now().isoformat()
+            }, merge=True)
+
+        _unset_hot_transaction(self.db.transaction())
+        with self._hot_lock:
+            self._hot_skus = None
 
     def adjust_stock(self, sku, branch_id, new_quantity, user_id, reason, notes):
-        transaction = self.db.transaction()
-        self._adjust_stock_transaction(transaction, sku, branch_id, new_quantity, user_id, reason, notes)
+        @firestore.transactional
+        def _adjust_stock_transaction(transaction):
+            current_quantity = self.get_stock_quantities([(sku, branch_id)], transaction=transaction)[(sku, branch_id)]
+            delta = new_quantity - current_quantity
+            if delta == 0: return
+
+            self.update_inventory(sku, branch_id, delta, transaction, spread=False)
+            adj_id = f"ADJ-{uuid.uuid4().hex[:8].upper()}"
+            adj_ref = self.adjustments_col.document(adj_id)
+            transaction.set(adj_ref, {
+                "id": adj_id, "sku": sku, "branch_id": branch_id, "user_id": user_id,
+                "timestamp": datetime.now().isoformat(), "quantity_before": current_quantity,
+                "quantity_after": new_quantity, "delta": delta, "reason": reason, "notes": notes
+            })
+
+        _adjust_stock_transaction(self.db.transaction())
+
+    def get_stock_quantities(self, pairs, transaction=None, lock_shards: bool = True, needed: dict = None) -> dict:
+        """
+        Lấy tồn kho của nhiều cặp (sku, branch_id) bằng một lần db.get_all() duy nhất
+        (thêm một lần nữa cho các shard nếu có SKU bán chạy).
+        Trả về {(sku, branch_id): stock_quantity}; cặp chưa có bản ghi tồn kho có giá trị 0.
+        Có thể truyền transaction để đọc (và khóa) các document trong transaction đó.
+        lock_shards=False: shard được đọc ngoài transaction, để các quầy cùng bán một SKU bán chạy không khóa lẫn nhau.
+        Khi đó, cặp có trong needed ({(sku, branch_id): số lượng cần}) mà tồn kho dưới shard_count × số lượng cần
+        được đọc lại shard trong transaction: các quầy bán đồng thời (tối đa khoảng shard_count quầy) không thể
+        cùng bán những đơn vị cuối. Trên ngưỡng đó vẫn có thể bán vượt nếu số quầy đồng thời lớn hơn shard_count.
+        """
+        pairs = [pair for pair in dict.fromkeys(pairs) if pair[0] and pair[1]]
+        if not pairs:
+            return {}
+        pairs_by_doc_id = {self._get_doc_id(sku, branch_id): (sku, branch_id) for sku, branch_id in pairs}
+        refs = [self.inventory_col.document(doc_id) for doc_id in pairs_by_doc_id]
+
+        records = {
+            snapshot.id: snapshot.to_dict()
+            for snapshot in self.db.get_all(refs, transaction=transaction) if snapshot.exists
+        }
+        if lock_shards or transaction is None:
+            self._add_shard_totals(records, transaction=transaction)
+        else:
+            base = {doc_id: data.get('stock_quantity', 0) for doc_id, data in records.items()}
+            self._add_shard_totals(records)
+            near_limit = {
+                doc_id: {**data, 'stock_quantity': base[doc_id]}
+                for doc_id, data in records.items()
+                if data.get('shard_count')
+                and data['stock_quantity'] < data['shard_count'] * (needed or {}).get(pairs_by_doc_id[doc_id], 0)
+            }
+            if near_limit:
+                records.update(self._add_shard_totals(near_limit, transaction=transaction))
+        quantities = {pair: 0 for pair in pairs}
+        for doc_id, data in records.items():
+            quantities[pairs_by_doc_id[doc_id]] = data.get('stock_quantity', 0)
+        return quantities
 
     def get_stock_quantity(self, sku: str, branch_id: str) -> int:
         try:
             if not branch_id or not sku: return 0
-            doc = self.inventory_col.document(self._get_doc_id(sku, branch_id)).get()
-            return doc.to_dict().get('stock_quantity', 0) if doc.exists else 0
+            return self.get_stock_quantities([(sku, branch_id)]).get((sku, branch_id), 0)
         except Exception as e:
             logging.error(f"Error getting stock for {sku}@{branch_id}: {e}")
             return 0
@@ -58,28 +211,34 @@ class InventoryManager:
         try:
             if not branch_id: return {}
             docs = self.inventory_col.where('branch_id', '==', branch_id).stream()
-            return {doc.to_dict()['sku']: doc.to_dict() for doc in docs if 'sku' in doc.to_dict()}
+            records = self._add_shard_totals({doc.id: doc.to_dict() for doc in docs})
+            return {data['sku']: data for data in records.values() if 'sku' in data}
         except Exception as e:
             logging.error(f"Error fetching inventory for branch '{branch_id}': {e}")
             return {}
     
     def get_inventory_adjustments_history(self, branch_id: str, limit: int = 200):
-        """
-        Lấy lịch sử điều chỉnh kho cho một chi nhánh cụ thể.
-        Sắp xếp được thực hiện ở phía server-side (Python) để tránh lỗi index của Firestore.
-        """
+        """Lấy lịch sử điều chỉnh kho gần nhất của một chi nhánh (mới nhất trước)."""
         try:
             if not branch_id:
                 return []
-            query = self.adjustments_col.where('branch_id', '==', branch_id).limit(limit)
-            docs = query.stream()
-            results = [doc.to_dict() for doc in docs]
-            results.sort(key=lambda x: x.get('timestamp', '1970-01-01T00:00:00.000000'), reverse=True)
-            return results
+            return self.get_inventory_adjustments_page(branch_id, page_size=limit, include_total=False).items
         except Exception as e:
             logging.error(f"Lỗi khi lấy lịch sử điều chỉnh kho cho chi nhánh '{branch_id}': {e}")
             return []
 
+    def get_inventory_adjustments_page(self, branch_id: str, page_size: int = DEFAULT_PAGE_SIZE, cursor: str = None,
+                                       include_total: bool = None) -> Page:
+        """
+        Lịch sử điều chỉnh kho theo trang, sắp xếp theo thời gian giảm dần ở phía Firestore.
+        Cần composite index (branch_id, timestamp desc) trên inventory_adjustments.
+        """
+        query = self.adjustments_col.where(filter=FieldFilter('branch_id', '==', branch_id))
+        return paginate(
+            self.adjustments_col, query, [('timestamp', DESCENDING)], page_size, cursor,
+            include_total=include_total, transform=lambda doc: doc.to_dict(),
+        )
+
     def create_transfer(self, from_branch_id, to_branch_id, items, user_id, notes=""):
         if not all([from_branch_id, to_branch_id, items]):
             raise ValueError("Thiếu thông tin chi nhánh hoặc sản phẩm.")
@@ -98,74 +257,76 @@ class InventoryManager:
         payload.update(update_data)
         transaction.update(transfer_ref, payload)
 
-    @firestore.transactional
-    def _ship_transfer_transaction(self, transaction, transfer_id, user_id):
+    def ship_transfer(self, transfer_id, user_id):
         transfer_ref = self.transfers_col.document(transfer_id)
-        transfer_doc = transfer_ref.get(transaction=transaction).to_dict()
-        if transfer_doc.get('status') != 'PENDING': raise Exception("Phiếu không ở trạng thái PENDING.")
 
-        from_branch = transfer_doc['from_branch_id']
-        for item in transfer_doc['items']:
-            if self.get_stock_quantity(item['sku'], from_branch) < item['quantity']: raise Exception(f"Tồn kho {item['sku']} không đủ.")
-            self.update_inventory(item['sku'], from_branch, -item['quantity'], transaction)
-        self._update_transfer_status(transaction, transfer_ref, "SHIPPED", user_id, {"shipped_at": datetime.now().isoformat(), "shipped_by": user_id})
+        @firestore.transactional
+        def _ship_transfer_transaction(transaction):
+            transfer_doc = transfer_ref.get(transaction=transaction).to_dict() or {}
+            if transfer_doc.get('status') != 'PENDING': raise Exception("Phiếu không ở trạng thái PENDING.")
 
-    def ship_transfer(self, transfer_id, user_id):
-        self._ship_transfer_transaction(self.db.transaction(), transfer_id, user_id)
+            from_branch = transfer_doc['from_branch_id']
+            required = {}
+            for item in transfer_doc['items']:
+                required[item['sku']] = required.get(item['sku'], 0) + item['quantity']
+            # Đọc tồn kho mọi dòng trong một lần get_all (transaction phải đọc xong trước khi ghi)
+            stock = self.get_stock_quantities([(sku, from_branch) for sku in required], transaction=transaction)
+            for sku, quantity in required.items():
+                if stock.get((sku, from_branch), 0) < quantity: raise Exception(f"Tồn kho {sku} không đủ.")
+
+            for item in transfer_doc['items']:
+                self.update_inventory(item['sku'], from_branch, -item['quantity'], transaction)
+            self._update_transfer_status(transaction, transfer_ref, "SHIPPED", user_id, {"shipped_at": datetime.now().isoformat(), "shipped_by": user_id})
+
+        _ship_transfer_transaction(self.db.transaction())
 
-    @firestore.transactional
-    def _receive_transfer_transaction(self, transaction, transfer_id, user_id):
-        transfer_ref = self.transfers_col.document(transfer_id)
-        transfer_doc = transfer_ref.get(transaction=transaction).to_dict()
-        if transfer_doc.get('status') != 'SHIPPED': raise Exception("Phiếu không ở trạng thái SHIPPED.")
-
-        to_branch = transfer_doc['to_branch_id']
-        for item in transfer_doc['items']:
-            self.update_inventory(item['sku'], to_branch, item['quantity'], transaction)
-        self._update_transfer_status(transaction, transfer_ref, "COMPLETED", user_id, {"completed_at": datetime.now().isoformat(), "completed_by": user_id})
-        
     def receive_transfer(self, transfer_id, user_id):
-        self._receive_transfer_transaction(self.db.transaction(), transfer_id, user_id)
+        transfer_ref = self.transfers_col.document(transfer_id)
+
+        @firestore.transactional
+        def _receive_transfer_transaction(transaction):
+            transfer_doc = transfer_ref.get(transaction=transaction).to_dict() or {}
+            if transfer_doc.get('status') != 'SHIPPED': raise Exception("Phiếu không ở trạng thái SHIPPED.")
+
+            to_branch = transfer_doc['to_branch_id']
+            for item in transfer_doc['items']:
+                self.update_inventory(item['sku'], to_branch, item['quantity'], transaction)
+            self._update_transfer_status(transaction, transfer_ref, "COMPLETED", user_id, {"completed_at": datetime.now().isoformat(), "completed_by": user_id})
+
+        _receive_transfer_transaction(self.db.transaction())
 
     def get_transfers(self, branch_id: str = None, direction: str = 'all', status: str = None, limit=100):
-        if not branch_id:
-            query = self.transfers_col
-            if status:
-                query = query.where('status', '==', status)
-            # Sắp xếp ở client-side nếu không có index
-            results = [doc.to_dict() for doc in query.limit(limit).stream()]
-            results.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-            return results
-
-        results = []
-        transfer_ids = set()
-
-        queries_to_run = []
-        if direction in ['outgoing', 'all']:
-            q_out = self.transfers_col.where('from_branch_id', '==', branch_id)
-            if status:
-                q_out = q_out.where('status', '==', status)
-            queries_to_run.append(q_out)
-        
-        if direction in ['incoming', 'all']:
-            q_in = self.transfers_col.where('to_branch_id', '==', branch_id)
-            if status:
-                q_in = q_in.where('status', '==', status)
-            queries_to_run.append(q_in)
-
-        for query in queries_to_run:
-            try:
-                docs = query.limit(limit).stream()
-                for doc in docs:
-                    if doc.id not in transfer_ids:
-                        results.append(doc.to_dict())
-                        transfer_ids.add(doc.id)
-            except Exception as e:
-                logging.error(f"Firestore query failed: {e}. This might be due to a missing index.")
-                # Optionally, re-raise or handle more gracefully
-                raise e
-
-        # Sắp xếp kết quả cuối cùng bằng Python
-        results.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        
-        return results[:limit]
+        try:
+            return self.get_transfers_page(branch_id, direction, status, page_size=limit, include_total=False).items
+        except Exception as e:
+            logging.error(f"Firestore query failed: {e}. This might be due to a missing index.")
+            raise e
+
+    def get_transfers_page(self, branch_id: str = None, direction: str = 'all', status: str = None,
+                           page_size: int = DEFAULT_PAGE_SIZE, cursor: str = None, include_total: bool = None) -> Page:
+        """
+        Phiếu chuyển kho theo trang, mới tạo trước.
+        direction: 'outgoing' (chi nhánh gửi), 'incoming' (chi nhánh nhận) hoặc 'all' (cả hai, dùng bộ lọc OR
+        nên chỉ cần một truy vấn và không phải gộp/sắp xếp lại ở client).
+        Cần composite index cho (from_branch_id|to_branch_id, [status], created_at desc) trên stock_transfers.
+        """
+        filters = []
+        if branch_id:
+            outgoing = FieldFilter('from_branch_id', '==', branch_id)
+            incoming = FieldFilter('to_branch_id', '==', branch_id)
+            if direction == 'outgoing':
+                filters.append(outgoing)
+            elif direction == 'incoming':
+                filters.append(incoming)
+            else:
+                filters.append(Or([outgoing, incoming]))
+        if status:
+            filters.append(FieldFilter('status', '==', status))
+
+        query = self.transfers_col
+        if filters:
+            query = query.where(filter=filters[0] if len(filters) == 1 else And(filters))
+        return paginate(
+            self.transfers_col, query, [('created_at', DESCENDING)], page_size, cursor,
+            include_total=include_total, transform=lambda doc: doc.to_dict(),
+        )
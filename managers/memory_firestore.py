@@ -0,0 +1,919 @@
+"""
+Backend Firestore giả lập trong bộ nhớ, dùng cho benchmark và kiểm thử không cần project thật.
+
+Chỉ hỗ trợ phần API mà các manager thực sự dùng:
+collection/document/get/set(merge)/update/delete/create/add, where (kể cả FieldFilter, And, Or),
+order_by/limit/offset/start_after/end_at/select/stream, count/sum/avg, collection_group,
+get_all, batch(), transaction() chạy được với @firestore.transactional (có retry khi Aborted),
+Increment/ArrayUnion/ArrayRemove/SERVER_TIMESTAMP/DELETE_FIELD và on_snapshot cho truy vấn.
+
+Tên các lớp trùng với lớp của google-cloud-firestore để FirestoreMetrics nhận diện được.
+
+    from managers.firebase_client import FirebaseClient
+    fb_client = FirebaseClient.in_memory(latency_ms=5, abort_rate=0.01)
+"""
+import enum
+import functools
+import itertools
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import Aborted, AlreadyExists, NotFound
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.base_query import BaseCompositeFilter, FieldFilter, Or
+
+DOCUMENT_ID = '__name__'
+_MISSING = object()
+
+
+# --------------------------------------------------------------------------
+# GIÁ TRỊ & SO SÁNH
+# --------------------------------------------------------------------------
+
+def _type_rank(value):
+    """Thứ tự kiểu dữ liệu giống Firestore: null < bool < số < thời gian < chuỗi < bytes < reference < mảng < map."""
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, DocumentReference):
+        return 6
+    if isinstance(value, list):
+        return 8
+    if isinstance(value, dict):
+        return 9
+    return 10
+
+
+def _compare(a, b) -> int:
+    rank_a, rank_b = _type_rank(a), _type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if rank_a == 0:
+        return 0
+    if rank_a == 6:
+        a, b = a.path, b.path
+    elif rank_a == 8:
+        for x, y in zip(a, b):
+            result = _compare(x, y)
+            if result:
+                return result
+        a, b = len(a), len(b)
+    elif rank_a == 9:
+        a, b = sorted(a.items()), sorted(b.items())
+    if a == b:
+        return 0
+    return -1 if a < b else 1
+
+
+def _normalize(value):
+    """Chuẩn hóa giá trị khi ghi: datetime không có timezone được coi là UTC (như client thật)."""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _clone(value):
+    if isinstance(value, dict):
+        return {k: _clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clone(v) for v in value]
+    return value
+
+
+def _get_field(data, field_path):
+    current = data
+    for part in field_path.split('.'):
+        if not isinstance(current, dict) or part not in current:
+            return _MISSING
+        current = current[part]
+    return current
+
+
+def _apply_transform(current, value, now):
+    if isinstance(value, transforms.Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        return base + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if item not in result:
+                result.append(_normalize(item))
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        result = list(current) if isinstance(current, list) else []
+        return [item for item in result if item not in value.values]
+    if value is transforms.SERVER_TIMESTAMP:
+        return now
+    return _normalize(value)
+
+
+def _set_field(data, field_path, value, now):
+    parts = field_path.split('.')
+    target = data
+    for part in parts[:-1]:
+        child = target.get(part)
+        if not isinstance(child, dict):
+            child = target[part] = {}
+        target = child
+    if value is transforms.DELETE_FIELD:
+        target.pop(parts[-1], None)
+    else:
+        target[parts[-1]] = _apply_transform(target.get(parts[-1]), value, now)
+
+
+def _merge_into(target, data, now):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_into(target[key], value, now)
+        elif value is transforms.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            target[key] = {}
+            _merge_into(target[key], value, now)
+        else:
+            target[key] = _apply_transform(target.get(key), value, now)
+
+
+def _project(data, field_paths):
+    if field_paths is None:
+        return data
+    projected = {}
+    for path in field_paths:
+        value = _get_field(data, path)
+        if value is not _MISSING:
+            _set_field(projected, path, value, None)
+    return projected
+
+
+# --------------------------------------------------------------------------
+# SNAPSHOT
+# --------------------------------------------------------------------------
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, exists, create_time=None, update_time=None, read_time=None, version=0):
+        self.reference = reference
+        self._data = data
+        self.exists = exists
+        self._version = version
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    def to_dict(self):
+        return _clone(self._data) if self.exists else None
+
+    def get(self, field_path):
+        value = _get_field(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return _clone(value)
+
+
+class ChangeType(enum.Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+
+class DocumentChange:
+    def __init__(self, change_type, document, old_index=-1, new_index=-1):
+        self.type = change_type
+        self.document = document
+        self.old_index = old_index
+        self.new_index = new_index
+
+
+class AggregationResult:
+    def __init__(self, alias, value, read_time=None):
+        self.alias = alias
+        self.value = value
+        self.read_time = read_time
+
+
+class _StoredDocument:
+    __slots__ = ('data', 'version', 'create_time', 'update_time')
+
+    def __init__(self, data, version, now):
+        self.data = data
+        self.version = version
+        self.create_time = now
+        self.update_time = now
+
+
+# --------------------------------------------------------------------------
+# CLIENT
+# --------------------------------------------------------------------------
+
+class Client:
+    """
+    Client Firestore trong bộ nhớ.
+
+    Args:
+        latency_ms: độ trễ giả lập cho mỗi round-trip (get, stream, commit...).
+        jitter_ms: biên độ dao động ngẫu nhiên cộng thêm vào latency_ms.
+        abort_rate: xác suất một transaction bị Aborted khi commit (giả lập tranh chấp),
+            ngoài các xung đột thật giữa các transaction.
+        lock_timeout: thời gian tối đa (giây) một transaction chờ khóa document trước khi bị Aborted.
+
+    Transaction khóa document khi đọc như Firestore server SDK: transaction khác đọc cùng
+    document phải chờ; khi tranh chấp, transaction bắt đầu sau bị hủy (wound-wait) và được
+    @firestore.transactional chạy lại, giữ nguyên thứ tự ưu tiên của lần thử đầu tiên.
+    """
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, abort_rate: float = 0.0,
+                 lock_timeout: float = 30, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.abort_rate = abort_rate
+        self.lock_timeout = lock_timeout
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._lock_released = threading.Condition(self._lock)
+        self._document_locks = {}   # (collection, doc_id) -> Transaction đang giữ khóa
+        self._transaction_sequence = itertools.count(1)
+        self._collections = {}   # đường dẫn collection -> {doc_id: _StoredDocument}
+        self._version = 0
+        self._listeners = []
+        self.rpc_count = 0
+
+    # --- Điều hướng ---
+    def collection(self, *path):
+        return CollectionReference(self, '/'.join(path))
+
+    def document(self, *path):
+        full_path = '/'.join(path)
+        parent, _, doc_id = full_path.rpartition('/')
+        return DocumentReference(self, parent, doc_id)
+
+    def collection_group(self, collection_id):
+        return CollectionGroup(self, collection_id)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return Transaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        if transaction is not None:
+            for ref in references:
+                transaction._acquire(ref._key)
+        self._simulate_rpc()
+        with self._lock:
+            snapshots = [ref._snapshot(field_paths) for ref in references]
+        for snapshot in snapshots:
+            if transaction is not None:
+                transaction._record_read(snapshot)
+            yield snapshot
+
+    def close(self):
+        with self._lock:
+            self._listeners.clear()
+
+    # --- Nội bộ ---
+    def _simulate_rpc(self):
+        self.rpc_count += 1
+        delay = self.latency_ms + (self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _stored(self, collection_path, doc_id):
+        return self._collections.get(collection_path, {}).get(doc_id)
+
+    def _commit(self, writes, transaction=None):
+        """Áp dụng nguyên tử một nhóm thao tác ghi (của batch, transaction hoặc một lệnh ghi đơn)."""
+        self._simulate_rpc()
+        now = datetime.now(timezone.utc)
+        changed = []
+        with self._lock:
+            if transaction is not None:
+                if transaction._wounded:
+                    raise Aborted("Transaction was aborted by an older conflicting transaction.")
+                if self.abort_rate and self._random.random() < self.abort_rate:
+                    raise Aborted("Simulated transaction contention.")
+                for (collection_path, doc_id), version in transaction._read_versions.items():
+                    stored = self._stored(collection_path, doc_id)
+                    if (stored.version if stored else 0) != version:
+                        raise Aborted(f"Document {collection_path}/{doc_id} changed during transaction.")
+
+            # Kiểm tra trước để cả nhóm ghi là nguyên tử
+            pending = {}
+            for op, ref, data, merge in writes:
+                key = (ref._parent_path, ref.id)
+                exists = pending[key] if key in pending else self._stored(*key) is not None
+                if op == 'update' and not exists:
+                    raise NotFound(f"No document to update: {ref.path}")
+                if op == 'create' and exists:
+                    raise AlreadyExists(f"Document already exists: {ref.path}")
+                pending[key] = op != 'delete'
+
+            for op, ref, data, merge in writes:
+                docs = self._collections.setdefault(ref._parent_path, {})
+                stored = docs.get(ref.id)
+                before = _clone(stored.data) if stored else None
+                self._version += 1
+                if op == 'delete':
+                    docs.pop(ref.id, None)
+                    after = None
+                else:
+                    if op == 'update':
+                        new_data = _clone(stored.data)
+                        for field_path, value in data.items():
+                            _set_field(new_data, field_path, value, now)
+                    elif op == 'set' and merge and stored:
+                        new_data = _clone(stored.data)
+                        _merge_into(new_data, data, now)
+                    else:
+                        new_data = {}
+                        _merge_into(new_data, data, now)
+                    if stored:
+                        stored.data = new_data
+                        stored.version = self._version
+                        stored.update_time = now
+                    else:
+                        docs[ref.id] = _StoredDocument(new_data, self._version, now)
+                    after = new_data
+                changed.append((ref, before, after))
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            listener._notify(changed)
+        return [now] * len(writes)
+
+
+# --------------------------------------------------------------------------
+# TRUY VẤN
+# --------------------------------------------------------------------------
+
+class Query:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, client, collection_path=None, group_id=None, filters=(), orders=(),
+                 limit=None, limit_to_last=False, offset=0, start=None, end=None, projection=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._group_id = group_id
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._limit_to_last = limit_to_last
+        self._offset = offset
+        self._start = start
+        self._end = end
+        self._projection = projection
+
+    def _copy(self, **changes):
+        params = dict(
+            collection_path=self._collection_path, group_id=self._group_id, filters=self._filters,
+            orders=self._orders, limit=self._limit, limit_to_last=self._limit_to_last, offset=self._offset,
+            start=self._start, end=self._end, projection=self._projection,
+        )
+        params.update(changes)
+        return Query(self._client, **params)
+
+    # --- Xây dựng truy vấn ---
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        new_filter = filter if filter is not None else FieldFilter(field_path, op_string, value)
+        return self._copy(filters=self._filters + (new_filter,))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((str(field_path), direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count, limit_to_last=False)
+
+    def limit_to_last(self, count):
+        return self._copy(limit=count, limit_to_last=True)
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def start_at(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, True))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, False))
+
+    def end_at(self, document_fields_or_snapshot):
+        return self._copy(end=(document_fields_or_snapshot, True))
+
+    def end_before(self, document_fields_or_snapshot):
+        return self._copy(end=(document_fields_or_snapshot, False))
+
+    def count(self, alias=None):
+        return AggregationQuery(self)._add('count', None, alias)
+
+    def sum(self, field_ref, alias=None):
+        return AggregationQuery(self)._add('sum', str(field_ref), alias)
+
+    def avg(self, field_ref, alias=None):
+        return AggregationQuery(self)._add('avg', str(field_ref), alias)
+
+    # --- Thực thi ---
+    def stream(self, transaction=None, **kwargs):
+        self._client._simulate_rpc()
+        snapshots = self._execute()
+        for snapshot in snapshots:
+            if transaction is not None:
+                transaction._record_read(snapshot)
+            yield snapshot
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream(transaction=transaction))
+
+    def on_snapshot(self, callback):
+        return Watch(self, callback)
+
+    def _execute(self, apply_window=True):
+        client = self._client
+        with client._lock:
+            candidates = []
+            for collection_path, docs in client._collections.items():
+                if not self._covers(collection_path):
+                    continue
+                for doc_id, stored in docs.items():
+                    if self._matches(doc_id, stored.data):
+                        candidates.append((collection_path, doc_id, stored))
+            orders = self._effective_orders()
+            candidates.sort(key=functools.cmp_to_key(
+                lambda a, b: self._compare_docs(orders, a[1], a[2].data, b[1], b[2].data)
+            ))
+            if apply_window:
+                candidates = self._apply_window(orders, candidates)
+            return [
+                DocumentSnapshot(
+                    DocumentReference(client, collection_path, doc_id),
+                    _project(_clone(stored.data), self._projection), True,
+                    stored.create_time, stored.update_time, version=stored.version,
+                )
+                for collection_path, doc_id, stored in candidates
+            ]
+
+    def _covers(self, collection_path):
+        if self._group_id is not None:
+            return collection_path.rsplit('/', 1)[-1] == self._group_id
+        return collection_path == self._collection_path
+
+    def _matches(self, doc_id, data):
+        if not all(_filter_matches(f, doc_id, data) for f in self._filters):
+            return False
+        # Firestore bỏ qua các document không có trường dùng để sắp xếp
+        return all(
+            field == DOCUMENT_ID or _get_field(data, field) is not _MISSING
+            for field, _ in self._orders
+        )
+
+    def _effective_orders(self):
+        orders = list(self._orders)
+        if not orders:
+            inequality = next((f.field_path for f in _flatten(self._filters)
+                               if f.op_string in ('<', '<=', '>', '>=', '!=', 'not-in')), None)
+            if inequality and inequality != DOCUMENT_ID:
+                orders.append((inequality, Query.ASCENDING))
+        if not any(field == DOCUMENT_ID for field, _ in orders):
+            last_direction = orders[-1][1] if orders else Query.ASCENDING
+            orders.append((DOCUMENT_ID, last_direction))
+        return orders
+
+    @staticmethod
+    def _sort_value(field, doc_id, data):
+        return doc_id if field == DOCUMENT_ID else _get_field(data, field)
+
+    def _compare_docs(self, orders, id_a, data_a, id_b, data_b):
+        for field, direction in orders:
+            result = _compare(self._sort_value(field, id_a, data_a), self._sort_value(field, id_b, data_b))
+            if result:
+                return -result if direction == Query.DESCENDING else result
+        return 0
+
+    def _cursor_values(self, cursor, orders):
+        if isinstance(cursor, DocumentSnapshot):
+            return [self._sort_value(field, cursor.id, cursor._data) for field, _ in orders]
+        if isinstance(cursor, dict):
+            return [cursor[field] for field, _ in orders if field in cursor]
+        return list(cursor)
+
+    def _compare_to_cursor(self, orders, doc_id, data, values):
+        for (field, direction), cursor_value in zip(orders, values):
+            if field == DOCUMENT_ID and isinstance(cursor_value, (DocumentReference, DocumentSnapshot)):
+                cursor_value = cursor_value.id
+            result = _compare(self._sort_value(field, doc_id, data), cursor_value)
+            if result:
+                return -result if direction == Query.DESCENDING else result
+        return 0
+
+    def _apply_window(self, orders, candidates):
+        if self._start is not None:
+            values = self._cursor_values(self._start[0], orders)
+            inclusive = self._start[1]
+            candidates = [
+                c for c in candidates
+                if (lambda r: r > 0 or (inclusive and r == 0))(self._compare_to_cursor(orders, c[1], c[2].data, values))
+            ]
+        if self._end is not None:
+            values = self._cursor_values(self._end[0], orders)
+            inclusive = self._end[1]
+            candidates = [
+                c for c in candidates
+                if (lambda r: r < 0 or (inclusive and r == 0))(self._compare_to_cursor(orders, c[1], c[2].data, values))
+            ]
+        if self._offset:
+            candidates = candidates[self._offset:]
+        if self._limit is not None:
+            candidates = candidates[-self._limit:] if self._limit_to_last else candidates[:self._limit]
+        return candidates
+
+
+def _flatten(filters):
+    for f in filters:
+        if isinstance(f, BaseCompositeFilter):
+            yield from _flatten(f.filters)
+        else:
+            yield f
+
+
+def _filter_matches(f, doc_id, data) -> bool:
+    if isinstance(f, BaseCompositeFilter):
+        results = (_filter_matches(sub, doc_id, data) for sub in f.filters)
+        return any(results) if isinstance(f, Or) else all(results)
+
+    field, op, expected = str(f.field_path), f.op_string, f.value
+    if field == DOCUMENT_ID:
+        actual = doc_id
+        normalize_id = lambda v: v.id if isinstance(v, DocumentReference) else str(v).rsplit('/', 1)[-1]
+        expected = [normalize_id(v) for v in expected] if op in ('in', 'not-in') else normalize_id(expected)
+    else:
+        actual = _get_field(data, field)
+        if actual is _MISSING:
+            return False
+        expected = _normalize(expected)
+
+    if op == '==':
+        return _type_rank(actual) == _type_rank(expected) and _compare(actual, expected) == 0
+    if op == '!=':
+        return actual is not None and not (_type_rank(actual) == _type_rank(expected) and _compare(actual, expected) == 0)
+    if op in ('<', '<=', '>', '>='):
+        if _type_rank(actual) != _type_rank(expected):
+            return False
+        result = _compare(actual, expected)
+        return {'<': result < 0, '<=': result <= 0, '>': result > 0, '>=': result >= 0}[op]
+    if op == 'in':
+        return any(_type_rank(actual) == _type_rank(v) and _compare(actual, v) == 0 for v in expected)
+    if op == 'not-in':
+        return actual is not None and not any(_type_rank(actual) == _type_rank(v) and _compare(actual, v) == 0 for v in expected)
+    if op == 'array_contains':
+        return isinstance(actual, list) and expected in actual
+    if op == 'array_contains_any':
+        return isinstance(actual, list) and any(v in actual for v in expected)
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, collection_path=path)
+        self._path = path
+
+    @property
+    def id(self):
+        return self._path.rsplit('/', 1)[-1]
+
+    @property
+    def path(self):
+        return self._path
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, self._path, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        write_times = self._client._commit([('create', ref, document_data, False)])
+        return write_times[0], ref
+
+    def list_documents(self, page_size=None):
+        with self._client._lock:
+            doc_ids = list(self._client._collections.get(self._path, {}))
+        return [self.document(doc_id) for doc_id in doc_ids]
+
+
+class CollectionGroup(Query):
+    def __init__(self, client, group_id):
+        super().__init__(client, group_id=group_id)
+
+
+class AggregationQuery:
+    def __init__(self, query):
+        self._query = query
+        self._aggregations = []
+
+    def _add(self, kind, field, alias):
+        self._aggregations.append((kind, field, alias or f"field_{len(self._aggregations) + 1}"))
+        return self
+
+    def count(self, alias=None):
+        return self._add('count', None, alias)
+
+    def sum(self, field_ref, alias=None):
+        return self._add('sum', str(field_ref), alias)
+
+    def avg(self, field_ref, alias=None):
+        return self._add('avg', str(field_ref), alias)
+
+    def get(self, transaction=None, **kwargs):
+        self._query._client._simulate_rpc()
+        # Giới hạn (limit/cursor) áp dụng trước khi tổng hợp, như Firestore
+        snapshots = self._query._execute()
+        results = []
+        for kind, field, alias in self._aggregations:
+            if kind == 'count':
+                value = len(snapshots)
+            else:
+                numbers = [
+                    v for v in (_get_field(s._data, field) for s in snapshots)
+                    if isinstance(v, (int, float)) and not isinstance(v, bool)
+                ]
+                if kind == 'sum':
+                    value = sum(numbers)
+                else:
+                    value = sum(numbers) / len(numbers) if numbers else None
+            results.append(AggregationResult(alias, value, datetime.now(timezone.utc)))
+        return [results]
+
+    def stream(self, transaction=None, **kwargs):
+        yield from self.get(transaction=transaction)
+
+
+class DocumentReference:
+    def __init__(self, client, parent_path, document_id):
+        self._client = client
+        self._parent_path = parent_path
+        self.id = document_id
+
+    @property
+    def path(self):
+        return f"{self._parent_path}/{self.id}"
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self._parent_path)
+
+    @property
+    def _key(self):
+        return (self._parent_path, self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def collection(self, collection_id):
+        return CollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def _snapshot(self, field_paths=None):
+        stored = self._client._stored(self._parent_path, self.id)
+        if stored is None:
+            return DocumentSnapshot(self, None, False)
+        data = _project(_clone(stored.data), field_paths)
+        return DocumentSnapshot(self, data, True, stored.create_time, stored.update_time, version=stored.version)
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        if transaction is not None:
+            transaction._acquire(self._key)
+        self._client._simulate_rpc()
+        with self._client._lock:
+            snapshot = self._snapshot(field_paths)
+        if transaction is not None:
+            transaction._record_read(snapshot)
+        return snapshot
+
+    def set(self, document_data, merge=False):
+        return self._client._commit([('set', self, document_data, merge)])[0]
+
+    def update(self, field_updates):
+        return self._client._commit([('update', self, field_updates, False)])[0]
+
+    def create(self, document_data):
+        return self._client._commit([('create', self, document_data, False)])[0]
+
+    def delete(self):
+        return self._client._commit([('delete', self, None, False)])[0]
+
+
+# --------------------------------------------------------------------------
+# GHI THEO LÔ & TRANSACTION
+# --------------------------------------------------------------------------
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+
+    def update(self, reference, field_updates):
+        self._writes.append(('update', reference, field_updates, False))
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, False))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, False))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes) if writes else []
+
+    def __len__(self):
+        return len(self._writes)
+
+
+class Transaction(WriteBatch):
+    """
+    Transaction khóa bi quan: document bị khóa từ lúc đọc tới khi commit/rollback.
+    Hiện thực giao thức mà @firestore.transactional sử dụng
+    (_begin, _commit, _rollback, _clean_up, _id, _max_attempts, _read_only).
+    """
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._priority = None
+        self._wounded = False
+        self._locked = set()
+        self._read_versions = {}
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    @property
+    def id(self):
+        return self._id
+
+    def _begin(self, retry_id=None):
+        if self.in_progress:
+            raise ValueError("Transaction already in progress.")
+        self._id = uuid.uuid4().bytes
+        # Lần thử lại giữ thứ tự ưu tiên của lần đầu, nên không bị transaction mới chen ngang mãi
+        if retry_id is None or self._priority is None:
+            self._priority = next(self._client._transaction_sequence)
+        self._wounded = False
+
+    def _clean_up(self):
+        self._release_locks()
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        if not self.in_progress:
+            raise ValueError("Transaction not in progress.")
+        try:
+            if self._writes or self._read_versions:
+                return self._client._commit(self._writes, transaction=self)
+            return []
+        finally:
+            self._clean_up()
+
+    def _acquire(self, key):
+        if self._writes:
+            raise ValueError("Transactions require all reads to be executed before all writes.")
+        client = self._client
+        deadline = time.monotonic() + client.lock_timeout
+        with client._lock_released:
+            while True:
+                owner = client._document_locks.get(key)
+                if owner is None or owner is self:
+                    break
+                if owner._priority > self._priority:
+                    # wound-wait: transaction bắt đầu sau nhường khóa và sẽ bị Aborted khi commit
+                    owner._wound()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Aborted(f"Timed out waiting for lock on {key[0]}/{key[1]}.")
+                client._lock_released.wait(remaining)
+            client._document_locks[key] = self
+            self._locked.add(key)
+
+    def _wound(self):
+        self._wounded = True
+        self._release_locks()
+
+    def _release_locks(self):
+        client = self._client
+        with client._lock_released:
+            for key in self._locked:
+                if client._document_locks.get(key) is self:
+                    del client._document_locks[key]
+            self._locked = set()
+            client._lock_released.notify_all()
+
+    def _record_read(self, snapshot):
+        key = snapshot.reference._key
+        self._acquire(key)
+        self._read_versions.setdefault(key, snapshot._version)
+
+    def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, DocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references, **kwargs):
+        return self._client.get_all(references, transaction=self, **kwargs)
+
+    def commit(self):
+        raise ValueError("Use @firestore.transactional to commit a transaction.")
+
+
+# --------------------------------------------------------------------------
+# LISTENER
+# --------------------------------------------------------------------------
+
+class Watch:
+    """Listener on_snapshot cho truy vấn; callback được gọi đồng bộ ngay sau mỗi lần commit."""
+    def __init__(self, query, callback):
+        self._query = query
+        self._callback = callback
+        self._known = {}
+        self.is_active = True
+        client = query._client
+        with client._lock:
+            snapshots = query._execute()
+            for snapshot in snapshots:
+                self._known[snapshot.reference.path] = snapshot
+            client._listeners.append(self)
+        changes = [DocumentChange(ChangeType.ADDED, s, -1, i) for i, s in enumerate(snapshots)]
+        self._callback(snapshots, changes, datetime.now(timezone.utc))
+
+    def unsubscribe(self):
+        client = self._query._client
+        with client._lock:
+            if self in client._listeners:
+                client._listeners.remove(self)
+        self.is_active = False
+
+    close = unsubscribe
+
+    def _notify(self, changed):
+        query = self._query
+        has_window = query._limit is not None or query._offset or query._start or query._end
+        relevant = [c for c in changed if query._covers(c[0]._parent_path)]
+        if not relevant or not self.is_active:
+            return
+
+        changes = []
+        if has_window:
+            # Truy vấn có giới hạn: tính lại toàn bộ kết quả rồi so sánh
+            current = {s.reference.path: s for s in query._execute()}
+            for path, snapshot in current.items():
+                if path not in self._known:
+                    changes.append(DocumentChange(ChangeType.ADDED, snapshot))
+                elif snapshot.update_time != self._known[path].update_time:
+                    changes.append(DocumentChange(ChangeType.MODIFIED, snapshot))
+            for path, snapshot in self._known.items():
+                if path not in current:
+                    changes.append(DocumentChange(ChangeType.REMOVED, snapshot))
+            self._known = current
+        else:
+            for ref, before, after in relevant:
+                was_member = ref.path in self._known
+                is_member = after is not None and query._matches(ref.id, after)
+                if is_member:
+                    with query._client._lock:
+                        snapshot = ref._snapshot(query._projection)
+                    self._known[ref.path] = snapshot
+                    changes.append(DocumentChange(ChangeType.MODIFIED if was_member else ChangeType.ADDED, snapshot))
+                elif was_member:
+                    changes.append(DocumentChange(ChangeType.REMOVED, self._known.pop(ref.path)))
+        if changes:
+            self._callback(list(self._known.values()), changes, datetime.now(timezone.utc))
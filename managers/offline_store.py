@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# Chờ giữa hai lần thử đồng bộ một đơn lỗi (tăng dần theo số lần thử, tối đa MAX_RETRY_DELAY_SECONDS)
+BASE_RETRY_DELAY_SECONDS = 5
+MAX_RETRY_DELAY_SECONDS = 300
+# Bản sao catalog của chi nhánh được ghi lại tối đa một lần trong khoảng này
+REPLICA_REFRESH_SECONDS = 300
+# Số dòng tối đa giữ lại trong bản sao gom dần (VD: khách hàng đã tìm thấy tại quầy), mới nhất trước
+REPLICA_MAX_MERGED_ROWS = 2000
+FLUSH_INTERVAL_SECONDS = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS order_outbox (
+    order_id TEXT PRIMARY KEY,           -- khóa idempotency: mỗi đơn chỉ được ghi lên Firestore một lần
+    branch_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'PENDING',  -- PENDING, SYNCED
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    synced_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_pending ON order_outbox (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS branch_replica (
+    branch_id TEXT NOT NULL,
+    kind TEXT NOT NULL,                  -- 'catalog', 'customers'
+    data TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    PRIMARY KEY (branch_id, kind)
+);
+CREATE TABLE IF NOT EXISTS order_sequences (
+    counter_id TEXT PRIMARY KEY,         -- '{branch}-{yymmdd}', cùng khóa với order_counters trên Firestore
+    next_seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class OfflineStore:
+    """
+    Lưu trữ cục bộ (SQLite, chế độ WAL) cho chế độ bán hàng offline của chi nhánh:
+
+    - order_outbox: đơn hàng đã chốt tại quầy nhưng chưa ghi lên Firestore. Thanh toán chỉ cần
+      ghi một dòng xuống đĩa; OutboxFlusher đẩy dần lên Firestore khi có mạng.
+    - branch_replica: bản chụp catalog (giá, tồn kho) và các khách hàng đã tìm thấy tại quầy của chi nhánh,
+      dùng khi khởi động lại trang POS lúc mất kết nối.
+    - order_sequences: số thứ tự mã đơn cấp tại máy (xem OrderIdAllocator), kèm terminal_id
+      ngẫu nhiên sinh một lần cho mỗi file để mã đơn của các quầy khác nhau không trùng.
+    """
+    def __init__(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # FULL: đơn đã báo thành công cho thu ngân không mất kể cả khi mất điện
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO store_meta (key, value) VALUES ('terminal_id', ?)", (uuid.uuid4().hex[:8].upper(),)
+        )
+        self.terminal_id = self._conn.execute("SELECT value FROM store_meta WHERE key = 'terminal_id'").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --------------------------------------------------------------------------
+    # OUTBOX
+    # --------------------------------------------------------------------------
+
+    def enqueue_order(self, order_id: str, branch_id: str, payload: dict) -> bool:
+        """Ghi đơn vào outbox. Trả về False nếu đơn với order_id này đã có (không ghi đè)."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO order_outbox (order_id, branch_id, payload, created_at) VALUES (?, ?, ?, ?)",
+                (order_id, branch_id, json.dumps(payload, ensure_ascii=False), datetime.now().isoformat()),
+            )
+            return cursor.rowcount == 1
+
+    def get_due_orders(self, limit: int = 50) -> list:
+        """Các đơn PENDING đã tới lượt đồng bộ, cũ nhất trước: [(order_id, payload, attempts)]."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT order_id, payload, attempts FROM order_outbox "
+                "WHERE status = 'PENDING' AND next_attempt_at <= ? ORDER BY created_at LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+        return [(order_id, json.loads(payload), attempts) for order_id, payload, attempts in rows]
+
+    def mark_synced(self, order_id: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE order_outbox SET status = 'SYNCED', synced_at = ?, last_error = NULL WHERE order_id = ?",
+                (datetime.now().isoformat(), order_id),
+            )
+
+    def mark_failed(self, order_id: str, error: str):
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM order_outbox WHERE order_id = ?", (order_id,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            delay = min(BASE_RETRY_DELAY_SECONDS * (2 ** (attempts - 1)), MAX_RETRY_DELAY_SECONDS)
+            self._conn.execute(
+                "UPDATE order_outbox SET attempts = ?, last_error = ?, next_attempt_at = ? WHERE order_id = ?",
+                (attempts, error[:500], time.time() + delay, order_id),
+            )
+
+    def count_pending(self, branch_id: str = None) -> int:
+        query = "SELECT COUNT(*) FROM order_outbox WHERE status = 'PENDING'"
+        params = ()
+        if branch_id:
+            query += " AND branch_id = ?"
+            params = (branch_id,)
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def get_pending_quantities(self, branch_id: str) -> dict:
+        """Tổng số lượng {sku: số lượng} trong các đơn chưa đồng bộ của chi nhánh (để trừ vào tồn kho hiển thị)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM order_outbox WHERE status = 'PENDING' AND branch_id = ?", (branch_id,)
+            ).fetchall()
+        quantities = {}
+        for (payload,) in rows:
+            for item in json.loads(payload).get('order', {}).get('items', []):
+                quantities[item['sku']] = quantities.get(item['sku'], 0) + item['quantity']
+        return quantities
+
+    def next_sequence(self, counter_id: str) -> int:
+        """Số thứ tự kế tiếp (bắt đầu từ 1) của counter tại máy này; ghi xuống đĩa trước khi trả về."""
+        with self._lock:
+            return self._conn.execute(
+                "INSERT INTO order_sequences (counter_id, next_seq) VALUES (?, 2) "
+                "ON CONFLICT (counter_id) DO UPDATE SET next_seq = next_seq + 1 RETURNING next_seq - 1",
+                (counter_id,),
+            ).fetchone()[0]
+
+    # --------------------------------------------------------------------------
+    # BẢN SAO DỮ LIỆU CHI NHÁNH
+    # --------------------------------------------------------------------------
+
+    def save_replica(self, branch_id: str, kind: str, rows: list, force: bool = False):
+        """Ghi bản chụp dữ liệu của chi nhánh (bỏ qua nếu bản hiện có mới hơn REPLICA_REFRESH_SECONDS)."""
+        now = time.time()
+        with self._lock:
+            if not force:
+                row = self._conn.execute(
+                    "SELECT saved_at FROM branch_replica WHERE branch_id = ? AND kind = ?", (branch_id, kind)
+                ).fetchone()
+                if row and now - row[0] < REPLICA_REFRESH_SECONDS:
+                    return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO branch_replica (branch_id, kind, data, saved_at) VALUES (?, ?, ?, ?)",
+                (branch_id, kind, json.dumps(rows, ensure_ascii=False, default=str), now),
+            )
+
+    def merge_replica(self, branch_id: str, kind: str, rows: list, key: str = 'id',
+                      max_rows: int = REPLICA_MAX_MERGED_ROWS):
+        """
+        Gộp rows vào bản sao hiện có (trùng key thì thay bằng bản mới), dòng mới nhất đứng trước
+        và chỉ giữ max_rows dòng. Dùng cho dữ liệu quá lớn để chụp toàn bộ, như khách hàng.
+        """
+        if not rows:
+            return
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM branch_replica WHERE branch_id = ? AND kind = ?", (branch_id, kind)
+            ).fetchone()
+            latest_keys = {r[key] for r in rows}
+            existing = [r for r in (json.loads(row[0]) if row else []) if r.get(key) not in latest_keys]
+            merged = (list(rows) + existing)[:max_rows]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO branch_replica (branch_id, kind, data, saved_at) VALUES (?, ?, ?, ?)",
+                (branch_id, kind, json.dumps(merged, ensure_ascii=False, default=str), time.time()),
+            )
+
+    def load_replica(self, branch_id: str, kind: str):
+        """(rows, thời điểm lưu) của bản chụp gần nhất, hoặc (None, None) nếu chưa có."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, saved_at FROM branch_replica WHERE branch_id = ? AND kind = ?", (branch_id, kind)
+            ).fetchone()
+        if not row:
+            return None, None
+        return json.loads(row[0]), datetime.fromtimestamp(row[1])
+
+
+class OutboxFlusher:
+    """Luồng nền đẩy các đơn trong outbox lên Firestore qua POSManager.flush_outbox()."""
+    def __init__(self, pos_mgr, interval: float = FLUSH_INTERVAL_SECONDS):
+        self.pos_mgr = pos_mgr
+        self.interval = interval
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="order-outbox-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        """Đồng bộ ngay (VD: vừa có đơn mới) thay vì chờ hết chu kỳ."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.pos_mgr.flush_outbox()
+            except Exception as e:
+                logging.error(f"Order outbox flush failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
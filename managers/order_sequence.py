@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from google.cloud import firestore
+
+# Số thứ tự cấp cho mỗi lần đọc counter; các đơn trong block không phải ghi vào counter,
+# nên các quầy chỉ tranh chấp counter một lần mỗi ORDER_ID_BLOCK_SIZE đơn.
+# Số còn thừa khi process khởi động lại sẽ bị bỏ (dãy số có thể có khoảng trống).
+ORDER_ID_BLOCK_SIZE = 20
+SEQUENCE_DIGITS = 6
+# Sau một lần xin block lỗi, chi nhánh dùng mã ngẫu nhiên trong khoảng này thay vì gọi lại Firestore
+# ở mỗi lần thanh toán (mỗi lần gọi khi mất mạng phải chờ hết timeout)
+ALLOCATION_RETRY_SECONDS = 30
+
+
+def order_id_prefix(branch_id: str, day: date) -> str:
+    """Tiền tố chung của mọi mã đơn trong ngày của chi nhánh: '{branch}-{yymmdd}-'."""
+    return f"{branch_id}-{day.strftime('%y%m%d')}-"
+
+
+def order_id_range(branch_id: str, start_day: date, end_day: date = None) -> tuple:
+    """
+    (start, end) để quét các đơn của chi nhánh từ start_day đến hết end_day theo khoảng document ID:
+    start <= id < end. Ngày là ngày local lúc tạo đơn (cùng quy ước với created_at).
+    """
+    end_day = end_day or start_day
+    return order_id_prefix(branch_id, start_day), order_id_prefix(branch_id, end_day + timedelta(days=1))
+
+
+class OrderIdAllocator:
+    """
+    Cấp mã đơn hàng '{branch}-{yymmdd}-{seq:06d}' với số thứ tự tăng dần theo chi nhánh và ngày.
+
+    Counter nằm ở order_counters/{branch}-{yymmdd} (field next_seq). Mỗi process xin một block
+    ORDER_ID_BLOCK_SIZE số bằng một transaction rồi cấp dần trong bộ nhớ. Trong cùng chi nhánh,
+    mã đơn sắp xếp theo thứ tự tạo (các quầy khác nhau cấp xen kẽ theo từng block), nên đơn của
+    một ngày có thể đọc bằng quét khoảng document ID thay vì composite index branch_id + created_at.
+
+    Có offline_store (chế độ offline của chi nhánh): số thứ tự cấp tại máy từ SQLite, không gọi Firestore
+    khi thanh toán; mã đơn có dạng '{branch}-{yymmdd}-{terminal_id}-{seq:06d}' để không trùng giữa các quầy.
+    """
+    def __init__(self, db, block_size: int = ORDER_ID_BLOCK_SIZE, offline_store=None):
+        self.db = db
+        self.counters_col = db.collection('order_counters')
+        self.block_size = block_size
+        self.offline_store = offline_store
+        self._lock = threading.Lock()
+        self._blocks = {}      # branch_id -> [counter id, số kế tiếp, số cuối của block + 1]
+        self._allocating = {}  # branch_id -> Event của lần xin block đang chạy
+        self._retry_at = {}    # branch_id -> thời điểm (monotonic) được xin block lại sau lần lỗi
+
+    def next_id(self, branch_id: str, now: datetime = None) -> str:
+        """
+        Mã đơn kế tiếp của chi nhánh. Khi không xin được block mới (mất kết nối), dùng hậu tố
+        ngẫu nhiên: mã vẫn cùng tiền tố ngày nên vẫn nằm trong khoảng quét, chỉ không theo thứ tự.
+        Transaction xin block chạy ngoài lock: chi nhánh khác không phải chờ, cùng chi nhánh thì
+        chỉ một lần xin tại một thời điểm.
+        """
+        prefix = order_id_prefix(branch_id, (now or datetime.now()).date())
+        counter_id = prefix[:-1]
+        if self.offline_store is not None:
+            try:
+                sequence = self.offline_store.next_sequence(counter_id)
+                return f"{prefix}{self.offline_store.terminal_id}-{sequence:0{SEQUENCE_DIGITS}d}"
+            except Exception as e:
+                logging.warning(f"Cannot allocate local order sequence for {counter_id}, using random id: {e}")
+                return self._random_id(prefix)
+
+        while True:
+            with self._lock:
+                block = self._blocks.get(branch_id)
+                # Còn số trong block của ngày hiện tại
+                if block is not None and block[0] == counter_id and block[1] < block[2]:
+                    sequence = block[1]
+                    block[1] += 1
+                    return f"{prefix}{sequence:0{SEQUENCE_DIGITS}d}"
+                if time.monotonic() < self._retry_at.get(branch_id, 0):
+                    return self._random_id(prefix)
+                in_flight = self._allocating.get(branch_id)
+                if in_flight is None:
+                    in_flight = self._allocating[branch_id] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+
+            if not owner:
+                # Chờ lần xin block đang chạy rồi thử lấy số từ block đó
+                in_flight.wait()
+                continue
+
+            try:
+                block = [counter_id, *self._allocate_block(counter_id)]
+            except Exception as e:
+                logging.warning(f"Cannot allocate order sequence for {counter_id}, using random id: {e}")
+                block = None
+            with self._lock:
+                if block is not None:
+                    self._blocks[branch_id] = block
+                    self._retry_at.pop(branch_id, None)
+                else:
+                    self._retry_at[branch_id] = time.monotonic() + ALLOCATION_RETRY_SECONDS
+                del self._allocating[branch_id]
+            in_flight.set()
+            if block is None:
+                return self._random_id(prefix)
+
+    @staticmethod
+    def _random_id(prefix: str) -> str:
+        return f"{prefix}{uuid.uuid4().hex[:SEQUENCE_DIGITS].upper()}"
+
+    def _allocate_block(self, counter_id: str) -> list:
+        counter_ref = self.counters_col.document(counter_id)
+        block_size = self.block_size
+
+        @firestore.transactional
+        def _allocate(transaction):
+            snapshot = counter_ref.get(transaction=transaction)
+            start = (snapshot.to_dict() or {}).get('next_seq', 1) if snapshot.exists else 1
+            transaction.set(counter_ref, {'next_seq': start + block_size, 'updated_at': datetime.now().isoformat()}, merge=True)
+            return [start, start + block_size]
+
+        return _allocate(self.db.transaction())
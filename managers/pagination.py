@@ -0,0 +1,93 @@
+import base64
+import logging
+
+from google.cloud import firestore
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+ASCENDING = firestore.Query.ASCENDING
+DESCENDING = firestore.Query.DESCENDING
+
+
+class Page:
+    """
+    Một trang kết quả của truy vấn danh sách.
+
+    items: danh sách dict của trang hiện tại.
+    next_cursor: chuỗi để lấy trang kế tiếp (None nếu đã hết).
+    total_estimate: tổng số bản ghi khớp truy vấn (chỉ tính ở trang đầu, có thể None).
+    """
+    def __init__(self, items: list, next_cursor: str = None, total_estimate: int = None, page_size: int = DEFAULT_PAGE_SIZE):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.total_estimate = total_estimate
+        self.page_size = page_size
+
+    @property
+    def has_more(self) -> bool:
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def encode_cursor(doc_id: str) -> str:
+    return base64.urlsafe_b64encode(doc_id.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> str:
+    return base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+
+
+def paginate(collection_ref, query, order_by: list, page_size: int = DEFAULT_PAGE_SIZE, cursor: str = None,
+             include_total: bool = None, transform=None) -> Page:
+    """
+    Lấy một trang của query theo cursor (start_after trên document cuối của trang trước).
+
+    Args:
+        collection_ref: collection chứa document, dùng để đọc lại document của cursor.
+        query: truy vấn đã có điều kiện where (chưa order_by/limit).
+        order_by: danh sách (field, direction) — cần có index tương ứng trên Firestore.
+        include_total: có đếm tổng số bản ghi bằng count() hay không (mặc định: chỉ ở trang đầu).
+        transform: hàm (snapshot) -> dict để dựng phần tử; mặc định {"id": doc.id, **doc.to_dict()}.
+    """
+    page_size = max(1, min(int(page_size or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    if include_total is None:
+        include_total = cursor is None
+
+    total_estimate = None
+    if include_total:
+        try:
+            total_estimate = query.count().get()[0][0].value
+        except Exception as e:
+            logging.warning(f"Cannot count query results: {e}")
+
+    page_query = query
+    for field, direction in order_by:
+        page_query = page_query.order_by(field, direction=direction)
+    if cursor:
+        cursor_snapshot = collection_ref.document(decode_cursor(cursor)).get()
+        if cursor_snapshot.exists:
+            page_query = page_query.start_after(cursor_snapshot)
+        else:
+            logging.warning("Pagination cursor document no longer exists, restarting from the first page.")
+
+    # Lấy dư 1 document để biết còn trang sau hay không
+    docs = list(page_query.limit(page_size + 1).stream())
+    has_more = len(docs) > page_size
+    docs = docs[:page_size]
+
+    transform = transform or (lambda doc: {"id": doc.id, **doc.to_dict()})
+    return Page(
+        items=[transform(doc) for doc in docs],
+        next_cursor=encode_cursor(docs[-1].id) if has_more else None,
+        total_estimate=total_estimate,
+        page_size=page_size,
+    )
@@ -2,45 +2,131 @@
 from google.cloud import firestore
 import streamlit as st
 from datetime import datetime
-import uuid
+import logging
+import re
+import time
+from google.api_core import exceptions as google_exceptions
 from .cost_manager import CostManager
 from .price_manager import PriceManager
+from .cart_state import CartState
+from .inventory_manager import InsufficientStockError
+from .order_sequence import OrderIdAllocator, order_id_range
+from .daily_sales import DailySalesRollup
+from .report_cache import ReportInvalidations
+from .offline_store import OfflineStore
+
+# Giá trị mặc định của tham số active_promo: chưa được đọc sẵn (None nghĩa là không có chương trình)
+_NOT_LOADED = object()
+# Sau một lần ghi đơn lỗi do mất kết nối, các đơn tiếp theo vào thẳng outbox trong khoảng này
+# (không chờ timeout của Firestore ở mỗi lần thanh toán); đồng bộ outbox thành công thì thử lại ngay
+OFFLINE_RETRY_SECONDS = 30
+# Số lần cấp lại mã khi mã đơn trùng với một đơn khác (hậu tố ngẫu nhiên lúc không cấp được số thứ tự)
+ORDER_ID_ATTEMPTS = 3
+# Lỗi cho thấy không tới được Firestore (khác với lỗi nghiệp vụ như thiếu hàng)
+_CONNECTION_ERRORS = (
+    google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded, google_exceptions.RetryError,
+    ConnectionError, TimeoutError,
+)
+
+# Mã quét có thể kèm số lượng ở đầu: "3*SKU" hoặc "3 * 8931234567890"
+_SCAN_PATTERN = re.compile(r'^\s*(?:(\d+)\s*\*\s*)?(\S+)\s*$')
+MAX_SCAN_QUANTITY = 9999
 
 class POSManager:
-    def __init__(self, firebase_client, inventory_mgr, customer_mgr, promotion_mgr, cost_mgr: CostManager, price_mgr: PriceManager):
+    def __init__(self, firebase_client, inventory_mgr, customer_mgr, promotion_mgr, cost_mgr: CostManager, price_mgr: PriceManager,
+                 offline_store: OfflineStore = None):
         self.db = firebase_client.db
         self.inventory_mgr = inventory_mgr
         self.customer_mgr = customer_mgr
         self.promotion_mgr = promotion_mgr
         self.cost_mgr = cost_mgr
         self.price_mgr = price_mgr
+        # Chế độ offline của chi nhánh: đơn được ghi vào outbox SQLite rồi đồng bộ nền
+        self.offline_store = offline_store
+        self.outbox_flusher = None
+        self._offline_until = 0  # thời điểm (monotonic) thử ghi đơn trực tiếp lại sau lần mất kết nối
         self.orders_collection = self.db.collection('orders')
+        self.order_ids = OrderIdAllocator(self.db, offline_store=offline_store)
+        self.daily_sales = DailySalesRollup(self.db)
+        self.report_invalidations = ReportInvalidations(self.db)
 
     # --------------------------------------------------------------------------
     # HÀM QUẢN LÝ GIỎ HÀNG
     # --------------------------------------------------------------------------
 
-    def add_item_to_cart(self, branch_id: str, product_data: dict, stock_quantity: int):
-        sku = product_data['sku']
-        current_price = self.price_mgr.get_current_price_for_sku(branch_id, sku)
+    def add_item_to_cart(self, branch_id: str, product_data: dict, stock_quantity: int, quantity: int = 1):
+        self.add_items_to_cart(branch_id, [(product_data, stock_quantity, quantity)])
+
+    def add_items_to_cart(self, branch_id: str, products: list):
+        """
+        Thêm nhiều sản phẩm vào giỏ, mỗi phần tử là (product_data, stock_quantity) hoặc
+        (product_data, stock_quantity, quantity) — mặc định thêm 1.
+        Giá bán hiệu lực của mọi SKU được tra một lần (PriceManager.get_current_prices). Khi chưa nạp được
+        giá (mất kết nối lúc vừa khởi động, bán bằng bản sao offline) thì dùng 'selling_price' của catalog.
+        """
+        try:
+            prices = self.price_mgr.get_current_prices(branch_id, [p[0]['sku'] for p in products])
+        except Exception as e:
+            logging.warning(f"Cannot resolve prices for {branch_id}, using catalog prices: {e}")
+            prices = {p[0]['sku']: p[0].get('selling_price', 0) for p in products}
+
+        for product_data, stock_quantity, *rest in products:
+            quantity = rest[0] if rest else 1
+            sku = product_data['sku']
+            current_price = prices.get(sku, 0)
 
-        if current_price <= 0:
-            st.error(f"Sản phẩm '{product_data['name']}' ({sku}) chưa được thiết lập giá bán tại chi nhánh này. Vui lòng kiểm tra lại.")
-            return
+            if current_price <= 0:
+                st.error(f"Sản phẩm '{product_data['name']}' ({sku}) chưa được thiết lập giá bán tại chi nhánh này. Vui lòng kiểm tra lại.")
+                continue
 
-        if sku in st.session_state.pos_cart:
-            self.update_item_quantity(sku, st.session_state.pos_cart[sku]['quantity'] + 1)
-        else:
-            st.session_state.pos_cart[sku] = {
-                "sku": sku,
-                "name": product_data['name'],
-                "category_id": product_data.get('category_id'),
-                "original_price": current_price,
-                "cost_price": product_data.get('cost_price', 0),
-                "quantity": 1,
-                "stock": stock_quantity,
-                "image_url": product_data.get('image_url')
-            }
+            if sku in st.session_state.pos_cart:
+                self.update_item_quantity(sku, st.session_state.pos_cart[sku]['quantity'] + quantity)
+            elif quantity > stock_quantity:
+                st.toast(f"Số lượng vượt quá tồn kho ({stock_quantity})!")
+            else:
+                st.session_state.pos_cart[sku] = {
+                    "sku": sku,
+                    "name": product_data['name'],
+                    "category_id": product_data.get('category_id'),
+                    "original_price": current_price,
+                    "cost_price": product_data.get('cost_price', 0),
+                    "quantity": quantity,
+                    "stock": stock_quantity,
+                    "image_url": product_data.get('image_url'),
+                    "image_id": product_data.get('image_id')
+                }
+                self._session_cart().refresh_line(sku)
+
+    def add_scanned_item(self, branch_id: str, scan_text: str, catalog_mirror):
+        """
+        Thêm sản phẩm theo mã quét (barcode hoặc SKU, có thể kèm số lượng "3*SKU") vào giỏ.
+        Mã được tra trong bảng của CatalogMirror nên không đọc Firestore.
+        Trả về (success, message).
+        """
+        match = _SCAN_PATTERN.match(scan_text or "")
+        if not match:
+            return False, "Mã quét không hợp lệ."
+        quantity = int(match.group(1)) if match.group(1) else 1
+        code = match.group(2)
+        if quantity <= 0 or quantity > MAX_SCAN_QUANTITY:
+            return False, f"Số lượng không hợp lệ: {quantity}."
+
+        product = catalog_mirror.resolve_scan_code(branch_id, code)
+        if not product:
+            return False, f"Không tìm thấy sản phẩm có mã '{code}' tại chi nhánh này."
+
+        stock_quantity = product.get('stock_quantity', 0)
+        if self.offline_store is not None:
+            # Tồn kho của mirror chưa trừ các đơn còn chờ trong outbox
+            stock_quantity -= self.offline_store.get_pending_quantities(branch_id).get(product['sku'], 0)
+        in_cart = st.session_state.pos_cart.get(product['sku'], {}).get('quantity', 0)
+        if in_cart + quantity > stock_quantity:
+            return False, f"'{product['name']}' chỉ còn {stock_quantity} trong kho (giỏ đang có {in_cart})."
+
+        self.add_item_to_cart(branch_id, product, stock_quantity, quantity)
+        if st.session_state.pos_cart.get(product['sku'], {}).get('quantity', 0) == in_cart:
+            return False, f"Không thể thêm '{product['name']}' vào giỏ."
+        return True, f"Đã thêm {quantity} x {product['name']}"
 
     def update_item_quantity(self, sku: str, new_quantity: int):
         if sku in st.session_state.pos_cart:
@@ -48,83 +134,83 @@ class POSManager:
                 del st.session_state.pos_cart[sku]
             elif new_quantity > st.session_state.pos_cart[sku]['stock']:
                 st.toast(f"Số lượng vượt quá tồn kho ({st.session_state.pos_cart[sku]['stock']})!")
+                return
             else:
                 st.session_state.pos_cart[sku]['quantity'] = new_quantity
+            st.session_state.get('pos_stock_shortages', {}).pop(sku, None)
+            self._session_cart().refresh_line(sku)
     
     def clear_cart(self):
         st.session_state.pos_cart = {}
         st.session_state.pos_customer = "-"
+        st.session_state.pos_customer_info = None
         st.session_state.pos_manual_discount = {"type": "PERCENT", "value": 0}
         st.session_state.pos_manual_discount_value = 0
+        st.session_state.pos_stock_shortages = {}
+
+    def _apply_stock_shortages(self, shortages: dict):
+        """Cập nhật tồn kho thực tế vào các dòng giỏ hàng bị thiếu và lưu lại để trang POS cảnh báo từng dòng."""
+        cart = self._session_cart()
+        for sku, (_, available) in shortages.items():
+            if sku in cart.items:
+                cart.items[sku]['stock'] = available
+                cart.refresh_line(sku)
+        st.session_state.pos_stock_shortages = dict(shortages)
 
     # --------------------------------------------------------------------------
     # HÀM TÍNH TOÁN GIỎ HÀNG
     # --------------------------------------------------------------------------
 
-    def calculate_cart_state(self, cart_items: dict, customer_id: str, manual_discount_input: dict):
-        active_promo = self.promotion_mgr.get_active_price_program()
-        calculated_items = {}
-        subtotal = 0
-        total_auto_discount = 0
-        manual_discount_exceeded = False
-        total_items = 0 # <--- SỬA LỖI: Khởi tạo biến đếm
-
-        for sku, item in cart_items.items():
-            total_items += item['quantity'] # <--- SỬA LỖI: Đếm tổng số lượng sản phẩm
-            original_line_total = item['original_price'] * item['quantity']
-            subtotal += original_line_total
-            
-            auto_discount_value = 0
-            if self.promotion_mgr.is_item_eligible_for_program(item, active_promo):
-                auto_discount_rule = active_promo.get('rules', {}).get('auto_discount', {})
-                if auto_discount_rule.get('type') == 'PERCENT':
-                    auto_discount_value = original_line_total * (auto_discount_rule.get('value', 0) / 100)
-            
-            total_auto_discount += auto_discount_value
-
-            calculated_items[sku] = {
-                **item,
-                'original_line_total': original_line_total,
-                'auto_discount_applied': auto_discount_value,
-                'line_total_after_auto_discount': original_line_total - auto_discount_value
-            }
-        
-        total_manual_discount = 0
-        limit_value = 0
-        if active_promo and self.promotion_mgr.is_manual_discount_allowed(active_promo):
-            limit_rule = active_promo.get('rules', {}).get('manual_extra_limit', {})
-            limit_value = limit_rule.get('value', 0)
-            user_discount_value = manual_discount_input.get('value', 0)
-            
-            if user_discount_value > limit_value:
-                manual_discount_exceeded = True
-            else:
-                total_manual_discount = (subtotal - total_auto_discount) * (user_discount_value / 100)
-        
-        grand_total = subtotal - total_auto_discount - total_manual_discount
-
-        return {
-            "items": calculated_items,
-            "total_items": total_items, # <--- SỬA LỖI: Trả về tổng số sản phẩm
-            "active_promotion": active_promo,
-            "subtotal": subtotal,
-            "total_auto_discount": total_auto_discount,
-            "total_manual_discount": total_manual_discount,
-            "manual_discount_input": manual_discount_input,
-            "manual_discount_limit": limit_value,
-            "manual_discount_exceeded": manual_discount_exceeded,
-            "grand_total": grand_total
-        }
+    def calculate_cart_state(self, cart_items: dict, customer_id: str, manual_discount_input: dict, active_promo=_NOT_LOADED):
+        """
+        Tính toàn bộ giỏ hàng từ đầu. active_promo: chương trình giá đã đọc sẵn (mặc định lấy từ cache
+        của PromotionManager). Trang POS dùng get_cart_state() để chỉ tính lại các dòng thay đổi.
+        """
+        if active_promo is _NOT_LOADED:
+            active_promo = self.promotion_mgr.get_active_price_program()
+        return CartState(self.promotion_mgr, cart_items, active_promo).summary(manual_discount_input)
+
+    def get_cart_state(self, customer_id: str, manual_discount_input: dict, active_promo=_NOT_LOADED):
+        """
+        Trạng thái giỏ hàng của phiên hiện tại (st.session_state.pos_cart), cùng định dạng với calculate_cart_state.
+        Các dòng đã được tính sẵn khi thêm/sửa/xóa; chương trình giá lấy từ cache nên không đọc Firestore.
+        active_promo: chương trình giá cho sẵn (VD: từ bản sao offline), mặc định lấy từ PromotionManager.
+        """
+        if active_promo is _NOT_LOADED:
+            active_promo = self.promotion_mgr.get_active_price_program()
+        cart = self._session_cart()
+        cart.set_promotion(active_promo)
+        return cart.summary(manual_discount_input)
+
+    def _session_cart(self) -> CartState:
+        items = st.session_state.setdefault('pos_cart', {})
+        cart = st.session_state.get('pos_cart_state')
+        # Giỏ được gán lại (xóa giỏ, đổi chi nhánh): dựng lại CartState cho dict mới
+        if cart is None or cart.items is not items:
+            cart = CartState(self.promotion_mgr, items, self.promotion_mgr.get_active_price_program())
+            st.session_state.pos_cart_state = cart
+        return cart
 
     # --------------------------------------------------------------------------
     # HÀM XỬ LÝ TẠO ĐƠN HÀNG
     # --------------------------------------------------------------------------
 
     def _create_order_id(self, branch_id):
-        now = datetime.now()
-        date_str = now.strftime('%y%m%d')
-        short_uuid = uuid.uuid4().hex[:6].upper()
-        return f'{branch_id}-{date_str}-{short_uuid}'
+        # {branch}-{yymmdd}-{seq:06d}: tăng dần trong ngày của chi nhánh, xem OrderIdAllocator
+        return self.order_ids.next_id(branch_id)
+
+    def list_branch_orders(self, branch_id: str, start_day, end_day=None, fields: list = None) -> list:
+        """
+        Các đơn của chi nhánh tạo từ start_day đến hết end_day (mặc định: chỉ start_day), theo thứ tự mã đơn.
+        Quét khoảng document ID '{branch}-{yymmdd}-...' nên không cần composite index.
+        """
+        start_id, end_id = order_id_range(branch_id, start_day, end_day)
+        query = self.orders_collection.order_by('__name__')\
+                    .start_at({'__name__': self.orders_collection.document(start_id)})\
+                    .end_before({'__name__': self.orders_collection.document(end_id)})
+        if fields:
+            query = query.select(fields)
+        return [doc.to_dict() for doc in query.stream()]
 
     def create_order(self, cart_state: dict, customer_id: str, branch_id: str, seller_id: str):
         if not cart_state['items']:
@@ -180,27 +266,135 @@ class POSManager:
             "status": "COMPLETED"
         }
 
+        if self.offline_store is None or time.monotonic() >= self._offline_until:
+            try:
+                # Các đơn còn chờ trong outbox chưa trừ vào tồn kho trên Firestore: giữ chỗ cho chúng khi kiểm tra
+                reserved = self.offline_store.get_pending_quantities(branch_id) if self.offline_store else None
+                return True, self._commit_new_order(final_order_data, reserved)
+            except InsufficientStockError as e:
+                self._apply_stock_shortages(e.shortages)
+                return False, str(e)
+            except Exception as e:
+                if self.offline_store is None or not isinstance(e, _CONNECTION_ERRORS):
+                    return False, str(e)
+                logging.warning(f"Cannot reach Firestore for order {order_id}, queueing it offline: {e}")
+                self._offline_until = time.monotonic() + OFFLINE_RETRY_SECONDS
+
+        # Chế độ offline, mất kết nối: chốt đơn xuống outbox cục bộ, OutboxFlusher ghi lên Firestore sau
         try:
-            @firestore.transactional
-            def _process_order(transaction):
-                order_ref = self.orders_collection.document(order_id)
-                for item in order_items_to_save:
-                    self.inventory_mgr.update_inventory(
-                        sku=item['sku'],
-                        branch_id=branch_id,
-                        delta=-item['quantity'],
-                        transaction=transaction
-                    )
-                if customer_id != "-":
-                    self.customer_mgr.update_customer_stats(
-                        transaction=transaction,
-                        customer_id=customer_id,
-                        amount_spent_delta=final_order_data['grand_total'],
-                        points_delta=int(final_order_data['grand_total'] / 1000) 
-                    )
-                transaction.set(order_ref, final_order_data)
-
-            _process_order(self.db.transaction())
-            return True, order_id
+            for _ in range(ORDER_ID_ATTEMPTS):
+                if self.offline_store.enqueue_order(final_order_data['id'], branch_id, {"order": final_order_data}):
+                    break
+                logging.warning(f"Order id {final_order_data['id']} already in the outbox, allocating a new one")
+                final_order_data['id'] = self._create_order_id(branch_id)
+            else:
+                return False, "Không cấp được mã đơn hàng không trùng lặp."
         except Exception as e:
-            return False, str(e)
+            return False, f"Không thể lưu đơn hàng cục bộ: {e}"
+        if self.outbox_flusher is not None:
+            self.outbox_flusher.wake()
+        return True, final_order_data['id']
+
+    def _commit_new_order(self, order_data: dict, reserved: dict = None) -> str:
+        """
+        _commit_order cho đơn vừa chốt tại quầy, trả về mã đơn đã ghi. Nếu mã đã thuộc về một đơn khác
+        (hậu tố ngẫu nhiên khi không cấp được số thứ tự) thì cấp mã mới và ghi lại, để đơn không bị bỏ qua
+        trong im lặng; trùng với chính đơn này (lần ghi trước thành công nhưng mất phản hồi) là thành công.
+        """
+        for _ in range(ORDER_ID_ATTEMPTS):
+            if self._commit_order(order_data, reserved=reserved) or self._is_stored_order(order_data):
+                return order_data['id']
+            logging.warning(f"Order id {order_data['id']} belongs to another order, allocating a new one")
+            order_data['id'] = self._create_order_id(order_data['branch_id'])
+        raise RuntimeError("Không cấp được mã đơn hàng không trùng lặp.")
+
+    def _is_stored_order(self, order_data: dict) -> bool:
+        """Đơn trên Firestore có cùng mã là chính đơn này (cùng quầy bán, thời điểm tạo và tổng tiền)."""
+        stored = self.orders_collection.document(order_data['id']).get().to_dict() or {}
+        return all(stored.get(field) == order_data.get(field) for field in ('seller_id', 'created_at', 'grand_total'))
+
+    def _commit_order(self, order_data: dict, validate_stock: bool = True, reserved: dict = None) -> bool:
+        """
+        Ghi đơn hàng lên Firestore trong một transaction: kiểm tra tồn kho, trừ tồn kho, cộng điểm khách hàng,
+        cộng vào tổng hợp bán hàng của ngày (daily_sales), lưu đơn. Đơn offline đồng bộ muộn còn invalidate
+        ngày của đơn (xem ReportInvalidations.invalidate_order).
+        Tồn kho của mọi dòng được đọc bằng một lần get_all trong transaction; thiếu hàng thì raise
+        InsufficientStockError với toàn bộ các SKU thiếu. Shard của SKU bán chạy chỉ được đọc (khóa) trong
+        transaction khi tồn kho gần hết (xem InventoryManager.get_stock_quantities). validate_stock=False khi đồng bộ đơn offline
+        (hàng đã giao cho khách, chỉ còn ghi nhận).
+        reserved: {sku: số lượng} đã bán tại máy nhưng chưa ghi lên Firestore (đơn trong outbox), được trừ
+        khỏi tồn kho khi kiểm tra.
+        Idempotent theo order_id: nếu đơn đã tồn tại (VD: lần gửi trước thành công nhưng mất phản hồi)
+        thì không ghi lại. Trả về False trong trường hợp đó.
+        """
+        order_ref = self.orders_collection.document(order_data['id'])
+        customer_id = order_data.get('customer_id')
+        branch_id = order_data['branch_id']
+        required = {}
+        for item in order_data['items']:
+            required[item['sku']] = required.get(item['sku'], 0) + item['quantity']
+
+        @firestore.transactional
+        def _process_order(transaction):
+            if order_ref.get(transaction=transaction).exists:
+                return False
+            if validate_stock:
+                stock = self.inventory_mgr.get_stock_quantities(
+                    [(sku, branch_id) for sku in required], transaction=transaction, lock_shards=False,
+                    needed={(sku, branch_id): quantity + (reserved or {}).get(sku, 0) for sku, quantity in required.items()},
+                )
+                available = {
+                    sku: stock.get((sku, branch_id), 0) - (reserved or {}).get(sku, 0) for sku in required
+                }
+                shortages = {
+                    sku: (quantity, max(0, available[sku]))
+                    for sku, quantity in required.items() if available[sku] < quantity
+                }
+                if shortages:
+                    raise InsufficientStockError(shortages)
+            for item in order_data['items']:
+                self.inventory_mgr.update_inventory(
+                    sku=item['sku'],
+                    branch_id=branch_id,
+                    delta=-item['quantity'],
+                    transaction=transaction
+                )
+            if customer_id:
+                self.customer_mgr.update_customer_stats(
+                    transaction=transaction,
+                    customer_id=customer_id,
+                    amount_spent_delta=order_data['grand_total'],
+                    points_delta=int(order_data['grand_total'] / 1000) 
+                )
+            self.daily_sales.record_order(transaction, order_data)
+            self.report_invalidations.invalidate_order(
+                datetime.fromisoformat(order_data['created_at']), writer=transaction
+            )
+            transaction.set(order_ref, order_data)
+            return True
+
+        return _process_order(self.db.transaction())
+
+    def flush_outbox(self, limit: int = 50):
+        """
+        Đẩy các đơn đang chờ trong outbox cục bộ lên Firestore (cũ nhất trước).
+        Trả về (số đơn đã đồng bộ, số đơn lỗi sẽ thử lại sau).
+        """
+        if self.offline_store is None:
+            return 0, 0
+        synced, failed = 0, 0
+        for order_id, payload, attempts in self.offline_store.get_due_orders(limit):
+            try:
+                if not self._commit_order(payload['order'], validate_stock=False) \
+                        and not self._is_stored_order(payload['order']):
+                    # Mã đơn trùng với một đơn khác: giữ lại trong outbox và báo lỗi thay vì bỏ qua đơn
+                    raise RuntimeError(f"Order id {order_id} is already used by another order")
+                self.offline_store.mark_synced(order_id)
+                synced += 1
+                # Firestore đã tới được: đơn mới lại được ghi trực tiếp
+                self._offline_until = 0
+            except Exception as e:
+                logging.warning(f"Cannot sync order {order_id} (attempt {attempts + 1}): {e}")
+                self.offline_store.mark_failed(order_id, str(e))
+                failed += 1
+        return synced, failed
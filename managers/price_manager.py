@@ -3,11 +3,15 @@ from datetime import datetime, time
 import uuid
 import pytz
 
+from managers.price_resolver import PriceResolver
+
 class PriceManager:
     def __init__(self, firebase_client):
         self.db = firebase_client.db
         self.prices_col = self.db.collection('branch_prices')
         self.schedules_col = self.db.collection('price_schedules')
+        # Timeline giá (hiện tại + lịch trình) trong bộ nhớ cho đường bán hàng
+        self.resolver = PriceResolver(self.db)
 
     # --- CÁC HÀM QUẢN LÝ GIÁ TRỰC TIẾP (GIỮ NGUYÊN) ---
     def set_price(self, sku: str, branch_id: str, price: float):
@@ -21,6 +25,7 @@ class PriceManager:
             'price': price,
             'updated_at': datetime.now().isoformat()
         }, merge=True)
+        self.resolver.invalidate(branch_id)
 
     def set_business_status(self, sku: str, branch_id: str, is_active: bool):
         """Thiết lập trạng thái kinh doanh (Đang bán/Tạm ngưng) cho sản phẩm."""
@@ -29,21 +34,60 @@ class PriceManager:
             'is_active': is_active,
             'updated_at': datetime.now().isoformat()
         }, merge=True)
+        self.resolver.invalidate(branch_id)
 
-    def get_all_prices(self):
-        """Lấy toàn bộ các bản ghi giá từ database."""
-        docs = self.prices_col.stream()
-        return [doc.to_dict() for doc in docs]
+    def get_all_prices(self, fields: list = None, branch_id: str = None):
+        """
+        Lấy các bản ghi giá từ database (của một chi nhánh nếu truyền branch_id).
+        fields: chỉ lấy các trường này (projection select() phía Firestore).
+        """
+        query = self.prices_col
+        if branch_id:
+            query = query.where('branch_id', '==', branch_id)
+        if fields:
+            query = query.select(fields)
+        return [doc.to_dict() for doc in query.stream()]
 
-    def get_active_prices_for_branch(self, branch_id: str):
+    def get_active_prices_for_branch(self, branch_id: str, fields: list = None):
         """Lấy các sản phẩm đang được 'Kinh doanh' tại một chi nhánh (cho POS)."""
-        docs = self.prices_col.where('branch_id', '==', branch_id).where('is_active', '==', True).stream()
-        return [doc.to_dict() for doc in docs]
+        query = self.prices_col.where('branch_id', '==', branch_id).where('is_active', '==', True)
+        if fields:
+            query = query.select(fields)
+        return [doc.to_dict() for doc in query.stream()]
+
+    def get_prices(self, pairs, transaction=None) -> dict:
+        """
+        Lấy bản ghi giá của nhiều cặp (sku, branch_id) bằng một lần db.get_all() duy nhất.
+        Trả về {(sku, branch_id): bản ghi giá hoặc None nếu chưa thiết lập giá}.
+        """
+        pairs = [pair for pair in dict.fromkeys(pairs) if pair[0] and pair[1]]
+        if not pairs:
+            return {}
+        pairs_by_doc_id = {f"{branch_id}_{sku}": (sku, branch_id) for sku, branch_id in pairs}
+        refs = [self.prices_col.document(doc_id) for doc_id in pairs_by_doc_id]
+
+        prices = {pair: None for pair in pairs}
+        for snapshot in self.db.get_all(refs, transaction=transaction):
+            if snapshot.exists:
+                prices[pairs_by_doc_id[snapshot.id]] = snapshot.to_dict()
+        return prices
 
     def get_price(self, sku: str, branch_id: str):
         """Lấy thông tin giá và trạng thái của một sản phẩm tại một chi nhánh."""
-        doc = self.prices_col.document(f"{branch_id}_{sku}").get()
-        return doc.to_dict() if doc.exists else None
+        return self.get_prices([(sku, branch_id)]).get((sku, branch_id))
+
+    def get_current_prices(self, branch_id: str, skus, at: datetime = None) -> dict:
+        """
+        Giá bán hiệu lực {sku: giá} của nhiều sản phẩm tại một chi nhánh ở thời điểm 'at' (mặc định: hiện tại),
+        đã tính cả lịch trình giá đến hạn. Tra trong timeline bộ nhớ (PriceResolver), không đọc Firestore.
+        Sản phẩm chưa có giá hoặc đang tạm ngưng kinh doanh có giá 0.
+        """
+        if not branch_id:
+            return {sku: 0 for sku in skus}
+        return self.resolver.prices_at(branch_id, skus, at)
+
+    def get_current_price_for_sku(self, branch_id: str, sku: str, at: datetime = None) -> float:
+        return self.get_current_prices(branch_id, [sku], at).get(sku, 0)
 
     # --- CÁC HÀM MỚI CHO LỊCH TRÌNH GIÁ ---
 
@@ -67,6 +111,7 @@ class PriceManager:
             "created_by": created_by
         }
         self.schedules_col.document(schedule_id).set(data)
+        self.resolver.invalidate(branch_id)
         return True, schedule_id
 
     def get_pending_schedules_for_product(self, sku: str, branch_id: str):
@@ -81,8 +126,10 @@ class PriceManager:
     def cancel_schedule(self, schedule_id: str):
         """Hủy một lịch trình đã được tạo."""
         doc_ref = self.schedules_col.document(schedule_id)
-        if doc_ref.get().exists:
+        doc = doc_ref.get()
+        if doc.exists:
             doc_ref.update({"status": "CANCELED"})
+            self.resolver.invalidate(doc.to_dict().get('branch_id'))
             return True
         return False
 
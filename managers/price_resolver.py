@@ -0,0 +1,156 @@
+import bisect
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from managers.concurrency import fan_out
+
+# Đọc lại timeline của chi nhánh sau khoảng này dù chưa tới mốc lịch trình nào,
+# để nhận thay đổi giá do process khác ghi (các thay đổi trong process này được invalidate ngay)
+REFRESH_SECONDS = 60
+# Chi nhánh chưa nạp được timeline (mất kết nối): báo lỗi ngay, không gọi lại Firestore trong khoảng này
+LOAD_RETRY_SECONDS = 60
+
+_BEGINNING = datetime.min.replace(tzinfo=timezone.utc)
+
+
+class _BranchTimeline:
+    __slots__ = ('skus', 'next_boundary', 'loaded_at')
+
+    def __init__(self, skus: dict, next_boundary, loaded_at: float):
+        self.skus = skus                    # sku -> (starts, prices, is_active)
+        self.next_boundary = next_boundary  # mốc lịch trình gần nhất trong tương lai (None nếu không có)
+        self.loaded_at = loaded_at
+
+
+class PriceResolver:
+    """
+    Giá bán hiệu lực theo thời điểm, tính từ 'branch_prices' và các lịch trình PENDING trong 'price_schedules'.
+
+    Mỗi chi nhánh được nạp một lần thành timeline đã sắp xếp cho từng SKU:
+    giá hiện tại bắt đầu từ quá khứ, sau đó là các giá theo lịch trình theo thứ tự start_date.
+    Tra giá là bisect trên timeline (O(log n), không đọc Firestore), nên lịch trình có hiệu lực
+    đúng thời điểm mà không cần chờ job apply_pending_schedules.
+    Timeline được nạp lại khi qua mốc lịch trình kế tiếp, khi quá REFRESH_SECONDS, hoặc khi invalidate().
+    """
+    def __init__(self, db, refresh_seconds: float = REFRESH_SECONDS):
+        self.prices_col = db.collection('branch_prices')
+        self.schedules_col = db.collection('price_schedules')
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._branches = {}  # branch_id -> _BranchTimeline
+        self._failed = {}    # branch_id -> (thời điểm được thử lại, lỗi) khi chưa từng nạp được timeline
+
+    def price_at(self, branch_id: str, sku: str, at: datetime = None) -> float:
+        """Giá của SKU tại chi nhánh ở thời điểm 'at' (mặc định: hiện tại); 0 nếu chưa có giá hoặc đang tạm ngưng."""
+        return self.prices_at(branch_id, [sku], at).get(sku, 0)
+
+    def prices_at(self, branch_id: str, skus, at: datetime = None) -> dict:
+        """Giá {sku: giá} của nhiều SKU tại chi nhánh ở thời điểm 'at', cùng quy ước với price_at."""
+        at = _to_utc(at) if at else datetime.now(timezone.utc)
+        timeline = self._get_timeline(branch_id)
+        prices = {}
+        for sku in skus:
+            entry = timeline.skus.get(sku)
+            if not entry or not entry[2]:
+                prices[sku] = 0
+                continue
+            starts, values, _ = entry
+            index = bisect.bisect_right(starts, at) - 1
+            prices[sku] = values[index] if index >= 0 else 0
+        return prices
+
+    def invalidate(self, branch_id: str = None):
+        """Bỏ timeline đã nạp của một chi nhánh (hoặc tất cả) sau khi giá/lịch trình thay đổi."""
+        with self._lock:
+            if branch_id is None:
+                self._branches.clear()
+            else:
+                self._branches.pop(branch_id, None)
+
+    # --------------------------------------------------------------------------
+
+    def _get_timeline(self, branch_id: str) -> _BranchTimeline:
+        with self._lock:
+            timeline = self._branches.get(branch_id)
+            failed = self._failed.get(branch_id)
+        if timeline is None and failed and time.monotonic() < failed[0]:
+            raise failed[1]
+        if timeline is None or self._is_stale(timeline):
+            try:
+                fresh = self._load(branch_id)
+            except Exception as e:
+                if timeline is None:
+                    with self._lock:
+                        self._failed[branch_id] = (time.monotonic() + LOAD_RETRY_SECONDS, e)
+                    raise
+                # Mất kết nối: tiếp tục dùng timeline cũ (bisect vẫn đúng theo thời điểm), thử lại sau refresh_seconds
+                logging.warning(f"Cannot refresh price timeline for {branch_id}, using cached prices: {e}")
+                fresh = _BranchTimeline(timeline.skus, None, time.monotonic())
+            timeline = fresh
+            with self._lock:
+                self._branches[branch_id] = timeline
+                self._failed.pop(branch_id, None)
+        return timeline
+
+    def _is_stale(self, timeline: _BranchTimeline) -> bool:
+        if time.monotonic() - timeline.loaded_at > self.refresh_seconds:
+            return True
+        return timeline.next_boundary is not None and datetime.now(timezone.utc) >= timeline.next_boundary
+
+    def _load(self, branch_id: str) -> _BranchTimeline:
+        loaded_at = time.monotonic()
+        fetched = fan_out({
+            'prices': lambda: list(
+                self.prices_col.where(filter=FieldFilter('branch_id', '==', branch_id))
+                .select(['sku', 'price', 'is_active']).stream()
+            ),
+            'schedules': lambda: list(
+                self.schedules_col.where(filter=FieldFilter('branch_id', '==', branch_id))
+                .where(filter=FieldFilter('status', '==', 'PENDING'))
+                .select(['sku', 'new_price', 'start_date', 'created_at']).stream()
+            ),
+        })
+
+        skus = {}
+        for doc in fetched['prices']:
+            data = doc.to_dict()
+            if data.get('sku') and data.get('price') is not None:
+                skus[data['sku']] = ([_BEGINNING], [data['price']], data.get('is_active', True))
+            elif data.get('sku'):
+                skus[data['sku']] = ([], [], data.get('is_active', True))
+
+        schedules = []
+        for doc in fetched['schedules']:
+            data = doc.to_dict()
+            try:
+                start = _to_utc(data['start_date'])
+                created_at = _to_utc(data['created_at']) if data.get('created_at') else _BEGINNING
+                schedules.append((start, created_at, data['sku'], data['new_price']))
+            except (KeyError, TypeError, ValueError) as e:
+                logging.warning(f"Skipping malformed price schedule {doc.id}: {e}")
+        # Cùng start_date thì lịch trình tạo sau được ưu tiên (nằm sau trong timeline)
+        schedules.sort(key=lambda s: (s[0], s[1]))
+
+        now = datetime.now(timezone.utc)
+        next_boundary = None
+        for start, _, sku, new_price in schedules:
+            starts, values, is_active = skus.setdefault(sku, ([], [], True))
+            starts.append(start)
+            values.append(new_price)
+            if start > now and (next_boundary is None or start < next_boundary):
+                next_boundary = start
+
+        return _BranchTimeline(skus, next_boundary, loaded_at)
+
+
+def _to_utc(value) -> datetime:
+    # Firestore coi datetime không có múi giờ là UTC (cùng quy ước với apply_pending_schedules)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
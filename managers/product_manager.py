@@ -6,7 +6,10 @@ from google.cloud import firestore
 from google.cloud.firestore_v1.field_path import FieldPath
 from google.cloud.firestore_v1.base_query import And, FieldFilter
 
+from managers.app_secrets import get_secret
 from managers.image_handler import ImageHandler
+from managers.pagination import DEFAULT_PAGE_SIZE, DESCENDING, Page, paginate
+from managers.reference_cache import reference_cache
 
 # --- BEGIN INLINED CategoryManager ---
 class CategoryManager:
@@ -26,6 +29,7 @@ class CategoryManager:
                 "created_at": firestore.SERVER_TIMESTAMP
             }
             self.cat_col.document(cat_id).set(data)
+            reference_cache.invalidate('categories')
             return True, f"Tạo danh mục '{name}' thành công!"
         except Exception as e:
             logging.error(f"Failed to create category '{name}': {e}")
@@ -33,15 +37,19 @@ class CategoryManager:
 
     def get_categories(self):
         try:
-            docs = self.cat_col.order_by("name").stream()
-            return [{"id": doc.id, **doc.to_dict()} for doc in docs]
+            return reference_cache.get_or_load(('categories',), self._load_categories)
         except Exception as e:
             logging.error(f"Error getting categories: {e}")
             return []
 
+    def _load_categories(self):
+        docs = self.cat_col.order_by("name").stream()
+        return [{"id": doc.id, **doc.to_dict()} for doc in docs]
+
     def delete_category(self, cat_id):
         try:
             self.cat_col.document(cat_id).delete()
+            reference_cache.invalidate('categories')
             return True, "Xóa danh mục thành công."
         except Exception as e:
             logging.error(f"Error deleting category {cat_id}: {e}")
@@ -63,6 +71,7 @@ class UnitManager:
                 "created_at": firestore.SERVER_TIMESTAMP
             }
             self.unit_col.document(unit_id).set(data)
+            reference_cache.invalidate('units')
             return True, f"Tạo đơn vị '{name}' thành công!"
         except Exception as e:
             logging.error(f"Failed to create unit '{name}': {e}")
@@ -70,15 +79,19 @@ class UnitManager:
 
     def get_units(self):
         try:
-            docs = self.unit_col.order_by("name").stream()
-            return [{"id": doc.id, **doc.to_dict()} for doc in docs]
+            return reference_cache.get_or_load(('units',), self._load_units)
         except Exception as e:
             logging.error(f"Error getting units: {e}")
             return []
 
+    def _load_units(self):
+        docs = self.unit_col.order_by("name").stream()
+        return [{"id": doc.id, **doc.to_dict()} for doc in docs]
+
     def delete_unit(self, unit_id):
         try:
             self.unit_col.document(unit_id).delete()
+            reference_cache.invalidate('units')
             return True, "Xóa đơn vị thành công."
         except Exception as e:
             logging.error(f"Error deleting unit {unit_id}: {e}")
@@ -86,19 +99,21 @@ class UnitManager:
 # --- END INLINED UnitManager ---
 
 class ProductManager:
-    def __init__(self, firebase_client):
+    def __init__(self, firebase_client, image_handler: ImageHandler = None):
         self.db = firebase_client.db
         self.collection = self.db.collection('products')
         # Initialize managers directly
         self.category_manager = CategoryManager(self.db)
         self.unit_manager = UnitManager(self.db)
-        self.image_handler = self._initialize_image_handler()
-        self.product_image_folder_id = st.secrets.get("drive_product_folder_id") or st.secrets.get("drive_folder_id")
+        # Ưu tiên handler dùng chung (đã build Drive client một lần cho cả process)
+        self.image_handler = image_handler or self._initialize_image_handler()
+        self.product_image_folder_id = get_secret("drive_product_folder_id") or get_secret("drive_folder_id")
 
     def _initialize_image_handler(self):
-        if "drive_oauth" in st.secrets:
+        drive_oauth = get_secret("drive_oauth")
+        if drive_oauth:
             try:
-                creds_info = dict(st.secrets["drive_oauth"])
+                creds_info = dict(drive_oauth)
                 if creds_info.get('refresh_token'):
                     return ImageHandler(credentials_info=creds_info)
             except Exception as e:
@@ -188,6 +203,8 @@ class ProductManager:
 
             transaction = self.db.transaction()
             sku = _create_in_transaction(transaction, cat_ref, product_data)
+            # current_seq của danh mục vừa thay đổi
+            reference_cache.invalidate('categories')
 
             if sku and image_file:
                 new_image_id = self._handle_image_update(sku, image_file, delete_image_flag=False)
@@ -246,15 +263,37 @@ class ProductManager:
             logging.error(f"Error deleting product {product_id}: {e}")
             return False, f"Lỗi khi xóa sản phẩm: {e}"
 
-    def get_all_products(self, show_inactive=False):
+    def get_all_products(self, show_inactive=False, fields: list = None):
+        """
+        Danh sách sản phẩm, mới tạo trước. fields: chỉ lấy các trường này (projection select() phía Firestore),
+        dùng cho dropdown/báo cáo không cần toàn bộ document. Trường 'id' luôn có.
+        """
         try:
             query = self.collection if show_inactive else self.collection.where(filter=FieldFilter("active", "==", True))
-            docs = query.order_by("created_at", direction=firestore.Query.DESCENDING).stream()
+            query = query.order_by("created_at", direction=firestore.Query.DESCENDING)
+            if fields:
+                query = query.select(fields)
+            docs = query.stream()
             return [{"id": doc.id, **doc.to_dict()} for doc in docs]
         except Exception as e:
             logging.error(f"Error getting all products: {e}")
             return []
 
+    def get_products_page(self, show_inactive=False, page_size: int = DEFAULT_PAGE_SIZE, cursor: str = None) -> Page:
+        """Danh sách sản phẩm theo trang, mới tạo trước (cùng thứ tự với get_all_products)."""
+        query = self.collection if show_inactive else self.collection.where(filter=FieldFilter("active", "==", True))
+        return paginate(self.collection, query, [("created_at", DESCENDING)], page_size, cursor)
+
+    def get_all_products_with_cost(self):
+        """
+        Sản phẩm đang kinh doanh kèm giá vốn ('cost_price') và giá niêm yết chung ('price_default'),
+        dùng cho mô phỏng chương trình giá. Sản phẩm chưa có các trường này được gán 0.
+        """
+        return [
+            {**p, 'cost_price': p.get('cost_price') or 0, 'price_default': p.get('price_default') or 0}
+            for p in self.get_all_products(fields=['sku', 'name', 'cost_price', 'price_default'])
+        ]
+
     def get_product_by_id(self, product_id):
         if not product_id: return None
         try:
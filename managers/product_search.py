@@ -0,0 +1,197 @@
+import threading
+
+from managers.text_utils import tokenize
+
+# Độ dài tiền tố tối đa được lập chỉ mục; từ khóa dài hơn được lọc thêm trên tập ứng viên
+MAX_PREFIX_LENGTH = 8
+# Tìm giữa từ (khi theo tiền tố không ra kết quả) chỉ áp dụng cho từ khóa đủ dài
+MIN_INFIX_LENGTH = 3
+
+
+class ProductSearchIndex:
+    """
+    Chỉ mục tìm kiếm sản phẩm trong bộ nhớ cho trang POS, không phân biệt dấu/hoa thường
+    ("ao so mi" khớp "Áo sơ mi").
+
+    - Postings theo tiền tố của từng từ trong tên và SKU: mọi từ khóa phải khớp tiền tố của một từ.
+    - Khi không có kết quả theo tiền tố, tìm chuỗi con trên tên/SKU đã fold ("somi" khớp "Áo sơ mi").
+    - Map SKU/barcode chính xác (lookup_code cho quét mã) và postings theo danh mục (bộ lọc pos_category).
+
+    sync() nhận danh sách catalog mới nhất và chỉ lập chỉ mục lại các sản phẩm có tên/danh mục/barcode thay đổi.
+    Kết quả xếp hạng: trùng SKU > SKU bắt đầu bằng từ khóa > tên bắt đầu bằng từ khóa > còn lại,
+    cùng hạng thì giữ thứ tự của catalog.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._products = {}       # sku -> bản ghi sản phẩm mới nhất (đã join giá/tồn kho)
+        self._position = {}       # sku -> vị trí trong catalog
+        self._signatures = {}     # sku -> (tên, danh mục, barcode) đã lập chỉ mục
+        self._compact = {}        # sku -> "tênđãfold skuđãfold" cho tìm chuỗi con
+        self._prefixes = {}       # tiền tố từ -> {sku}
+        self._sku_prefixes = {}   # tiền tố SKU (đã bỏ ký tự phân cách) -> {sku}
+        self._name_prefixes = {}  # tiền tố của cả tên (đã fold) -> {sku}
+        self._categories = {}     # category_id -> {sku}
+        self._exact_skus = {}     # SKU đã bỏ ký tự phân cách -> sku
+        self._barcodes = {}       # barcode (đã chuẩn hóa) -> sku
+
+    def __len__(self):
+        return len(self._products)
+
+    def sync(self, catalog: list):
+        """Cập nhật chỉ mục theo catalog mới (danh sách dict có 'sku', 'name', 'category_id')."""
+        with self._lock:
+            latest = {p['sku']: p for p in catalog if p.get('sku')}
+            for sku in [sku for sku in self._signatures if sku not in latest]:
+                self._unindex(sku)
+
+            for sku, product in latest.items():
+                signature = (product.get('name', ''), product.get('category_id'), product.get('barcode') or None)
+                if self._signatures.get(sku) != signature:
+                    self._unindex(sku)
+                    self._index(sku, signature)
+
+            self._products = latest
+            self._position = {sku: i for i, sku in enumerate(latest)}
+
+    def search(self, query: str = "", category_id: str = None, limit: int = None) -> list:
+        """
+        Sản phẩm khớp từ khóa (và danh mục nếu có), đã xếp hạng.
+        Từ khóa rỗng trả về toàn bộ (theo danh mục) theo thứ tự catalog.
+        """
+        with self._lock:
+            return [self._products[sku] for sku in self.search_skus(query, category_id, limit)]
+
+    def lookup_code(self, code: str):
+        """SKU của sản phẩm có barcode hoặc SKU trùng khớp chính xác với mã quét (O(1)); None nếu không có."""
+        key = _normalize_code(code)
+        if not key:
+            return None
+        with self._lock:
+            return self._barcodes.get(key) or self._exact_skus.get(key)
+
+    def search_skus(self, query: str = "", category_id: str = None, limit: int = None) -> list:
+        """Như search() nhưng chỉ trả về danh sách SKU."""
+        with self._lock:
+            terms = tokenize(query)
+            if terms:
+                candidates = (self._match_prefixes(terms) | self._match_sku(''.join(terms))) \
+                    or self._match_infix(''.join(terms))
+            else:
+                candidates = None
+
+            if category_id:
+                in_category = self._categories.get(category_id, set())
+                candidates = in_category if candidates is None else candidates & in_category
+
+            if candidates is None:
+                skus = list(self._products)
+            else:
+                skus = self._rank(candidates, terms)
+            if limit is not None:
+                skus = skus[:limit]
+            return skus
+
+    # --------------------------------------------------------------------------
+
+    def _match_prefixes(self, terms: list) -> set:
+        matched = None
+        # Từ khóa dài (ít kết quả) trước để giao tập nhỏ nhất
+        for term in sorted(terms, key=len, reverse=True):
+            postings = self._prefixes.get(term[:MAX_PREFIX_LENGTH], set())
+            if len(term) > MAX_PREFIX_LENGTH:
+                postings = {
+                    sku for sku in postings
+                    if any(word.startswith(term) for word in self._words(sku))
+                }
+            matched = postings if matched is None else matched & postings
+            if not matched:
+                return set()
+        return matched
+
+    def _match_sku(self, compact_query: str) -> set:
+        """SKU gõ liền không dấu phân cách ("c030012" khớp "C03-0012")."""
+        exact = self._barcodes.get(compact_query) or self._exact_skus.get(compact_query)
+        if exact:
+            return {exact}
+        postings = self._sku_prefixes.get(compact_query[:MAX_PREFIX_LENGTH], set())
+        if len(compact_query) > MAX_PREFIX_LENGTH:
+            return {sku for sku in postings if self._compact[sku].split(' ')[-1].startswith(compact_query)}
+        return postings
+
+    def _match_infix(self, compact_query: str) -> set:
+        if len(compact_query) < MIN_INFIX_LENGTH:
+            return set()
+        return {sku for sku, text in self._compact.items() if compact_query in text}
+
+    def _rank(self, candidates: set, terms: list) -> list:
+        compact_query = ''.join(terms)
+        folded_query = ' '.join(terms)
+        exact = self._exact_skus.get(compact_query)
+        sku_prefix = self._sku_prefixes.get(compact_query[:MAX_PREFIX_LENGTH], set())
+        name_prefix = self._name_prefixes.get(folded_query[:MAX_PREFIX_LENGTH], set())
+
+        ordered = sorted(candidates, key=self._position.__getitem__)
+        ranked = [exact] if exact in candidates else []
+        ranked += [sku for sku in ordered if sku in sku_prefix and sku != exact]
+        ranked += [sku for sku in ordered if sku in name_prefix and sku not in sku_prefix and sku != exact]
+        ranked += [sku for sku in ordered if sku not in name_prefix and sku not in sku_prefix and sku != exact]
+        return ranked
+
+    def _words(self, sku: str) -> list:
+        name = self._signatures[sku][0]
+        return tokenize(name) + tokenize(sku)
+
+    def _posting_keys(self, sku: str, signature: tuple):
+        """Các (postings, key) mà một sản phẩm thuộc về; dùng chung cho lập chỉ mục và gỡ chỉ mục."""
+        name_words, sku_words = _signature_words(sku, signature)
+        for word in set(name_words + sku_words):
+            for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+                yield self._prefixes, word[:length]
+
+        compact_sku = ''.join(sku_words)
+        for length in range(1, min(len(compact_sku), MAX_PREFIX_LENGTH) + 1):
+            yield self._sku_prefixes, compact_sku[:length]
+
+        folded_name = ' '.join(name_words)
+        for length in range(1, min(len(folded_name), MAX_PREFIX_LENGTH) + 1):
+            yield self._name_prefixes, folded_name[:length]
+
+        if signature[1]:
+            yield self._categories, signature[1]
+
+    def _index(self, sku: str, signature: tuple):
+        for postings, key in self._posting_keys(sku, signature):
+            postings.setdefault(key, set()).add(sku)
+        name_words, sku_words = _signature_words(sku, signature)
+        compact_sku = ''.join(sku_words)
+        self._exact_skus[compact_sku] = sku
+        self._compact[sku] = ''.join(name_words) + ' ' + compact_sku
+        if signature[2]:
+            self._barcodes[_normalize_code(signature[2])] = sku
+        self._signatures[sku] = signature
+
+    def _unindex(self, sku: str):
+        signature = self._signatures.pop(sku, None)
+        if signature is None:
+            return
+        for postings, key in self._posting_keys(sku, signature):
+            members = postings.get(key)
+            if members is not None:
+                members.discard(sku)
+                if not members:
+                    del postings[key]
+        compact_sku = ''.join(tokenize(sku))
+        if self._exact_skus.get(compact_sku) == sku:
+            del self._exact_skus[compact_sku]
+        self._compact.pop(sku, None)
+        barcode = _normalize_code(signature[2])
+        if barcode and self._barcodes.get(barcode) == sku:
+            del self._barcodes[barcode]
+
+
+def _normalize_code(code) -> str:
+    return ''.join(tokenize(code))
+
+
+def _signature_words(sku: str, signature: tuple):
+    return tokenize(signature[0]), tokenize(sku)
@@ -1,8 +1,18 @@
 
+import logging
+import threading
+import time
 import streamlit as st
 from google.cloud.firestore_v1.base_query import FieldFilter
 from google.cloud import firestore
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+
+from managers.concurrency import fan_out
+from managers.pagination import DEFAULT_PAGE_SIZE, DESCENDING, Page, paginate
+
+# Chương trình giá đang chạy được cache tới mốc thay đổi kế tiếp (kết thúc chương trình hiện tại hoặc
+# bắt đầu chương trình khác), nhưng không lâu hơn khoảng này để nhận thay đổi từ process khác
+PRICE_PROGRAM_CACHE_SECONDS = 300
 
 class PromotionManager:
     """
@@ -11,6 +21,8 @@ class PromotionManager:
     def __init__(self, firebase_client):
         self.db = firebase_client.db
         self.collection_ref = self.db.collection('promotions')
+        self._program_lock = threading.Lock()
+        self._program_cache = None  # (chương trình hoặc None, hiệu lực tới (UTC), thời điểm nạp theo monotonic)
 
     def get_all_promotions(self):
         """Returns a list of all promotions, ordered by creation time."""
@@ -22,29 +34,79 @@ class PromotionManager:
             results.append(data)
         return results
 
+    def get_promotions_page(self, page_size: int = DEFAULT_PAGE_SIZE, cursor: str = None) -> Page:
+        """Returns one page of promotions, newest first."""
+        return paginate(self.collection_ref, self.collection_ref, [("created_at", DESCENDING)], page_size, cursor)
+
     def get_active_price_program(self):
         """
         Finds the highest-priority, active price program for the current time.
-        Returns the program data dict or None.
+        Returns the program data dict or None (callers must not modify it: it is cached).
+
+        The result is cached until the active program's end_datetime or the next program's
+        start_datetime, whichever comes first, so repeated calls do not read Firestore.
         """
-        now = datetime.now(timezone.utc).isoformat()
-
-        query = self.collection_ref.where(filter=FieldFilter("promotion_type", "==", "PRICE_PROGRAM")) \
-                                   .where(filter=FieldFilter("is_active", "==", True)) \
-                                   .where(filter=FieldFilter("start_datetime", "<=", now)) \
-                                   .where(filter=FieldFilter("end_datetime", ">=", now)) \
-                                   .order_by("priority", direction=firestore.Query.DESCENDING) \
-                                   .limit(1)
-        
-        active_programs = list(query.stream())
+        now = datetime.now(timezone.utc)
+        with self._program_lock:
+            cached = self._program_cache
+        if cached and now < cached[1] and time.monotonic() - cached[2] < PRICE_PROGRAM_CACHE_SECONDS:
+            return cached[0]
+
+        loaded_at = time.monotonic()
+        try:
+            program, valid_until = self._load_active_price_program(now)
+        except Exception as e:
+            # Mất kết nối: dùng tạm chương trình đã cache (chưa có thì coi như không có chương trình),
+            # thử lại sau một phút
+            logging.warning(f"Cannot refresh active price program, using cached value: {e}")
+            program, valid_until = (cached[0] if cached else None), now + timedelta(minutes=1)
+            loaded_at = time.monotonic()
+        with self._program_lock:
+            self._program_cache = (program, valid_until, loaded_at)
+        return program
 
-        if active_programs:
+    def invalidate_price_program_cache(self):
+        with self._program_lock:
+            self._program_cache = None
+
+    def _load_active_price_program(self, now: datetime):
+        """Chương trình giá đang chạy và thời điểm kết quả có thể thay đổi."""
+        now_iso = now.isoformat()
+        price_programs = self.collection_ref.where(filter=FieldFilter("promotion_type", "==", "PRICE_PROGRAM")) \
+                                            .where(filter=FieldFilter("is_active", "==", True))
+
+        active_query = price_programs.where(filter=FieldFilter("start_datetime", "<=", now_iso)) \
+                                     .where(filter=FieldFilter("end_datetime", ">=", now_iso)) \
+                                     .order_by("priority", direction=firestore.Query.DESCENDING) \
+                                     .limit(1)
+        # Chương trình sắp bắt đầu sớm nhất (có thể thay thế chương trình hiện tại)
+        upcoming_query = price_programs.where(filter=FieldFilter("start_datetime", ">", now_iso)) \
+                                       .order_by("start_datetime") \
+                                       .limit(1)
+        fetched = fan_out({
+            'active': lambda: list(active_query.stream()),
+            'upcoming': lambda: list(upcoming_query.stream()),
+        })
+
+        program = None
+        boundaries = []
+        if fetched['active']:
             # Return the first (and only) document's data
-            program = active_programs[0].to_dict()
-            program['id'] = active_programs[0].id # Thêm ID để tham chiếu
-            return program
-        
-        return None
+            program = fetched['active'][0].to_dict()
+            program['id'] = fetched['active'][0].id # Thêm ID để tham chiếu
+            boundaries.append(program.get('end_datetime'))
+        if fetched['upcoming']:
+            boundaries.append(fetched['upcoming'][0].to_dict().get('start_datetime'))
+
+        valid_until = datetime.max.replace(tzinfo=timezone.utc)
+        for boundary in boundaries:
+            try:
+                boundary = _to_utc(boundary)
+            except (AttributeError, TypeError, ValueError) as e:
+                logging.warning(f"Invalid price program boundary {boundary!r}: {e}")
+                continue
+            valid_until = min(valid_until, boundary)
+        return program, valid_until
 
     def check_and_initialize(self):
         """
@@ -92,6 +154,7 @@ class PromotionManager:
             # Add created_at timestamp
             promo_data['created_at'] = datetime.now(timezone.utc).isoformat()
             self.collection_ref.add(promo_data)
+            self.invalidate_price_program_cache()
             return True, "Tạo chương trình khuyến mãi thành công."
         except Exception as e:
             st.error(f"Lỗi khi tạo chương trình khuyến mãi: {e}")
@@ -103,6 +166,7 @@ class PromotionManager:
         """
         try:
             self.collection_ref.document(promo_id).update({"is_active": is_active})
+            self.invalidate_price_program_cache()
             return True, f"Đã cập nhật trạng thái của chương trình {promo_id}."
         except Exception as e:
             st.error(f"Lỗi khi cập nhật trạng thái: {e}")
@@ -199,3 +263,11 @@ class PromotionManager:
         limit_value = program.get('rules', {}).get('manual_extra_limit', {}).get('value', 0)
         
         return limit_value > 0
+
+
+def _to_utc(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
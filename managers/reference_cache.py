@@ -0,0 +1,61 @@
+import copy
+import threading
+import time
+
+# TTL (giây) cho từng collection dữ liệu tham chiếu. Các collection này gần như
+# không đổi trong ngày, nên mỗi lần rerun Streamlit không cần đọc lại Firestore.
+REFERENCE_TTLS = {
+    'branches': 600,
+    'categories': 600,
+    'units': 3600,
+    'cost_groups': 1800,
+    'cost_allocation_rules': 1800,
+    'settings': 300,
+}
+DEFAULT_TTL = 300
+
+
+class ReferenceCache:
+    """
+    Cache đọc-xuyên (read-through) có TTL cho dữ liệu tham chiếu, dùng chung cho cả process.
+    Khóa là tuple mà phần tử đầu tiên là tên collection, ví dụ ('branches', True).
+    Các hàm create/update/delete của manager gọi invalidate(collection) sau khi ghi.
+    """
+    def __init__(self, ttls: dict = None):
+        self.ttls = {**REFERENCE_TTLS, **(ttls or {})}
+        self._entries = {}
+        # Đếm số lần invalidate theo collection, để một lần tải đang chạy song song
+        # với thao tác ghi không lưu lại dữ liệu cũ vào cache.
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key: tuple, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            generation = self._generations.get(key[0], 0)
+        if entry and entry[0] > now:
+            return copy.deepcopy(entry[1])
+
+        value = loader()
+        ttl = self.ttls.get(key[0], DEFAULT_TTL)
+        with self._lock:
+            if self._generations.get(key[0], 0) == generation:
+                self._entries[key] = (now + ttl, value)
+        # Trả về bản sao để người gọi có thể sửa dict mà không làm hỏng cache
+        return copy.deepcopy(value)
+
+    def invalidate(self, collection: str):
+        """Xóa mọi khóa thuộc một collection."""
+        with self._lock:
+            self._generations[collection] = self._generations.get(collection, 0) + 1
+            for key in [k for k in self._entries if k[0] == collection]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Instance dùng chung cho toàn bộ process
+reference_cache = ReferenceCache()
@@ -0,0 +1,147 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+from google.cloud import firestore
+
+REPORT_INVALIDATIONS_COLLECTION = 'report_invalidations'
+# AnalyticsStore đọc lại các đơn có created_at trong khoảng này trước watermark ở mỗi lần đồng bộ,
+# để không bỏ sót đơn được ghi sau một đơn có created_at muộn hơn (created_at do máy bán hàng đặt)
+ANALYTICS_SYNC_OVERLAP_SECONDS = 600
+# Khóa chi nhánh của báo cáo toàn hệ thống
+ALL_BRANCHES_KEY = '*'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_days (
+    kind TEXT NOT NULL,                  -- loại báo cáo kèm phiên bản cách tính, VD 'pnl_v1'
+    branch_key TEXT NOT NULL,            -- branch_id, hoặc '*' cho toàn hệ thống
+    day TEXT NOT NULL,                   -- YYYY-MM-DD
+    generation INTEGER NOT NULL,         -- thế hệ của ngày (ReportInvalidations) lúc tính
+    data TEXT NOT NULL,
+    computed_at TEXT NOT NULL,
+    PRIMARY KEY (kind, branch_key, day)
+);
+"""
+
+
+class ReportDayCache:
+    """
+    Kết quả báo cáo theo (chi nhánh, ngày) lưu trên đĩa (SQLite), giữ qua các lần khởi động lại.
+    Chỉ lưu ngày đã đóng (trước hôm nay): số liệu của ngày đó chỉ đổi khi có thao tác ghi lùi ngày,
+    và khi đó ReportInvalidations tăng thế hệ của ngày nên bản lưu cũ bị bỏ qua.
+    """
+    def __init__(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Mất vài dòng cuối khi mất điện chỉ khiến các ngày đó được tính lại
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def load(self, kind: str, branch_key: str, start_day: date, end_day: date) -> dict:
+        """{ngày ISO: (generation, data)} của các ngày đã lưu trong khoảng."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, generation, data FROM report_days WHERE kind = ? AND branch_key = ? AND day BETWEEN ? AND ?",
+                (kind, branch_key, start_day.isoformat(), end_day.isoformat()),
+            ).fetchall()
+        return {day: (generation, json.loads(data)) for day, generation, data in rows}
+
+    def save(self, kind: str, branch_key: str, days: dict):
+        """Ghi (hoặc ghi đè) kết quả của các ngày: days = {ngày ISO: (generation, data)}."""
+        if not days:
+            return
+        computed_at = datetime.now().isoformat()
+        rows = [
+            (kind, branch_key, day, generation, json.dumps(data, ensure_ascii=False), computed_at)
+            for day, (generation, data) in days.items()
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO report_days VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def clear(self, kind: str = None):
+        with self._lock:
+            if kind is None:
+                self._conn.execute("DELETE FROM report_days")
+            else:
+                self._conn.execute("DELETE FROM report_days WHERE kind = ?", (kind,))
+
+
+class ReportInvalidations:
+    """
+    Thế hệ (generation) của từng ngày đã đóng: report_invalidations/{YYYY-MM}, field days.{YYYY-MM-DD}.
+
+    Các thao tác ghi làm đổi số liệu của một ngày trong quá khứ (đơn offline đồng bộ muộn, chi phí ghi lùi ngày,
+    phân bổ chi phí, tính lại daily_sales) tăng thế hệ của ngày đó. Kết quả đã lưu trong ReportDayCache
+    với thế hệ cũ sẽ được tính lại, ở mọi process/máy dùng chung Firestore; AnalyticsStore đọc lại đơn của ngày đó.
+    Ngày chưa từng bị invalidate có thế hệ 0.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.collection(REPORT_INVALIDATIONS_COLLECTION)
+
+    def invalidate_days(self, days, writer=None):
+        """
+        Tăng thế hệ của các ngày trước hôm nay trong days (hôm nay trở đi không được cache nên bỏ qua).
+        writer: transaction hoặc WriteBatch để ghi cùng thao tác làm đổi số liệu; không có thì ghi ngay.
+        """
+        today = datetime.now().date()
+        self._increment_days([day for day in set(days) if day < today], writer)
+
+    def invalidate_order(self, created_at: datetime, writer=None):
+        """
+        Invalidate ngày của một đơn vừa ghi: ngày đã qua như invalidate_days; đơn của hôm nay chỉ khi
+        created_at cũ hơn ANALYTICS_SYNC_OVERLAP_SECONDS (đơn offline đồng bộ muộn), vì AnalyticsStore
+        có thể đã đồng bộ qua thời điểm đó. Đơn ghi ngay khi bán không ghi gì.
+        """
+        day = created_at.date()
+        if day < datetime.now().date() or created_at < datetime.now() - timedelta(seconds=ANALYTICS_SYNC_OVERLAP_SECONDS):
+            self._increment_days([day], writer)
+
+    def _increment_days(self, days, writer=None):
+        by_month = {}
+        for day in days:
+            by_month.setdefault(day.strftime('%Y-%m'), {})[day.isoformat()] = firestore.Increment(1)
+        for month, increments in by_month.items():
+            data = {'days': increments, 'updated_at': datetime.now().isoformat()}
+            month_ref = self.collection.document(month)
+            if writer is not None:
+                writer.set(month_ref, data, merge=True)
+            else:
+                month_ref.set(data, merge=True)
+
+    def invalidate_range(self, start_day: date, end_day: date):
+        days = []
+        day = start_day
+        while day <= end_day:
+            days.append(day)
+            day += timedelta(days=1)
+        self.invalidate_days(days)
+
+    def get_generations(self, start_day: date, end_day: date) -> dict:
+        """{ngày ISO: thế hệ} của các ngày đã từng bị invalidate trong khoảng; một get_all cho mọi tháng."""
+        refs = []
+        month = start_day.replace(day=1)
+        while month <= end_day:
+            refs.append(self.collection.document(month.strftime('%Y-%m')))
+            month = (month + timedelta(days=32)).replace(day=1)
+        generations = {}
+        for snapshot in self.db.get_all(refs):
+            if snapshot.exists:
+                generations.update((snapshot.to_dict() or {}).get('days', {}))
+        return generations
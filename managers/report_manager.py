@@ -1,48 +1,91 @@
 
-from datetime import datetime, timedelta
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
 from google.cloud.firestore import Query
+import numpy as np
 import pandas as pd
 from dateutil.relativedelta import relativedelta
 
+from .concurrency import fan_out
+from .order_sequence import order_id_range
+from .daily_sales import DailySalesRollup
+from .report_cache import ALL_BRANCHES_KEY, ReportDayCache, ReportInvalidations
 from .cost_manager import CostManager 
 
+# Các trường chi phí mà P&L cần (gồm cả trường dùng để lọc trong query_cost_entries)
+PNL_COST_ENTRY_FIELDS = [
+    'id', 'branch_id', 'group_id', 'amount', 'entry_date', 'classification',
+    'is_amortized', 'amortization_months', 'status', 'source_entry_id',
+]
+
+# Báo cáo doanh thu: số đơn gom lại trước khi rút gọn bằng groupby (bộ nhớ tỉ lệ với khối này + số ngày + số SKU)
+REVENUE_CHUNK_SIZE = 5000
+REVENUE_ORDER_FIELDS = ['created_at', 'grand_total', 'total_cogs', 'items']
+TOP_PRODUCTS_LIMIT = 5
+
+# Tổng của P&L tính bằng aggregation query (count/sum) phía Firestore: mỗi truy vấn phủ tối đa
+# chừng này ngày để không chạm giới hạn thời gian của aggregation query khi dữ liệu lớn
+AGGREGATION_MAX_DAYS = 31
+# Sau khi aggregation query lỗi (thiếu composite index...), đọc theo luồng trong khoảng này rồi mới thử lại
+AGGREGATION_RETRY_SECONDS = 600
+
+# Khóa của P&L theo ngày trong ReportDayCache; đổi phiên bản khi đổi cách tính hoặc định dạng dữ liệu lưu
+PNL_CACHE_KIND = 'pnl_v1'
+
+# Nguồn dữ liệu của báo cáo: Firestore (mặc định) hoặc kho phân tích Parquet cục bộ (AnalyticsStore)
+REPORT_SOURCE_FIRESTORE = 'firestore'
+REPORT_SOURCE_ANALYTICS = 'analytics'
+
 class ReportManager:
-    def __init__(self, firebase_client, cost_mgr: CostManager):
+    def __init__(self, firebase_client, cost_mgr: CostManager, day_cache: ReportDayCache = None,
+                 analytics_store=None):
         self.db = firebase_client.db
         self.cost_mgr = cost_mgr
+        # Có day_cache: P&L của các ngày đã đóng được lưu lại, mỗi lần xem chỉ tính lại hôm nay
+        # và các ngày đã bị invalidate
+        self.day_cache = day_cache
+        self.report_invalidations = ReportInvalidations(self.db)
+        # Có analytics_store: báo cáo có thể chạy trên bản sao Parquet cục bộ (source=REPORT_SOURCE_ANALYTICS)
+        self.analytics_store = analytics_store
         self.orders_collection = self.db.collection('orders')
         self.products_collection = self.db.collection('products')
+        self.daily_sales = DailySalesRollup(self.db)
+        self._aggregation_lock = threading.Lock()
+        self._aggregation_failed_at = {}  # dạng truy vấn ('branch' / 'all') -> time.monotonic() lần lỗi gần nhất
 
     def get_profit_loss_statement(self, start_date: datetime, end_date: datetime, branch_id: str = None):
         """
         Tạo Báo cáo Kết quả Kinh doanh (P&L), bao gồm cả dữ liệu phân tích chi phí.
         """
-        # 1. TÍNH DOANH THU VÀ GIÁ VỐN
-        query = self.orders_collection
-        branch_ids_for_query = []
+        if self.day_cache is not None and _is_whole_days(start_date, end_date):
+            daily_parts, cost_groups = self._pnl_days(start_date.date(), end_date.date(), branch_id)
+            total_revenue, total_cogs, order_count = _combine_sales(
+                (part['revenue'], part['cogs'], part['order_count']) for part in daily_parts
+            )
+            cost_entries = [entry for part in daily_parts for entry in part['cost_entries']]
+        else:
+            # Các truy vấn độc lập (tổng bán hàng, chi phí, nhóm chi phí) chạy song song trong một lượt
+            cost_filters = {
+                'start_date': start_date.isoformat(),
+                'end_date': end_date.isoformat(),
+            }
+            # Phân quyền chi nhánh cho chi phí
+            if branch_id:
+                cost_filters['branch_id'] = branch_id
 
-        # Nếu không có branch_id cụ thể, query tất cả các chi nhánh
-        if branch_id:
-             branch_ids_for_query = [branch_id]
-        # Nếu là admin và xem all, để rỗng để query_cost_entries tự xử lý
-
-        # Query orders
-        order_query = self.orders_collection.where('status', '==', 'COMPLETED')\
-                                       .where('created_at', '>=', start_date.isoformat())\
-                                       .where('created_at', '<=', end_date.isoformat())
-        if branch_id:
-            order_query = order_query.where('branch_id', '==', branch_id)
-
-        orders = order_query.stream()
-        total_revenue = 0
-        total_cogs = 0
-        order_count = 0
-        for order in orders:
-            order_data = order.to_dict()
-            total_revenue += order_data.get('grand_total', 0)
-            total_cogs += order_data.get('total_cogs', 0)
-            order_count += 1
+            sales_calls = self._sales_calls(start_date, end_date, branch_id)
+            fetched = fan_out({
+                **sales_calls,
+                'cost_entries': lambda: self.cost_mgr.query_cost_entries(filters=cost_filters, fields=PNL_COST_ENTRY_FIELDS),
+                'cost_groups': self.cost_mgr.get_cost_groups,
+            })
+            total_revenue, total_cogs, order_count = _combine_sales(fetched[name] for name in sales_calls)
+            cost_entries = fetched['cost_entries']
+            cost_groups = fetched['cost_groups']
 
+        # 1. TÍNH DOANH THU VÀ GIÁ VỐN
         gross_profit = total_revenue - total_cogs
 
         # 2. TÍNH CHI PHÍ HOẠT ĐỘNG (OPERATING EXPENSES)
@@ -51,20 +94,8 @@ class ReportManager:
         op_expenses_by_classification = {}
         total_op_expenses = 0
 
-        # Lấy chi phí
-        cost_filters = {
-            'start_date': start_date.isoformat(),
-            'end_date': end_date.isoformat(),
-        }
-        # Phân quyền chi nhánh cho chi phí
-        if branch_id:
-            cost_filters['branch_id'] = branch_id
-        
-        cost_entries = self.cost_mgr.query_cost_entries(filters=cost_filters)
-        
-        # Lấy thông tin nhóm chi phí để mapping tên
-        cost_groups_raw = self.cost_mgr.get_cost_groups()
-        cost_groups = {g['id']: g['group_name'] for g in cost_groups_raw}
+        # Thông tin nhóm chi phí để mapping tên
+        cost_groups = {g['id']: g['group_name'] for g in cost_groups}
 
         for entry in cost_entries:
             # Tính toán số tiền chi phí thực tế trong kỳ (xử lý phân bổ)
@@ -107,6 +138,397 @@ class ReportManager:
             "net_profit": net_profit
         }
 
+    def _pnl_days(self, start_day, end_day, branch_id: str = None):
+        """
+        Số liệu P&L từng ngày từ start_day đến end_day: ([{revenue, cogs, order_count, cost_entries}], cost_groups).
+        Ngày đã đóng lấy từ day_cache nếu thế hệ của ngày chưa đổi; chỉ hôm nay, các ngày chưa lưu
+        hoặc đã bị invalidate được tính lại (mỗi đoạn ngày liên tiếp: tổng bán theo ngày + chi phí của đoạn).
+        """
+        branch_key = branch_id or ALL_BRANCHES_KEY
+        today = datetime.now().date()
+        fetched = fan_out({
+            'generations': lambda: self.report_invalidations.get_generations(start_day, end_day),
+            'cost_groups': self.cost_mgr.get_cost_groups,
+        })
+        generations, cost_groups = fetched['generations'], fetched['cost_groups']
+        cached = self.day_cache.load(PNL_CACHE_KIND, branch_key, start_day, end_day)
+
+        parts, missing = {}, []
+        for day in _days_between(start_day, end_day):
+            entry = cached.get(day.isoformat())
+            if day < today and entry and entry[0] == generations.get(day.isoformat(), 0):
+                parts[day.isoformat()] = entry[1]
+            else:
+                missing.append(day)
+
+        runs = _contiguous_runs(missing)
+        calls = {}
+        for run_start, run_end in runs:
+            # Chi phí nhập từ form có entry_date chỉ gồm ngày ('YYYY-MM-DD'): cận dưới cũng chỉ là ngày để không bỏ sót
+            cost_filters = {
+                'start_date': run_start.isoformat(),
+                'end_date': datetime.combine(run_end, datetime.max.time()).isoformat(),
+            }
+            if branch_id:
+                cost_filters['branch_id'] = branch_id
+            calls[('sales', run_start)] = lambda s=run_start, e=run_end: self._daily_sales_totals(s, e, branch_id)
+            calls[('costs', run_start)] = lambda f=cost_filters: self.cost_mgr.query_cost_entries(filters=f, fields=PNL_COST_ENTRY_FIELDS)
+        fetched = fan_out(calls)
+
+        closed = {}
+        for run_start, run_end in runs:
+            fresh = {
+                day.isoformat(): {'revenue': 0, 'cogs': 0, 'order_count': 0, 'cost_entries': []}
+                for day in _days_between(run_start, run_end)
+            }
+            for day_key, (revenue, cogs, count) in fetched[('sales', run_start)].items():
+                fresh[day_key].update(revenue=revenue, cogs=cogs, order_count=count)
+            for entry in fetched[('costs', run_start)]:
+                fresh[entry['entry_date'][:10]]['cost_entries'].append(entry)
+            parts.update(fresh)
+            # Lưu với thế hệ đọc trước khi tính: ghi lùi ngày xảy ra trong lúc tính sẽ khiến lần sau tính lại
+            closed.update(
+                (day_key, (generations.get(day_key, 0), part))
+                for day_key, part in fresh.items() if date.fromisoformat(day_key) < today
+            )
+        if closed:
+            try:
+                self.day_cache.save(PNL_CACHE_KIND, branch_key, closed)
+            except Exception as e:
+                logging.warning(f"Cannot save P&L day cache: {e}")
+        return [parts[day.isoformat()] for day in _days_between(start_day, end_day)], cost_groups
+
+    def get_revenue_report(self, start_date: datetime, end_date: datetime, branch_ids: list,
+                           source: str = REPORT_SOURCE_FIRESTORE):
+        """
+        Báo cáo doanh thu của các chi nhánh trong kỳ. Trả về (success, data, message), data gồm
+        total_revenue, total_profit (lợi nhuận gộp), total_orders, average_order_value,
+        revenue_by_day (DataFrame theo ngày) và top_products_by_revenue.
+
+        Các ngày trọn vẹn đọc từ daily_sales (một document mỗi chi nhánh-ngày). Phần còn lại đọc đơn hàng
+        của từng chi nhánh song song, chỉ các field cần thiết, và rút gọn từng khối REVENUE_CHUNK_SIZE đơn
+        bằng groupby của pandas, nên bộ nhớ không tăng theo số đơn.
+        source=REPORT_SOURCE_ANALYTICS: tính trên AnalyticsStore, không đọc Firestore (số liệu tới lần đồng bộ gần nhất).
+        """
+        try:
+            if not branch_ids:
+                return False, {}, "Chưa chọn chi nhánh."
+
+            if source == REPORT_SOURCE_ANALYTICS:
+                if self.analytics_store is None:
+                    return False, {}, "Chưa bật kho phân tích cục bộ."
+                daily, products, names = self._analytics_revenue_frames(start_date, end_date, branch_ids)
+                daily_parts, product_parts = [daily], [products]
+            else:
+                daily_parts, product_parts, names = self._firestore_revenue_frames(start_date, end_date, branch_ids)
+
+            all_days = pd.date_range(start_date.date(), end_date.date(), freq='D')
+            daily = _combine_frames(daily_parts, ['revenue', 'cogs', 'orders'])
+            daily = daily.reindex(all_days.strftime('%Y-%m-%d'), fill_value=0)
+            products = _combine_frames(product_parts, ['quantity', 'revenue'])
+
+            total_revenue = float(daily['revenue'].sum())
+            total_cogs = float(daily['cogs'].sum())
+            total_orders = int(daily['orders'].sum())
+
+            top = products.nlargest(TOP_PRODUCTS_LIMIT, 'revenue')
+            missing = [sku for sku in top.index if sku not in names]
+            if missing:
+                # Rollup chỉ lưu SKU: lấy tên của các sản phẩm trong top còn thiếu
+                refs = [self.products_collection.document(sku) for sku in missing]
+                for snapshot in self.db.get_all(refs, field_paths=['name']):
+                    if snapshot.exists:
+                        names[snapshot.id] = snapshot.to_dict().get('name', snapshot.id)
+
+            data = {
+                "total_revenue": round(total_revenue),
+                "total_profit": round(total_revenue - total_cogs),
+                "total_orders": total_orders,
+                "average_order_value": round(total_revenue / total_orders) if total_orders else 0,
+                "revenue_by_day": pd.DataFrame({"Doanh thu": daily['revenue'].to_numpy()}, index=all_days),
+                "top_products_by_revenue": pd.DataFrame({
+                    "SKU": top.index,
+                    "Sản phẩm": [names.get(sku, sku) for sku in top.index],
+                    "Số lượng": top['quantity'].astype(int).to_numpy(),
+                    "Doanh thu": top['revenue'].round().to_numpy(),
+                }),
+            }
+            return True, data, ""
+        except Exception as e:
+            logging.error(f"Error building revenue report: {e}")
+            return False, {}, str(e)
+
+    def _firestore_revenue_frames(self, start_date: datetime, end_date: datetime, branch_ids: list):
+        """([DataFrame theo ngày], [DataFrame theo SKU], {sku: tên}) của báo cáo doanh thu, đọc từ Firestore."""
+        rollup_days, windows = self._split_rollup_range(start_date, end_date)
+        calls = {}
+        if rollup_days:
+            calls['rollups'] = lambda: self.daily_sales.load_days(*rollup_days, branch_ids)
+        for i, (window_start, window_end) in enumerate(windows):
+            for branch_id in branch_ids:
+                calls[(i, branch_id)] = lambda s=window_start, e=window_end, b=branch_id: self._aggregate_order_sales(s, e, b)
+        fetched = fan_out(calls)
+
+        daily_parts, product_parts, names = [], [], {}
+        rollups = fetched.pop('rollups', None)
+        if rollups:
+            daily, products = _rollup_frames(rollups)
+            daily_parts.append(daily)
+            product_parts.append(products)
+        for daily, products, part_names in fetched.values():
+            daily_parts.append(daily)
+            product_parts.append(products)
+            for sku, name in part_names.items():
+                names.setdefault(sku, name)
+        return daily_parts, product_parts, names
+
+    def _analytics_revenue_frames(self, start_date: datetime, end_date: datetime, branch_ids: list):
+        """(theo ngày, theo SKU, {sku: tên}) của báo cáo doanh thu, cùng định dạng với _order_frames, từ AnalyticsStore."""
+        orders = self.analytics_store.load_orders(start_date, end_date, branch_ids, columns=['day', 'grand_total', 'total_cogs'])
+        items = self.analytics_store.load_items(start_date, end_date, branch_ids, columns=['sku', 'name', 'quantity', 'revenue'])
+        daily = orders.groupby('day').agg(revenue=('grand_total', 'sum'), cogs=('total_cogs', 'sum'), orders=('grand_total', 'size'))
+        products = items.groupby('sku')[['quantity', 'revenue']].sum()
+        names = items.drop_duplicates('sku', keep='last').set_index('sku')['name'].to_dict()
+        return daily, products, names
+
+    def get_profit_analysis(self, start_date: datetime, end_date: datetime, branch_ids: list, freq: str = 'D'):
+        """
+        Phân tích lợi nhuận gộp trên AnalyticsStore (không đọc Firestore). Trả về (success, data, message), data gồm
+        profit_by_period (doanh thu, giá vốn, lợi nhuận gộp theo kỳ freq: 'D' ngày, 'W' tuần, 'MS' tháng),
+        profit_by_branch và top_products_by_profit (TOP_PRODUCTS_LIMIT SKU có lợi nhuận gộp cao nhất).
+        """
+        try:
+            if self.analytics_store is None:
+                return False, {}, "Chưa bật kho phân tích cục bộ."
+            if not branch_ids:
+                return False, {}, "Chưa chọn chi nhánh."
+
+            orders = self.analytics_store.load_orders(
+                start_date, end_date, branch_ids, columns=['created_at', 'branch_id', 'grand_total', 'total_cogs']
+            )
+            items = self.analytics_store.load_items(
+                start_date, end_date, branch_ids, columns=['sku', 'name', 'quantity', 'revenue', 'line_cogs']
+            )
+            orders['gross_profit'] = orders['grand_total'] - orders['total_cogs']
+            columns = {'grand_total': 'Doanh thu', 'total_cogs': 'Giá vốn', 'gross_profit': 'Lợi nhuận gộp'}
+
+            by_period = orders.set_index('created_at')[list(columns)].resample(freq).sum()
+            by_branch = orders.groupby('branch_id')[list(columns)].sum().sort_values('gross_profit', ascending=False)
+
+            items['gross_profit'] = items['revenue'] - items['line_cogs']
+            products = items.groupby('sku').agg(
+                name=('name', 'last'), quantity=('quantity', 'sum'), revenue=('revenue', 'sum'), gross_profit=('gross_profit', 'sum'),
+            ).nlargest(TOP_PRODUCTS_LIMIT, 'gross_profit')
+
+            data = {
+                "profit_by_period": by_period.rename(columns=columns),
+                "profit_by_branch": by_branch.rename(columns=columns),
+                "top_products_by_profit": pd.DataFrame({
+                    "SKU": products.index,
+                    "Sản phẩm": products['name'].to_numpy(),
+                    "Số lượng": products['quantity'].astype(int).to_numpy(),
+                    "Doanh thu": products['revenue'].round().to_numpy(),
+                    "Lợi nhuận gộp": products['gross_profit'].round().to_numpy(),
+                }),
+            }
+            return True, data, ""
+        except Exception as e:
+            logging.error(f"Error building profit analysis: {e}")
+            return False, {}, str(e)
+
+    def _aggregate_order_sales(self, start_date: datetime, end_date: datetime, branch_id: str):
+        """
+        (doanh thu theo ngày, doanh thu theo SKU, {sku: tên}) từ đơn hàng của một chi nhánh trong khoảng thời gian.
+        Đơn được đọc theo luồng và rút gọn từng khối REVENUE_CHUNK_SIZE đơn.
+        """
+        start_iso, end_iso = start_date.isoformat(), end_date.isoformat()
+        query = self._completed_orders_query(start_date, end_date, branch_id).select(REVENUE_ORDER_FIELDS)
+        daily, products, names = None, None, {}
+        chunk = []
+
+        def _flush():
+            nonlocal daily, products
+            chunk_daily, chunk_products = _order_frames(chunk, names)
+            daily = _combine_frames([daily, chunk_daily], ['revenue', 'cogs', 'orders'])
+            products = _combine_frames([products, chunk_products], ['quantity', 'revenue'])
+            chunk.clear()
+
+        for doc in query.stream():
+            order = doc.to_dict()
+            if start_iso <= order.get('created_at', '') <= end_iso:
+                chunk.append(order)
+                if len(chunk) >= REVENUE_CHUNK_SIZE:
+                    _flush()
+        _flush()
+        return daily, products, names
+
+    def _sales_calls(self, start_date: datetime, end_date: datetime, branch_id: str = None) -> dict:
+        """
+        Các lời gọi độc lập, mỗi lời gọi trả về (doanh thu, giá vốn, số đơn) của một phần kỳ báo cáo;
+        chạy chung một fan_out rồi cộng lại bằng _combine_sales.
+        Các ngày trọn vẹn (và đã có rollup đầy đủ) đọc từ daily_sales, một document mỗi chi nhánh-ngày;
+        phần lẻ của ngày đầu/cuối kỳ và các ngày trước khi backfill tính từ đơn hàng,
+        mỗi khoảng tối đa AGGREGATION_MAX_DAYS ngày là một aggregation query.
+        Theo chi nhánh thì phần lẻ của ngày đầu/cuối được tách riêng để các ngày trọn vẹn
+        quét theo khoảng mã đơn, chỉ phần lẻ mới lọc theo created_at.
+        """
+        rollup_days, windows = self._split_rollup_range(start_date, end_date)
+        calls = {}
+        if rollup_days is not None:
+            calls[('sales', 'rollups')] = lambda: _rollup_totals(
+                self.daily_sales.load_days(*rollup_days, [branch_id] if branch_id else None)
+            )
+        for window_start, window_end in windows:
+            sub_ranges = _split_by_days(window_start, window_end, AGGREGATION_MAX_DAYS)
+            if branch_id:
+                sub_ranges = [part for sub_start, sub_end in sub_ranges
+                              for part in _split_partial_edges(sub_start, sub_end)]
+            for sub_start, sub_end in sub_ranges:
+                calls[('sales', sub_start)] = lambda s=sub_start, e=sub_end: self._sum_completed_orders(s, e, branch_id)
+        return calls
+
+    def _split_rollup_range(self, start_date: datetime, end_date: datetime):
+        """
+        Chia kỳ báo cáo thành ((ngày đầu, ngày cuối) đọc từ daily_sales, [các khoảng (start, end) phải đọc từ đơn hàng]).
+        Chỉ các ngày trọn vẹn từ complete_from trở đi được đọc từ rollup; nếu không có ngày nào thì trả về (None, [cả kỳ]).
+        """
+        complete_from = self.daily_sales.get_complete_from()
+        first_day = start_date.date() if start_date.time() == datetime.min.time() else start_date.date() + timedelta(days=1)
+        last_day = end_date.date() if end_date.time() == datetime.max.time() else end_date.date() - timedelta(days=1)
+        if complete_from:
+            first_day = max(first_day, complete_from)
+        if not complete_from or first_day > last_day:
+            return None, [(start_date, end_date)]
+
+        windows = []
+        rollup_start = datetime.combine(first_day, datetime.min.time())
+        rollup_end = datetime.combine(last_day, datetime.max.time())
+        if start_date < rollup_start:
+            windows.append((start_date, rollup_start - timedelta(microseconds=1)))
+        if end_date > rollup_end:
+            windows.append((rollup_end + timedelta(microseconds=1), end_date))
+        return (first_day, last_day), windows
+
+    def rebuild_daily_sales(self, branch_ids: list, start_day=None) -> int:
+        """
+        Backfill daily_sales cho các chi nhánh từ start_day (mặc định: ngày của đơn hàng đầu tiên) đến hôm nay.
+        Trả về số document rollup đã ghi.
+        """
+        if start_day is None:
+            first_orders = list(self.orders_collection.order_by('created_at').limit(1).select(['created_at']).stream())
+            if not first_orders:
+                return 0
+            start_day = datetime.fromisoformat(first_orders[0].to_dict()['created_at']).date()
+        written = self.daily_sales.rebuild(branch_ids, start_day)
+        # Báo cáo đã lưu của các ngày này có thể đã tính từ rollup sai
+        self.report_invalidations.invalidate_range(start_day, datetime.now().date() - timedelta(days=1))
+        return written
+
+    def invalidate_report_days(self, start_day, end_day):
+        """Buộc tính lại báo cáo đã lưu của các ngày từ start_day đến end_day (ở mọi máy dùng chung Firestore)."""
+        self.report_invalidations.invalidate_range(start_day, end_day)
+
+    def _sum_completed_orders(self, start_date: datetime, end_date: datetime, branch_id: str = None):
+        """
+        Tổng doanh thu, giá vốn và số đơn COMPLETED trong khoảng thời gian.
+        Dùng aggregation query (một RPC, không tải document); nếu lỗi (thiếu index, field...) thì đọc theo luồng.
+        """
+        shape = _aggregation_shape(start_date, end_date, branch_id)
+        with self._aggregation_lock:
+            failed_at = self._aggregation_failed_at.get(shape)
+        if failed_at is None or time.monotonic() - failed_at > AGGREGATION_RETRY_SECONDS:
+            try:
+                return self._aggregate_completed_orders(start_date, end_date, branch_id)
+            except Exception as e:
+                logging.warning(f"Aggregation query for orders ({shape}) failed, streaming instead: {e}")
+                with self._aggregation_lock:
+                    self._aggregation_failed_at[shape] = time.monotonic()
+        return self._stream_completed_orders(start_date, end_date, branch_id)
+
+    def _aggregate_completed_orders(self, start_date: datetime, end_date: datetime, branch_id: str = None):
+        if branch_id and _is_whole_days(start_date, end_date):
+            # Trọn ngày: quét khoảng mã đơn như _completed_orders_query, không cần composite index
+            order_query = self._completed_orders_query(start_date, end_date, branch_id)
+        else:
+            # Phần lẻ của ngày đầu/cuối kỳ cần lọc theo created_at: có branch_id thì cần composite index
+            # (status, branch_id, created_at), không có thì (status, created_at) như truy vấn đọc theo luồng
+            order_query = self.orders_collection.where('status', '==', 'COMPLETED')
+            if branch_id:
+                order_query = order_query.where('branch_id', '==', branch_id)
+            order_query = order_query.where('created_at', '>=', start_date.isoformat())\
+                                     .where('created_at', '<=', end_date.isoformat())
+        results = order_query.count(alias='order_count')\
+                             .sum('grand_total', alias='revenue')\
+                             .sum('total_cogs', alias='cogs')\
+                             .get()
+        values = {result.alias: result.value for result in results[0]}
+        return values['revenue'] or 0, values['cogs'] or 0, values['order_count'] or 0
+
+    def _stream_completed_orders(self, start_date: datetime, end_date: datetime, branch_id: str = None):
+        return _combine_sales(self._stream_completed_orders_by_day(start_date, end_date, branch_id).values())
+
+    def _stream_completed_orders_by_day(self, start_date: datetime, end_date: datetime, branch_id: str = None) -> dict:
+        """{ngày ISO: (doanh thu, giá vốn, số đơn)} của các đơn COMPLETED trong khoảng, đọc theo luồng."""
+        start_iso, end_iso = start_date.isoformat(), end_date.isoformat()
+        order_query = self._completed_orders_query(start_date, end_date, branch_id)
+
+        # P&L chỉ cần tổng tiền và giá vốn, không tải mảng items của từng đơn
+        totals = {}
+        for order in order_query.select(['grand_total', 'total_cogs', 'created_at']).stream():
+            order_data = order.to_dict()
+            created_at = order_data.get('created_at', '')
+            if not start_iso <= created_at <= end_iso:
+                continue
+            revenue, cogs, count = totals.get(created_at[:10], (0, 0, 0))
+            totals[created_at[:10]] = (
+                revenue + order_data.get('grand_total', 0), cogs + order_data.get('total_cogs', 0), count + 1
+            )
+        return totals
+
+    def _daily_sales_totals(self, start_day, end_day, branch_id: str = None) -> dict:
+        """
+        {ngày ISO: (doanh thu, giá vốn, số đơn)} từ start_day đến hết end_day (ngày không bán được gì thì không có).
+        Ngày đã có rollup đọc từ daily_sales, các ngày trước khi backfill đọc đơn hàng.
+        """
+        rollup_days, windows = self._split_rollup_range(
+            datetime.combine(start_day, datetime.min.time()), datetime.combine(end_day, datetime.max.time())
+        )
+        calls = {}
+        if rollup_days is not None:
+            calls['rollups'] = lambda: self.daily_sales.load_days(*rollup_days, [branch_id] if branch_id else None)
+        for i, (window_start, window_end) in enumerate(windows):
+            calls[i] = lambda s=window_start, e=window_end: self._stream_completed_orders_by_day(s, e, branch_id)
+        fetched = fan_out(calls)
+
+        totals = {}
+        for i in range(len(windows)):
+            totals.update(fetched[i])
+        for rollup in fetched.get('rollups', []):
+            revenue, cogs, count = totals.get(rollup['date'], (0, 0, 0))
+            totals[rollup['date']] = (
+                revenue + rollup.get('revenue', 0), cogs + rollup.get('cogs', 0), count + rollup.get('order_count', 0)
+            )
+        return totals
+
+    def _completed_orders_query(self, start_date: datetime, end_date: datetime, branch_id: str = None):
+        """
+        Truy vấn đơn COMPLETED của kỳ. Có branch_id thì quét theo ngày nên có thể dư đơn ngoài giờ
+        của ngày đầu/cuối: người gọi cần lọc lại theo created_at.
+        """
+        if branch_id:
+            # Mã đơn có tiền tố '{branch}-{yymmdd}-': quét khoảng document ID của các ngày trong kỳ
+            # (chỉ cần index một field cho status), rồi cắt theo giờ bằng created_at
+            start_id, end_id = order_id_range(branch_id, start_date.date(), end_date.date())
+            order_query = self.orders_collection.where('status', '==', 'COMPLETED')\
+                                           .order_by('__name__')\
+                                           .start_at({'__name__': self.orders_collection.document(start_id)})\
+                                           .end_before({'__name__': self.orders_collection.document(end_id)})
+        else:
+            order_query = self.orders_collection.where('status', '==', 'COMPLETED')\
+                                           .where('created_at', '>=', start_date.isoformat())\
+                                           .where('created_at', '<=', end_date.isoformat())
+        return order_query
+
     def _calculate_amortized_cost_for_period(self, cost_entry, report_start, report_end) -> float:
         try:
             amount = float(cost_entry['amount'])
@@ -139,3 +561,128 @@ class ReportManager:
         except (ValueError, TypeError, KeyError) as e:
             print(f"Error calculating amortization for entry {cost_entry.get('id')}: {e}")
             return 0
+
+
+def _order_frames(orders: list, names: dict):
+    """Rút gọn một khối đơn hàng thành (theo ngày: revenue, cogs, orders; theo SKU: quantity, revenue)."""
+    if not orders:
+        return None, None
+    orders_df = pd.DataFrame({
+        'date': [order['created_at'][:10] for order in orders],
+        'revenue': np.fromiter((order.get('grand_total', 0) for order in orders), dtype=float, count=len(orders)),
+        'cogs': np.fromiter((order.get('total_cogs', 0) for order in orders), dtype=float, count=len(orders)),
+    })
+    daily = orders_df.groupby('date').agg(revenue=('revenue', 'sum'), cogs=('cogs', 'sum'), orders=('revenue', 'size'))
+
+    items = [item for order in orders for item in order.get('items', [])]
+    if not items:
+        return daily, None
+    for item in items:
+        names.setdefault(item['sku'], item.get('name', item['sku']))
+    items_df = pd.DataFrame({
+        'sku': [item['sku'] for item in items],
+        'quantity': np.fromiter((item.get('quantity', 0) for item in items), dtype=float, count=len(items)),
+        'final_price': np.fromiter((item.get('final_price', 0) for item in items), dtype=float, count=len(items)),
+    })
+    items_df['revenue'] = items_df['quantity'] * items_df['final_price']
+    products = items_df.groupby('sku')[['quantity', 'revenue']].sum()
+    return daily, products
+
+
+def _rollup_frames(rollups: list):
+    """(theo ngày, theo SKU) từ các document daily_sales, cùng định dạng với _order_frames."""
+    daily = pd.DataFrame({
+        'date': [r['date'] for r in rollups],
+        'revenue': [r.get('revenue', 0) for r in rollups],
+        'cogs': [r.get('cogs', 0) for r in rollups],
+        'orders': [r.get('order_count', 0) for r in rollups],
+    }).groupby('date').sum()
+    lines = [(sku, line.get('quantity', 0), line.get('revenue', 0)) for r in rollups for sku, line in r.get('items', {}).items()]
+    products = pd.DataFrame(lines, columns=['sku', 'quantity', 'revenue']).groupby('sku').sum() if lines else None
+    return daily, products
+
+
+def _combine_frames(frames: list, columns: list) -> pd.DataFrame:
+    """Cộng các DataFrame tổng hợp cùng index (ngày hoặc SKU); bỏ qua phần rỗng."""
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns, dtype=float)
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames).groupby(level=0).sum()
+
+
+def _rollup_totals(rollups: list) -> tuple:
+    """(doanh thu, giá vốn, số đơn) của các document daily_sales."""
+    return (
+        sum(r.get('revenue', 0) for r in rollups),
+        sum(r.get('cogs', 0) for r in rollups),
+        sum(r.get('order_count', 0) for r in rollups),
+    )
+
+
+def _combine_sales(parts) -> tuple:
+    """Cộng các bộ (doanh thu, giá vốn, số đơn)."""
+    total_revenue, total_cogs, order_count = 0, 0, 0
+    for revenue, cogs, count in parts:
+        total_revenue += revenue
+        total_cogs += cogs
+        order_count += count
+    return total_revenue, total_cogs, order_count
+
+
+def _split_by_days(start_date: datetime, end_date: datetime, max_days: int) -> list:
+    """Chia [start_date, end_date] thành các khoảng liên tiếp, mỗi khoảng kết thúc ở nửa đêm và dài tối đa max_days ngày."""
+    ranges = []
+    sub_start = start_date
+    while sub_start <= end_date:
+        boundary = datetime.combine(sub_start.date() + timedelta(days=max_days), datetime.min.time())
+        sub_end = min(end_date, boundary - timedelta(microseconds=1))
+        ranges.append((sub_start, sub_end))
+        sub_start = boundary
+    return ranges
+
+
+def _split_partial_edges(start_date: datetime, end_date: datetime) -> list:
+    """Tách phần lẻ của ngày đầu và ngày cuối khỏi các ngày trọn vẹn ở giữa [start_date, end_date]."""
+    first_midnight = datetime.combine(start_date.date(), datetime.min.time())
+    if start_date != first_midnight:
+        first_midnight += timedelta(days=1)
+    last_midnight = datetime.combine(end_date.date() + timedelta(days=1), datetime.min.time())
+    if end_date.time() != datetime.max.time():
+        last_midnight -= timedelta(days=1)
+    if first_midnight >= last_midnight:
+        return [(start_date, end_date)]
+    ranges = []
+    if start_date < first_midnight:
+        ranges.append((start_date, first_midnight - timedelta(microseconds=1)))
+    ranges.append((first_midnight, last_midnight - timedelta(microseconds=1)))
+    if last_midnight <= end_date:
+        ranges.append((last_midnight, end_date))
+    return ranges
+
+
+def _aggregation_shape(start_date: datetime, end_date: datetime, branch_id: str = None) -> str:
+    """Dạng truy vấn của _aggregate_completed_orders, để lỗi thiếu index của dạng này không tắt các dạng khác."""
+    if not branch_id:
+        return 'all'
+    return 'branch_days' if _is_whole_days(start_date, end_date) else 'branch'
+
+
+def _is_whole_days(start_date: datetime, end_date: datetime) -> bool:
+    return start_date.time() == datetime.min.time() and end_date.time() == datetime.max.time()
+
+
+def _days_between(start_day, end_day) -> list:
+    return [start_day + timedelta(days=i) for i in range((end_day - start_day).days + 1)]
+
+
+def _contiguous_runs(days: list) -> list:
+    """Gộp danh sách ngày tăng dần thành các đoạn liên tiếp [(ngày đầu, ngày cuối)]."""
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] + timedelta(days=1) == day:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
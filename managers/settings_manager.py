@@ -1,6 +1,8 @@
 
 import streamlit as st
 
+from managers.reference_cache import reference_cache
+
 class SettingsManager:
     def __init__(self, firebase_client):
         self.db = firebase_client.db
@@ -11,7 +13,11 @@ class SettingsManager:
         """
         Lấy toàn bộ cài đặt của ứng dụng từ Firestore.
         Trả về một dict chứa cài đặt hoặc dict mặc định nếu chưa có.
+        Kết quả được cache theo TTL vì hàm này được gọi ở hầu hết các lần rerun.
         """
+        return reference_cache.get_or_load(('settings', self._settings_doc_id), self._load_settings)
+
+    def _load_settings(self):
         doc_ref = self.collection.document(self._settings_doc_id)
         doc = doc_ref.get()
         if doc.exists:
@@ -28,6 +34,7 @@ class SettingsManager:
         """
         doc_ref = self.collection.document(self._settings_doc_id)
         doc_ref.set(settings_data, merge=True) # Dùng merge=True để an toàn hơn
+        reference_cache.invalidate('settings')
 
     def get_session_config(self):
         """
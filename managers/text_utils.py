@@ -0,0 +1,23 @@
+import re
+import unicodedata
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def fold_text(text) -> str:
+    """
+    Chuẩn hóa chuỗi để so khớp không phân biệt dấu/hoa thường: "Áo Sơ Mi Đỏ" -> "ao so mi do".
+    Ký tự không phải chữ/số được thay bằng khoảng trắng.
+    """
+    if not text:
+        return ""
+    text = str(text).replace('đ', 'd').replace('Đ', 'D')
+    # Tách dấu (NFKD) rồi bỏ mọi ký tự ngoài ASCII, gồm cả dấu thanh/dấu mũ đã tách ra
+    folded = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return _NON_WORD.sub(' ', folded).strip()
+
+
+def tokenize(text) -> list:
+    """Các từ (đã fold_text) của chuỗi, theo thứ tự xuất hiện."""
+    folded = fold_text(text)
+    return folded.split() if folded else []
@@ -28,4 +28,89 @@ def render_branch_selector(allowed_branches_map, default_branch_id):
         # If only one branch, display it as disabled text and return its ID
         single_branch_id = list(allowed_branches_map.keys())[0]
         st.text_input("Chi nhánh", value=allowed_branches_map[single_branch_id], disabled=True)
-        return single_branch_id
\ No newline at end of file
+        return single_branch_id
+
+# --------------------------------------------------------------------------
+# PHÂN TRANG
+# --------------------------------------------------------------------------
+
+def get_page_cursor(key: str, filters=None):
+    """
+    Cursor của trang đang xem cho danh sách `key`, lưu trong session_state.
+    Khi `filters` thay đổi (VD: đổi chi nhánh, trạng thái) danh sách quay về trang đầu.
+    """
+    state_key = f"pager_{key}"
+    state = st.session_state.get(state_key)
+    if state is None or state['filters'] != filters:
+        state = {'filters': filters, 'cursors': [None], 'index': 0, 'total': None}
+        st.session_state[state_key] = state
+    return state['cursors'][state['index']]
+
+
+def reset_pager(key: str):
+    st.session_state.pop(f"pager_{key}", None)
+
+
+def get_offset_page(key: str, total: int, page_size: int, filters=None):
+    """
+    (start, end) của trang đang xem cho danh sách trong bộ nhớ có `total` phần tử.
+    Khi `filters` thay đổi danh sách quay về trang đầu.
+    """
+    state_key = f"offset_pager_{key}"
+    state = st.session_state.get(state_key)
+    if state is None or state['filters'] != filters:
+        state = {'filters': filters, 'index': 0}
+        st.session_state[state_key] = state
+    last_index = max(0, (total - 1) // page_size)
+    state['index'] = min(state['index'], last_index)
+    start = state['index'] * page_size
+    return start, min(start + page_size, total)
+
+
+def render_offset_pager(key: str, total: int, page_size: int):
+    """Thanh điều hướng Trước/Sau cho get_offset_page."""
+    state = st.session_state.get(f"offset_pager_{key}")
+    total_pages = max(1, -(-total // page_size))
+    if state is None or total_pages <= 1:
+        return
+
+    def go_to(index):
+        state['index'] = index
+
+    prev_col, label_col, next_col = st.columns([1, 3, 1])
+    prev_col.button("◀ Trước", key=f"offset_pager_{key}_prev", on_click=go_to, args=(state['index'] - 1,),
+                    disabled=state['index'] == 0, use_container_width=True)
+    label_col.markdown(f"<div style='text-align:center;padding-top:0.4rem'>Trang {state['index'] + 1} / {total_pages} ({total} sản phẩm)</div>",
+                       unsafe_allow_html=True)
+    next_col.button("Sau ▶", key=f"offset_pager_{key}_next", on_click=go_to, args=(state['index'] + 1,),
+                    disabled=state['index'] >= total_pages - 1, use_container_width=True)
+
+
+def render_pager(key: str, page):
+    """Thanh điều hướng Trước/Sau cho một managers.pagination.Page."""
+    state = st.session_state.get(f"pager_{key}")
+    if state is None:
+        return
+    if page.total_estimate is not None:
+        state['total'] = page.total_estimate
+    if state['index'] == 0 and not page.has_more:
+        return
+
+    def go_previous():
+        state['index'] = max(0, state['index'] - 1)
+
+    def go_next():
+        state['cursors'] = state['cursors'][:state['index'] + 1] + [page.next_cursor]
+        state['index'] += 1
+
+    label = f"Trang {state['index'] + 1}"
+    if state['total'] is not None:
+        total_pages = max(1, -(-state['total'] // page.page_size))
+        label += f" / {total_pages} ({state['total']} bản ghi)"
+
+    prev_col, label_col, next_col = st.columns([1, 3, 1])
+    prev_col.button("◀ Trước", key=f"pager_{key}_prev", on_click=go_previous,
+                    disabled=state['index'] == 0, use_container_width=True)
+    label_col.markdown(f"<div style='text-align:center;padding-top:0.4rem'>{label}</div>", unsafe_allow_html=True)
+    next_col.button("Sau ▶", key=f"pager_{key}_next", on_click=go_next,
+                    disabled=not page.has_more, use_container_width=True)
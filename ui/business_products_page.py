@@ -51,9 +51,9 @@ def render_business_products_page(auth_mgr: AuthManager, branch_mgr: BranchManag
     st.divider()
 
     # --- DỮ LIỆU --- #
-    all_catalog_products = prod_mgr.get_all_products()
-    all_prices = price_mgr.get_all_prices()
-    prices_in_branch = {p['sku']: p for p in all_prices if p.get('branch_id') == selected_branch_id}
+    all_catalog_products = prod_mgr.get_all_products(fields=['sku', 'name'])
+    branch_prices = price_mgr.get_all_prices(fields=['sku', 'price', 'is_active'], branch_id=selected_branch_id)
+    prices_in_branch = {p['sku']: p for p in branch_prices}
     listed_skus = prices_in_branch.keys()
     
     # Lọc ra sản phẩm chưa được niêm yết một cách chính xác
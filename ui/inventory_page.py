@@ -8,7 +8,7 @@ from managers.product_manager import ProductManager
 from managers.branch_manager import BranchManager
 from managers.auth_manager import AuthManager
 # Import UI utils
-from ui._utils import render_page_header, render_branch_selector
+from ui._utils import render_page_header, render_branch_selector, get_page_cursor, render_pager
 
 def render_inventory_page(inv_mgr: InventoryManager, prod_mgr: ProductManager, branch_mgr: BranchManager, auth_mgr: AuthManager):
     # Use the new header utility
@@ -42,7 +42,7 @@ def render_inventory_page(inv_mgr: InventoryManager, prod_mgr: ProductManager, b
     @st.cache_data(ttl=120) # Cache for 2 minutes to improve performance
     def load_data(branch_id):
         branch_inventory_data = inv_mgr.get_inventory_by_branch(branch_id)
-        all_products_data = prod_mgr.get_all_products()
+        all_products_data = prod_mgr.get_all_products(fields=['sku', 'name'])
         return branch_inventory_data, all_products_data
 
     with st.spinner("Đang tải dữ liệu kho..."):
@@ -97,6 +97,25 @@ def render_inventory_page(inv_mgr: InventoryManager, prod_mgr: ProductManager, b
             else:
                  st.info("Chưa có sản phẩm nào trong kho của chi nhánh này.")
 
+        if user_role == 'admin' and branch_inventory:
+            with st.expander("🔥 Chế độ bán chạy (chia tải tồn kho)"):
+                st.caption("Dùng cho sản phẩm nhiều quầy bán cùng lúc (VD: khi chạy khuyến mãi): "
+                           "mỗi lần bán được ghi vào một shard riêng để thanh toán không phải chờ nhau.")
+                hot_options = {sku: f"{product_map.get(sku, {}).get('name', sku)} ({sku})" for sku in branch_inventory}
+                hot_sku = st.selectbox("Sản phẩm", options=list(hot_options.keys()), format_func=lambda x: hot_options[x], key="hot_sku_select")
+                is_hot = branch_inventory[hot_sku].get('hot', False)
+                st.write("Trạng thái: " + ("**Đang chia tải**" if is_hot else "Bình thường"))
+                if st.button("Tắt chế độ bán chạy" if is_hot else "Bật chế độ bán chạy", key="hot_sku_toggle"):
+                    try:
+                        if is_hot:
+                            inv_mgr.unset_hot_sku(hot_sku, selected_branch)
+                        else:
+                            inv_mgr.set_hot_sku(hot_sku, selected_branch)
+                        st.cache_data.clear()
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Không thể cập nhật chế độ bán chạy: {e}")
+
     # =========================================================
     # TAB 2: RECEIVE STOCK
     # =========================================================
@@ -143,17 +162,14 @@ def render_inventory_page(inv_mgr: InventoryManager, prod_mgr: ProductManager, b
     with tab3:
         st.subheader("Lịch sử Thay đổi Kho")
         
-        @st.cache_data(ttl=60)
-        def load_history(branch_id):
-            return inv_mgr.get_inventory_adjustments_history(branch_id=branch_id, limit=200)
-
+        pager_key = f"adjustments_{selected_branch}"
         with st.spinner("Đang tải lịch sử..."):
-            history = load_history(selected_branch)
+            history = inv_mgr.get_inventory_adjustments_page(selected_branch, page_size=50, cursor=get_page_cursor(pager_key))
 
         if not history:
             st.info("Chưa có lịch sử thay đổi nào cho chi nhánh này.")
         else:
-            history_df = pd.DataFrame(history)
+            history_df = pd.DataFrame(history.items)
             history_df['Sản phẩm'] = history_df['sku'].map(lambda s: product_map.get(s, {}).get('name', s))
             history_df['Thời gian'] = pd.to_datetime(history_df['timestamp']).dt.strftime('%d/%m/%Y %H:%M')
             history_df.rename(columns={
@@ -167,3 +183,4 @@ def render_inventory_page(inv_mgr: InventoryManager, prod_mgr: ProductManager, b
             # Reorder columns for better readability
             display_columns = ['Thời gian', 'Sản phẩm', 'Thay đổi', 'Tồn trước', 'Tồn sau', 'Lý do', 'Ghi chú']
             st.dataframe(history_df[display_columns], use_container_width=True, hide_index=True)
+            render_pager(pager_key, history)
@@ -1,6 +1,15 @@
 import streamlit as st
-from datetime import datetime
-from ui._utils import render_page_header, render_branch_selector
+from datetime import datetime, timezone
+from managers.concurrency import fan_out
+from managers.customer_manager import filter_customers
+from managers.image_handler import ImageHandler
+from managers.text_utils import fold_text
+from ui._utils import render_page_header, render_branch_selector, get_offset_page, render_offset_pager
+
+# Gallery: number of cards rendered per rerun and thumbnail width requested from Drive
+GALLERY_PAGE_SIZE = 24
+GALLERY_COLUMNS = 3
+THUMBNAIL_WIDTH = 240
 
 # --- State Management ---
 def initialize_pos_state(branch_id):
@@ -12,69 +21,131 @@ def initialize_pos_state(branch_id):
         st.session_state.pos_search = ""
         st.session_state.pos_category = "ALL"
         st.session_state.pos_manual_discount = {"type": "PERCENT", "value": 0}
+        st.session_state.pos_scan_feedback = None
+        st.session_state.pos_stock_shortages = {}
         st.session_state.current_pos_branch_key = branch_key
         st.rerun() # Rerun to ensure the UI updates with the new branch state
 
 # --- UI Rendering Functions ---
 
-def render_product_gallery(pos_mgr, product_mgr, inventory_mgr, branch_id):
-    """Displays the product search, filter, and a visual gallery of products."""
+def render_product_gallery(pos_mgr, catalog_mirror, all_categories, branch_id, replica_products=None, pending_sales=None):
+    """
+    Displays the product search, filter, and a visual gallery of products.
+    replica_products: offline snapshot of the branch catalog, used instead of the mirror when Firestore is unreachable.
+    pending_sales: {sku: quantity} of orders still waiting in the outbox, taken off the displayed stock.
+    """
+    pending_sales = pending_sales or {}
     
     with st.container(border=False):
         # 1. Filters
         search_query = st.text_input("🔍 Tìm theo tên hoặc SKU", st.session_state.get("pos_search", ""), key="pos_search_input")
         st.session_state.pos_search = search_query
 
-        all_categories = product_mgr.get_categories()
         cat_options = {cat['id']: cat['name'] for cat in all_categories}
         cat_options["ALL"] = "Tất cả danh mục"
         selected_cat = st.selectbox("Lọc theo danh mục", options=list(cat_options.keys()), format_func=lambda x: cat_options[x], key='pos_category')
         st.divider()
 
-        # 2. Product Listing
-        branch_products = product_mgr.get_listed_products_for_branch(branch_id)
-        branch_inventory = inventory_mgr.get_inventory_by_branch(branch_id)
-
-        filtered_products = [p for p in branch_products if (search_query.lower() in p['name'].lower() or search_query.lower() in p.get('sku', '').lower())]
-        if selected_cat != "ALL":
-            filtered_products = [p for p in filtered_products if p.get('category_id') == selected_cat]
+        # 2. Product Listing: accent-insensitive, ranked search over the branch catalog.
+        # The in-stock result list is cached by the mirror, so each rerun only slices one page of it.
+        category_filter = None if selected_cat == "ALL" else selected_cat
+        if replica_products is not None:
+            # Offline snapshot: plain accent-insensitive substring filter, no index
+            folded_query = fold_text(search_query)
+            filtered_products = [
+                p for p in replica_products
+                if _available_stock(p, pending_sales) > 0
+                and (not category_filter or p.get('category_id') == category_filter)
+                and (not folded_query or folded_query in fold_text(f"{p.get('name', '')} {p.get('sku', '')}"))
+            ]
+        else:
+            filtered_products = catalog_mirror.search_branch_catalog(
+                branch_id, search_query, category_id=category_filter, in_stock_only=True
+            )
+            if pending_sales:
+                # The mirror's stock does not include the orders still waiting in the outbox
+                filtered_products = [p for p in filtered_products if _available_stock(p, pending_sales) > 0]
 
         if not filtered_products:
             st.info("Không tìm thấy sản phẩm phù hợp.")
+            return
+
+        pager_key = f"pos_gallery_{branch_id}"
+        start, end = get_offset_page(pager_key, len(filtered_products), GALLERY_PAGE_SIZE,
+                                     filters=(search_query.strip(), category_filter))
+        page_products = filtered_products[start:end]
+        # Show the price the cart will charge: branch_prices plus any schedule already due
+        # (the apply job may not have run yet). Without a loaded timeline, keep the catalog price.
+        try:
+            current_prices = pos_mgr.price_mgr.get_current_prices(branch_id, [p['sku'] for p in page_products])
+        except Exception:
+            current_prices = {}
+        cols = st.columns(GALLERY_COLUMNS)
+        for i, p in enumerate(page_products):
+            if current_prices.get(p['sku']):
+                p = {**p, 'selling_price': current_prices[p['sku']]}
+            if pending_sales.get(p['sku']):
+                p = {**p, 'stock_quantity': _available_stock(p, pending_sales)}
+            with cols[i % GALLERY_COLUMNS]:
+                render_product_card(pos_mgr, p, branch_id)
+        render_offset_pager(pager_key, len(filtered_products), GALLERY_PAGE_SIZE)
+
+def render_product_card(pos_mgr, p, branch_id):
+    """One gallery card; keys depend only on the SKU so they stay stable across pages and reruns."""
+    sku = p['sku']
+    stock_quantity = p.get('stock_quantity', 0)
+    with st.container(border=True, height=330):
+        # Lazy-loaded Drive thumbnail: the browser only fetches images of cards it actually shows
+        thumbnail_url = ImageHandler.get_thumbnail_url(p.get('image_id'), width=THUMBNAIL_WIDTH)
+        if thumbnail_url:
+            st.markdown(f"<img src='{thumbnail_url}' loading='lazy' decoding='async' "
+                        f"style='width:100%;height:140px;object-fit:contain' alt=''>", unsafe_allow_html=True)
         else:
-            # Display products in a grid
-            cols = st.columns(3)
-            for i, p in enumerate(filtered_products):
-                col = cols[i % 3]
-                sku = p.get('sku')
-                if not sku: continue
-
-                stock_quantity = branch_inventory.get(sku, {}).get('quantity', 0)
-                
-                if stock_quantity > 0:
-                    with col.container(border=True, height=360):
-                        # --- REFACTORED IMAGE LOGIC ---
-                        image_url = product_mgr.image_handler.get_public_view_url(p.get('image_id'))
-                        st.image(image_url, use_column_width=True)
-                        
-                        st.markdown(f"**{p['name']}**")
-
-                        selling_price = p.get('selling_price', 0)
-                        base_price = p.get('base_price') 
-
-                        if base_price and base_price > selling_price:
-                            st.markdown(f"<span style='color: #D22B2B; font-weight: bold;'>{selling_price:,.0f}đ</span> "
-                                        f"<span style='text-decoration: line-through; color: grey; font-size: 0.9em;'>{base_price:,.0f}đ</span>", 
-                                        unsafe_allow_html=True)
-                        else:
-                            st.markdown(f"<span style='color: #D22B2B; font-weight: bold;'>{selling_price:,.0f}đ</span>", 
-                                        unsafe_allow_html=True)
+            st.markdown("<div style='height:140px;display:flex;align-items:center;justify-content:center;"
+                        "background:#f3f3f3;color:#999'>🖼️</div>", unsafe_allow_html=True)
 
-                        st.caption(f"Tồn kho: {stock_quantity}")
+        st.markdown(f"**{p['name']}**")
 
-                        if st.button("➕ Thêm", key=f"add_{sku}", use_container_width=True, type="primary"):
-                            pos_mgr.add_item_to_cart(branch_id, p, stock_quantity)
-                            st.rerun()
+        selling_price = p.get('selling_price', 0)
+        base_price = p.get('base_price')
+
+        if base_price and base_price > selling_price:
+            st.markdown(f"<span style='color: #D22B2B; font-weight: bold;'>{selling_price:,.0f}đ</span> "
+                        f"<span style='text-decoration: line-through; color: grey; font-size: 0.9em;'>{base_price:,.0f}đ</span>",
+                        unsafe_allow_html=True)
+        else:
+            st.markdown(f"<span style='color: #D22B2B; font-weight: bold;'>{selling_price:,.0f}đ</span>",
+                        unsafe_allow_html=True)
+
+        st.caption(f"Tồn kho: {stock_quantity}")
+
+        # on_click runs before the rerun, so no extra st.rerun() is needed
+        st.button("➕ Thêm", key=f"add_{sku}", use_container_width=True, type="primary",
+                  on_click=pos_mgr.add_item_to_cart, args=(branch_id, p, stock_quantity))
+
+def _handle_scan(pos_mgr, catalog_mirror, branch_id):
+    """on_change callback of the scan input: runs before the rerun, so the cart below is already updated."""
+    scan_text = st.session_state.get('pos_scan_input', '')
+    if scan_text.strip():
+        st.session_state.pos_scan_feedback = pos_mgr.add_scanned_item(branch_id, scan_text, catalog_mirror)
+    # Clear the input so the scanner can send the next code right away
+    st.session_state.pos_scan_input = ""
+
+def render_scan_input(pos_mgr, catalog_mirror, branch_id):
+    """Scan mode: a single input resolved through the catalog lookup table, no gallery rendering."""
+    st.text_input(
+        "📷 Quét barcode hoặc nhập SKU (vd: `3*SKU` để thêm 3 sản phẩm)",
+        key="pos_scan_input",
+        on_change=_handle_scan,
+        args=(pos_mgr, catalog_mirror, branch_id),
+    )
+    feedback = st.session_state.get('pos_scan_feedback')
+    if feedback:
+        success, message = feedback
+        if success:
+            st.success(message)
+        else:
+            st.warning(message)
 
 def render_cart_view(cart_state, pos_mgr, product_mgr):
     """Displays the items currently in the cart."""
@@ -82,13 +153,18 @@ def render_cart_view(cart_state, pos_mgr, product_mgr):
         st.info("Giỏ hàng đang trống. Hãy chọn sản phẩm từ Thư viện.")
         return
 
+    shortages = st.session_state.get('pos_stock_shortages', {})
     for sku, item in cart_state['items'].items():
         with st.container(border=True):
+            if sku in shortages:
+                needed, available = shortages[sku]
+                st.warning(f"Chỉ còn {available} trong kho (giỏ đang có {needed}). Vui lòng giảm số lượng.")
             col_img, col_details = st.columns([1, 4])
             with col_img:
                 # --- REFACTORED IMAGE LOGIC ---
-                image_url = product_mgr.image_handler.get_public_view_url(item.get('image_id'))
-                st.image(image_url, width=60)
+                thumbnail_url = ImageHandler.get_thumbnail_url(item.get('image_id'), width=120)
+                if thumbnail_url:
+                    st.markdown(f"<img src='{thumbnail_url}' loading='lazy' style='width:60px' alt=''>", unsafe_allow_html=True)
 
             with col_details:
                 st.markdown(f"**{item['name']}** (`{sku}`)")
@@ -113,13 +189,58 @@ def render_cart_view(cart_state, pos_mgr, product_mgr):
                             st.toast("Vượt quá tồn kho!", icon="⚠️")
 
 # ... (The rest of the file is unchanged) ...
-def render_checkout_panel(cart_state, customer_mgr, pos_mgr, branch_id):
+def render_customer_picker(customer_mgr, branch_id=None, offline_store=None, offline=False):
+    """
+    Type-ahead customer picker: only the customers matching the typed name/phone prefix are read.
+    Customers found while online are kept in the offline store, and searched there when Firestore is unreachable.
+    """
+    query = st.text_input("👤 **Khách hàng**", key="pos_customer_query", placeholder="Gõ tên hoặc số điện thoại...")
+    query = query.strip()
+
+    # Results are kept per query so reruns that don't change the text don't query Firestore again
+    cached = st.session_state.get('pos_customer_results')
+    if cached and cached[0] == (query, offline):
+        matches, from_replica = cached[1:]
+    else:
+        matches, from_replica = [], offline
+        if query and not offline:
+            try:
+                matches = customer_mgr.search_customers(query)
+            except Exception as e:
+                if not offline_store:
+                    st.caption(f"Không thể tìm khách hàng: {e}")
+                from_replica = True
+            else:
+                if offline_store and matches:
+                    offline_store.merge_replica(branch_id, 'customers', matches)
+        if query and from_replica and offline_store:
+            saved_customers, _ = offline_store.load_replica(branch_id, 'customers')
+            matches = filter_customers(saved_customers or [], query)
+        st.session_state.pos_customer_results = ((query, offline), matches, from_replica)
+    if query and from_replica and offline_store:
+        st.caption("Đang tìm trong các khách hàng đã lưu trên máy.")
+
+    customer_options = {c['id']: f"{c['name']} ({c.get('phone', '')})" for c in matches}
+    # Keep the current selection visible even when it is not in the latest results
+    selected = st.session_state.get('pos_customer_info')
+    if selected and st.session_state.get('pos_customer') == selected['id']:
+        customer_options.setdefault(selected['id'], f"{selected['name']} ({selected.get('phone', '')})")
+    customer_options["-"] = "Khách vãng lai"
+    if st.session_state.get('pos_customer') not in customer_options:
+        st.session_state.pos_customer = "-"
+
+    customer_id = st.selectbox("Chọn khách hàng", options=list(customer_options.keys()), format_func=lambda x: customer_options[x],
+                               key='pos_customer', label_visibility="collapsed")
+    match = next((c for c in matches if c['id'] == customer_id), None)
+    if match:
+        st.session_state.pos_customer_info = match
+    if query and not matches:
+        st.caption("Không tìm thấy khách hàng phù hợp.")
+
+def render_checkout_panel(cart_state, customer_mgr, pos_mgr, branch_id, offline_store=None, offline=False):
     """Displays the customer selection, summary, and checkout button."""
     with st.container(border=True):
-        customers = customer_mgr.list_customers()
-        customer_options = {c['id']: f"{c['name']} ({c['phone']})" for c in customers}
-        customer_options["-"] = "Khách vãng lai"
-        st.selectbox("👤 **Khách hàng**", options=list(customer_options.keys()), format_func=lambda x: customer_options[x], key='pos_customer')
+        render_customer_picker(customer_mgr, branch_id, offline_store, offline)
         st.divider()
 
         st.markdown(f"Tổng tiền hàng: <span style='float: right;'>{cart_state['subtotal']:,.0f}đ</span>", unsafe_allow_html=True)
@@ -172,6 +293,30 @@ def confirm_checkout_dialog(cart_state, pos_mgr, branch_id):
         st.session_state.show_confirm_dialog = False
         st.rerun()
 
+def _available_stock(p, pending_sales):
+    return max(0, p.get('stock_quantity', 0) - pending_sales.get(p['sku'], 0))
+
+def _cap_cart_to_pending_sales(branch_products, pending_sales):
+    """
+    The catalog's stock (mirror or replica) does not include the orders still waiting in the outbox:
+    take their quantities off the caps of the lines already in the cart, so repeated offline sales can't oversell.
+    """
+    available = {p['sku']: _available_stock(p, pending_sales) for p in branch_products if p['sku'] in pending_sales}
+    shortages = st.session_state.setdefault('pos_stock_shortages', {})
+    for sku, line in st.session_state.get('pos_cart', {}).items():
+        if sku in available:
+            line['stock'] = min(line['stock'], available[sku])
+            if line['quantity'] > line['stock']:
+                shortages[sku] = (line['quantity'], line['stock'])
+
+def _load_replica_price_program(offline_store, branch_id):
+    """The price program saved with the replica, if it has not ended yet (None otherwise)."""
+    rows, _ = offline_store.load_replica(branch_id, 'price_program')
+    program = rows[0] if rows else None
+    if program and program.get('end_datetime', '') < datetime.now(timezone.utc).isoformat():
+        return None
+    return program
+
 # --- Main Page Rendering ---
 def render_pos_page(pos_mgr):
     render_page_header("Bán hàng tại quầy", "🛒")
@@ -179,8 +324,9 @@ def render_pos_page(pos_mgr):
     auth_mgr = st.session_state.auth_mgr
     branch_mgr = st.session_state.branch_mgr
     product_mgr = st.session_state.product_mgr
-    inventory_mgr = st.session_state.inventory_mgr
+    catalog_mirror = st.session_state.catalog_mirror
     customer_mgr = st.session_state.customer_mgr
+    offline_store = st.session_state.get('offline_store')
     
     user_info = auth_mgr.get_current_user_info()
     allowed_branches_map = auth_mgr.get_allowed_branches_map()
@@ -194,27 +340,70 @@ def render_pos_page(pos_mgr):
 
     initialize_pos_state(selected_branch_id)
 
-    # This part needs to be defined before being used in the tab title
-    branch_products = product_mgr.get_listed_products_for_branch(selected_branch_id)
+    scan_mode = st.session_state.get('pos_scan_mode', False)
 
-    cart_state = pos_mgr.calculate_cart_state(
-        cart_items=st.session_state.get('pos_cart', {}),
+    # Independent reads run in parallel; the catalog comes from the in-memory mirror
+    # (no Firestore round-trip per rerun once its listeners are up)
+    page_reads = {
+        'branch_products': lambda: catalog_mirror.get_branch_catalog(selected_branch_id),
+    }
+    if not scan_mode:
+        page_reads['categories'] = product_mgr.get_categories
+    replica_products = None
+    try:
+        page_data = fan_out(page_reads)
+        # The price program comes from the manager's cache
+        active_promo = pos_mgr.promotion_mgr.get_active_price_program()
+        if offline_store:
+            offline_store.save_replica(selected_branch_id, 'catalog', page_data['branch_products'])
+            offline_store.save_replica(selected_branch_id, 'price_program', [active_promo])
+    except Exception as e:
+        # Offline mode: keep selling from the last local snapshot, orders go to the outbox
+        replica_products, saved_at = offline_store.load_replica(selected_branch_id, 'catalog') if offline_store else (None, None)
+        if replica_products is None:
+            raise
+        st.warning(f"Mất kết nối máy chủ ({e}). Đang bán bằng dữ liệu lưu lúc {saved_at.strftime('%H:%M %d/%m/%Y')}; "
+                   "đơn hàng sẽ được đồng bộ khi có mạng.")
+        page_data = {'branch_products': replica_products, 'categories': []}
+        active_promo = _load_replica_price_program(offline_store, selected_branch_id)
+        scan_mode = False
+    branch_products = page_data['branch_products']
+    pending_sales = offline_store.get_pending_quantities(selected_branch_id) if offline_store else {}
+    if pending_sales:
+        _cap_cart_to_pending_sales(branch_products, pending_sales)
+
+    if offline_store:
+        pending_orders = offline_store.count_pending(selected_branch_id)
+        if pending_orders:
+            st.caption(f"⏳ {pending_orders} đơn chờ đồng bộ")
+
+    # Lines are repriced as they change
+    cart_state = pos_mgr.get_cart_state(
         customer_id=st.session_state.get('pos_customer', "-"),
-        manual_discount_input=st.session_state.get('pos_manual_discount', {"type": "PERCENT", "value": 0})
+        manual_discount_input=st.session_state.get('pos_manual_discount', {"type": "PERCENT", "value": 0}),
+        active_promo=active_promo,
     )
 
     main_col, order_col = st.columns([0.6, 0.4])
 
     with main_col:
-        tab_gallery, tab_cart = st.tabs([f"Thư viện Sản phẩm ({len(branch_products)})", f"Đơn hàng ({cart_state['total_items']})"])
-        with tab_gallery:
-            # We pass the already fetched branch_products to avoid a second call
-            render_product_gallery(pos_mgr, product_mgr, inventory_mgr, selected_branch_id)
-        with tab_cart:
+        st.toggle("Chế độ quét mã", key="pos_scan_mode", help="Quét barcode/SKU để thêm nhanh vào giỏ, ẩn thư viện sản phẩm.")
+        if scan_mode:
+            # Skip the gallery entirely: only the scan input and the cart are rendered
+            render_scan_input(pos_mgr, catalog_mirror, selected_branch_id)
+            st.markdown(f"**Đơn hàng ({cart_state['total_items']})**")
             render_cart_view(cart_state, pos_mgr, product_mgr)
+        else:
+            tab_gallery, tab_cart = st.tabs([f"Thư viện Sản phẩm ({len(branch_products)})", f"Đơn hàng ({cart_state['total_items']})"])
+            with tab_gallery:
+                render_product_gallery(pos_mgr, catalog_mirror, page_data['categories'], selected_branch_id,
+                                       replica_products=replica_products, pending_sales=pending_sales)
+            with tab_cart:
+                render_cart_view(cart_state, pos_mgr, product_mgr)
 
     with order_col:
-        render_checkout_panel(cart_state, customer_mgr, pos_mgr, selected_branch_id)
+        render_checkout_panel(cart_state, customer_mgr, pos_mgr, selected_branch_id,
+                              offline_store=offline_store, offline=replica_products is not None)
 
     if st.session_state.get('show_confirm_dialog', False):
         confirm_checkout_dialog(cart_state, pos_mgr, selected_branch_id)
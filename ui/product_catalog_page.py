@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 from managers.product_manager import ProductManager
 from managers.auth_manager import AuthManager
+from ui._utils import get_page_cursor, render_pager
 
 def render_product_catalog_page(prod_mgr: ProductManager, auth_mgr: AuthManager):
     st.header("🗂️ Danh mục Sản phẩm")
@@ -89,7 +90,7 @@ def render_product_catalog_page(prod_mgr: ProductManager, auth_mgr: AuthManager)
         
         st.divider()
         st.subheader("Toàn bộ sản phẩm trong danh mục")
-        products = prod_mgr.get_all_products(show_inactive=True)
+        products = prod_mgr.get_products_page(show_inactive=True, page_size=30, cursor=get_page_cursor("catalog_products"))
 
         if not products:
             st.info("Chưa có sản phẩm nào.")
@@ -148,6 +149,8 @@ def render_product_catalog_page(prod_mgr: ProductManager, auth_mgr: AuthManager)
                     st.rerun()
             st.markdown("<hr style='margin:0.25rem 0'>", unsafe_allow_html=True)
 
+        render_pager("catalog_products", products)
+
     if is_admin and len(tabs) > 1:
         with tabs[1]:
             st.subheader("Thiết lập các thuộc tính sản phẩm")
@@ -5,12 +5,13 @@ from datetime import date, datetime
 from managers.promotion_manager import PromotionManager
 from managers.product_manager import ProductManager
 from managers.branch_manager import BranchManager
+from ui._utils import get_page_cursor, render_pager
 
 def render_promotions_page(promotion_mgr: PromotionManager, product_mgr: ProductManager, branch_mgr: BranchManager):
     st.title("🎁 Quản lý Khuyến mãi")
 
     # Lấy dữ liệu cho các select box
-    all_products = product_mgr.list_products()
+    all_products = product_mgr.get_all_products(fields=['sku', 'name'])
     all_categories = product_mgr.get_categories()
     product_options = {p['sku']: p['name'] for p in all_products if 'sku' in p}
     category_options = {c['id']: c['name'] for c in all_categories}
@@ -94,7 +95,7 @@ def render_promotions_page(promotion_mgr: PromotionManager, product_mgr: Product
             return f"Danh mục: {', '.join(names)}"
         return "Không xác định"
 
-    promotions = promotion_mgr.get_all_promotions()
+    promotions = promotion_mgr.get_promotions_page(page_size=20, cursor=get_page_cursor("promotions"))
     if not promotions:
         st.info("Chưa có chương trình khuyến mãi nào được tạo.")
     else:
@@ -126,3 +127,5 @@ def render_promotions_page(promotion_mgr: PromotionManager, product_mgr: Product
                         if st.button("🟢 Kích hoạt", key=f"act_{promo['id']}", use_container_width=True, type="primary"):
                             promotion_mgr.update_promotion_status(promo['id'], True)
                             st.rerun()
+
+        render_pager("promotions", promotions)
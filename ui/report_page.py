@@ -4,7 +4,7 @@ import pandas as pd
 from datetime import datetime, timedelta
 
 # Import managers
-from managers.report_manager import ReportManager
+from managers.report_manager import ReportManager, REPORT_SOURCE_ANALYTICS, REPORT_SOURCE_FIRESTORE
 from managers.branch_manager import BranchManager
 from managers.auth_manager import AuthManager
 
@@ -55,6 +55,14 @@ def render_report_page(report_mgr: ReportManager, branch_mgr: BranchManager, aut
         today = datetime.now()
         start_date = date_col1.date_input("Từ ngày", today - timedelta(days=30))
         end_date = date_col2.date_input("Đến ngày", today)
+
+        source = REPORT_SOURCE_FIRESTORE
+        if report_mgr.analytics_store is not None:
+            source = render_analytics_source_picker(report_mgr.analytics_store)
+        profit_freq = 'D'
+        if report_type == "Phân tích Lợi nhuận":
+            freq_labels = {'D': "Ngày", 'W': "Tuần", 'MS': "Tháng"}
+            profit_freq = st.radio("Gom theo", list(freq_labels), format_func=freq_labels.get, horizontal=True, key="profit_freq")
         
         # Main action button
         if st.button("📈 Xem báo cáo", type="primary", use_container_width=True):
@@ -76,7 +84,7 @@ def render_report_page(report_mgr: ReportManager, branch_mgr: BranchManager, aut
 
         with st.spinner("Đang xử lý và tải dữ liệu báo cáo..."):
             if report_type == "Báo cáo Doanh thu":
-                success, data, message = report_mgr.get_revenue_report(start_datetime, end_datetime, selected_branch_ids)
+                success, data, message = report_mgr.get_revenue_report(start_datetime, end_datetime, selected_branch_ids, source=source)
                 if success:
                     st.subheader("Tổng quan Doanh thu")
                     # Display KPIs
@@ -103,10 +111,59 @@ def render_report_page(report_mgr: ReportManager, branch_mgr: BranchManager, aut
                     st.error(f"Lỗi khi lấy báo cáo: {message}")
 
             elif report_type == "Phân tích Lợi nhuận":
-                st.info("Tính năng 'Phân tích Lợi nhuận' đang trong giai đoạn phát triển.")
+                if report_mgr.analytics_store is None:
+                    st.info("Phân tích Lợi nhuận cần kho phân tích cục bộ (cấu hình 'analytics_dir').")
+                else:
+                    render_profit_analysis(report_mgr, start_datetime, end_datetime, selected_branch_ids, profit_freq, allowed_branches_map)
 
             elif report_type == "Báo cáo Tồn kho":
                 st.info("Tính năng 'Báo cáo Tồn kho' đang trong giai đoạn phát triển.")
         
         # Reset the flag so the report doesn't re-run on every interaction
         st.session_state.run_report = False
+
+
+def render_analytics_source_picker(analytics_store) -> str:
+    """Chọn nguồn dữ liệu của báo cáo khi có kho phân tích cục bộ; trả về REPORT_SOURCE_*."""
+    src_col, sync_col = st.columns([3, 1])
+    source = src_col.radio(
+        "Nguồn dữ liệu",
+        [REPORT_SOURCE_ANALYTICS, REPORT_SOURCE_FIRESTORE],
+        format_func=lambda s: "Kho phân tích cục bộ (nhanh)" if s == REPORT_SOURCE_ANALYTICS else "Firestore (trực tiếp)",
+        horizontal=True,
+        key="report_source",
+    )
+    if sync_col.button("🔄 Đồng bộ ngay", use_container_width=True):
+        with st.spinner("Đang đồng bộ đơn hàng..."):
+            try:
+                new_orders, changed_days = analytics_store.sync()
+                st.toast(f"Đã đồng bộ {new_orders} đơn mới, {changed_days} ngày được cập nhật.")
+            except Exception as e:
+                st.error(f"Lỗi khi đồng bộ: {e}")
+    synced_at = analytics_store.get_status().get('synced_at')
+    if synced_at:
+        st.caption(f"Kho phân tích cập nhật lúc {datetime.fromisoformat(synced_at).strftime('%d/%m/%Y %H:%M')}.")
+    else:
+        st.caption("Kho phân tích chưa được đồng bộ.")
+    return source
+
+
+def render_profit_analysis(report_mgr: ReportManager, start_datetime: datetime, end_datetime: datetime,
+                           branch_ids: list, freq: str, branch_names: dict):
+    success, data, message = report_mgr.get_profit_analysis(start_datetime, end_datetime, branch_ids, freq=freq)
+    if not success:
+        st.error(f"Lỗi khi phân tích lợi nhuận: {message}")
+        return
+
+    st.subheader("Lợi nhuận gộp theo thời gian")
+    if data['profit_by_period'].empty:
+        st.info("Không có dữ liệu trong khoảng thời gian này.")
+        return
+    st.line_chart(data['profit_by_period'])
+
+    st.write("**Theo chi nhánh**")
+    by_branch = data['profit_by_branch'].rename(index=branch_names)
+    st.dataframe(by_branch.style.format('{:,.0f}'), use_container_width=True)
+
+    st.write(f"**Top {len(data['top_products_by_profit'])} sản phẩm theo lợi nhuận gộp**")
+    st.dataframe(data['top_products_by_profit'], use_container_width=True)
@@ -1,5 +1,7 @@
 
 import streamlit as st
+from datetime import datetime, timedelta
+import pandas as pd
 from managers.settings_manager import SettingsManager
 from managers.auth_manager import AuthManager
 
@@ -14,7 +16,7 @@ def render_settings_page(settings_mgr: SettingsManager, auth_mgr: AuthManager):
     current_settings = settings_mgr.get_settings()
 
     # Cấu trúc tab để dễ dàng mở rộng trong tương lai
-    tab1, tab2, tab3 = st.tabs(["Cài đặt Chung", "Thông tin Kinh doanh", "Bảo mật"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Cài đặt Chung", "Thông tin Kinh doanh", "Bảo mật", "Hiệu năng Firestore"])
 
     # ===================================
     # TAB 1: CÀI ĐẶT CHUNG (PREVIOUSLY BRANCHES)
@@ -120,3 +122,97 @@ def render_settings_page(settings_mgr: SettingsManager, auth_mgr: AuthManager):
                 st.success(f"Đã lưu cài đặt. Thời gian ghi nhớ đăng nhập là {new_persistence_days} ngày.")
                 st.rerun()
 
+    # ===================================
+    # TAB 4: HIỆU NĂNG FIRESTORE
+    # ===================================
+    with tab4:
+        render_firestore_metrics_panel(st.session_state.get('firestore_metrics'))
+        st.divider()
+        render_data_maintenance_panel()
+
+
+def render_data_maintenance_panel():
+    st.subheader("Bảo trì dữ liệu")
+    st.caption("Bổ sung các field chỉ mục cho dữ liệu tạo trước khi có tính năng tương ứng. Có thể chạy lại nhiều lần.")
+
+    customer_mgr = st.session_state.get('customer_mgr')
+    if customer_mgr and st.button("🔎 Lập chỉ mục tìm kiếm khách hàng", use_container_width=True):
+        with st.spinner("Đang cập nhật khách hàng..."):
+            try:
+                updated = customer_mgr.backfill_search_fields()
+                st.success(f"Đã cập nhật {updated} khách hàng.")
+            except Exception as e:
+                st.error(f"Lỗi khi lập chỉ mục khách hàng: {e}")
+
+    report_mgr = st.session_state.get('report_mgr')
+    branch_mgr = st.session_state.get('branch_mgr')
+    if report_mgr and branch_mgr and st.button("📊 Tổng hợp doanh thu theo ngày", use_container_width=True,
+                                               help="Tính lại daily_sales từ đơn hàng để báo cáo không phải đọc từng đơn."):
+        with st.spinner("Đang tổng hợp doanh thu..."):
+            try:
+                branch_ids = [b['id'] for b in branch_mgr.list_branches(active_only=False)]
+                written = report_mgr.rebuild_daily_sales(branch_ids)
+                st.success(f"Đã ghi {written} bản tổng hợp chi nhánh-ngày.")
+            except Exception as e:
+                st.error(f"Lỗi khi tổng hợp doanh thu: {e}")
+
+    if report_mgr:
+        with st.expander("♻️ Tính lại báo cáo đã lưu"):
+            st.caption("Báo cáo của các ngày đã qua được lưu lại. Dùng khi số liệu của các ngày này bị sửa trực tiếp trên Firestore.")
+            cols = st.columns(2)
+            today = datetime.now().date()
+            start_day = cols[0].date_input("Từ ngày", today - timedelta(days=30), key="invalidate_report_start")
+            end_day = cols[1].date_input("Đến ngày", today, key="invalidate_report_end")
+            if st.button("Tính lại các ngày này", use_container_width=True, disabled=start_day > end_day):
+                try:
+                    report_mgr.invalidate_report_days(start_day, end_day)
+                    st.success("Báo cáo của các ngày đã chọn sẽ được tính lại ở lần xem tiếp theo.")
+                except Exception as e:
+                    st.error(f"Lỗi: {e}")
+
+
+def render_firestore_metrics_panel(metrics):
+    st.subheader("Thống kê truy cập Firestore")
+    if metrics is None:
+        st.info("Chưa bật đo lường Firestore.")
+        return
+
+    st.caption(f"Dữ liệu được thu thập từ {metrics.started_at.strftime('%d/%m/%Y %H:%M:%S')} (dùng chung cho toàn bộ server).")
+    rows = metrics.snapshot()
+    if not rows:
+        st.info("Chưa có thao tác nào được ghi nhận.")
+    else:
+        df = pd.DataFrame(rows)
+        view = st.radio("Hiển thị", ["Tất cả", "Theo trang", "Theo hàm manager"], horizontal=True, key="fs_metrics_view")
+        if view == "Theo trang":
+            df = df[df['kind'] == 'page']
+        elif view == "Theo hàm manager":
+            df = df[df['kind'] == 'method']
+
+        sort_options = {
+            "reads_per_call": "Số đọc / lần gọi",
+            "reads": "Tổng số đọc",
+            "p95_ms": "Độ trễ p95",
+            "writes": "Tổng số ghi",
+        }
+        sort_by = st.selectbox("Sắp xếp theo", options=list(sort_options.keys()), format_func=lambda k: sort_options[k], key="fs_metrics_sort")
+        df = df.sort_values(sort_by, ascending=False, na_position='last')
+
+        st.dataframe(df.rename(columns={
+            'scope': 'Phạm vi', 'calls': 'Số lần gọi', 'reads': 'Đọc', 'writes': 'Ghi',
+            'streamed_docs': 'Document stream', 'transactions': 'Transaction',
+            'reads_per_call': 'Đọc/lần', 'writes_per_call': 'Ghi/lần',
+            'avg_ms': 'TB (ms)', 'p50_ms': 'p50 (ms)', 'p95_ms': 'p95 (ms)', 'p99_ms': 'p99 (ms)',
+        }).drop(columns=['kind']), use_container_width=True, hide_index=True)
+
+    c1, c2 = st.columns(2)
+    c1.download_button(
+        "⬇️ Xuất JSON",
+        data=metrics.to_json(),
+        file_name="firestore_metrics.json",
+        mime="application/json",
+        use_container_width=True
+    )
+    if c2.button("🔄 Đặt lại số liệu", use_container_width=True):
+        metrics.reset()
+        st.rerun()
@@ -15,7 +15,7 @@ def render_create_transfer_form(from_branch_id, all_branches, inventory_manager,
         return # Dừng hàm tại đây để không tạo form trống
 
     # Tải dữ liệu cần thiết
-    products = product_manager.get_all_products()
+    products = product_manager.get_all_products(fields=['sku', 'name', 'cogs'])
     inventory = inventory_manager.get_inventory_by_branch(from_branch_id)
 
     # Kiểm tra dữ liệu an toàn
@@ -2,6 +2,8 @@
 import streamlit as st
 from datetime import datetime
 
+from ui._utils import get_page_cursor, render_pager
+
 def render_incoming_transfers(branch_id, all_branches_map, inventory_manager, user_id):
     st.header("Phiếu Chuyển Đến")
     
@@ -13,7 +15,11 @@ def render_incoming_transfers(branch_id, all_branches_map, inventory_manager, us
     )
 
     try:
-        transfers = inventory_manager.get_transfers(branch_id, direction='incoming', status=status_filter)
+        pager_key = f"transfers_in_{branch_id}"
+        transfers = inventory_manager.get_transfers_page(
+            branch_id, direction='incoming', status=status_filter, page_size=20,
+            cursor=get_page_cursor(pager_key, filters=status_filter),
+        )
     except Exception as e:
         st.error(f"Lỗi khi tải danh sách phiếu chuyển đến: {e}")
         return
@@ -22,7 +28,7 @@ def render_incoming_transfers(branch_id, all_branches_map, inventory_manager, us
         st.info("Không có phiếu luân chuyển nào đang được gửi đến chi nhánh này.")
         return
 
-    for t in sorted(transfers, key=lambda x: x.get('shipped_at', x.get('created_at', '')), reverse=True):
+    for t in transfers:
         from_branch_name = all_branches_map.get(t.get('from_branch_id'), t.get('from_branch_id'))
         with st.expander(f"Phiếu `{t.get('id')}` từ CN `{from_branch_name}` - **{t.get('status')}**"):
             shipped_at_str = datetime.fromisoformat(t['shipped_at']).strftime('%d-%m-%Y %H:%M') if t.get('shipped_at') else 'Chưa gửi'
@@ -40,3 +46,5 @@ def render_incoming_transfers(branch_id, all_branches_map, inventory_manager, us
                         st.rerun()
                     except Exception as e:
                         st.error(f"Lỗi khi xác nhận nhận hàng: {e}")
+
+    render_pager(pager_key, transfers)
@@ -2,6 +2,8 @@
 import streamlit as st
 from datetime import datetime
 
+from ui._utils import get_page_cursor, render_pager
+
 def render_outgoing_transfers(branch_id, all_branches_map, inventory_manager, user_id):
     st.header("Phiếu Chuyển Đi")
     
@@ -13,7 +15,11 @@ def render_outgoing_transfers(branch_id, all_branches_map, inventory_manager, us
     )
 
     try:
-        transfers = inventory_manager.get_transfers(branch_id, direction='outgoing', status=status_filter)
+        pager_key = f"transfers_out_{branch_id}"
+        transfers = inventory_manager.get_transfers_page(
+            branch_id, direction='outgoing', status=status_filter, page_size=20,
+            cursor=get_page_cursor(pager_key, filters=status_filter),
+        )
     except Exception as e:
         st.error(f"Lỗi khi tải danh sách phiếu chuyển đi: {e}")
         return
@@ -22,7 +28,7 @@ def render_outgoing_transfers(branch_id, all_branches_map, inventory_manager, us
         st.info("Không có phiếu luân chuyển nào được gửi đi từ chi nhánh này.")
         return
 
-    for t in sorted(transfers, key=lambda x: x.get('created_at', ''), reverse=True):
+    for t in transfers:
         to_branch_name = all_branches_map.get(t.get('to_branch_id'), t.get('to_branch_id'))
         with st.expander(f"Phiếu `{t.get('id')}` gửi tới CN `{to_branch_name}` - **{t.get('status')}**"):
             created_at_str = datetime.fromisoformat(t['created_at']).strftime('%d-%m-%Y %H:%M') if 'created_at' in t else 'N/A'
@@ -48,3 +54,5 @@ def render_outgoing_transfers(branch_id, all_branches_map, inventory_manager, us
                         st.rerun()
                     except Exception as e:
                         st.error(f"Lỗi khi hủy phiếu: {e}")
+
+    render_pager(pager_key, transfers)
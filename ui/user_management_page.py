@@ -2,7 +2,7 @@
 import streamlit as st
 from managers.auth_manager import AuthManager
 from managers.branch_manager import BranchManager
-from ui._utils import render_page_header
+from ui._utils import render_page_header, get_page_cursor, render_pager
 
 # --- Constants and Configuration ---
 ROLES = ['staff', 'supervisor', 'manager', 'admin']
@@ -183,8 +183,10 @@ def render_create_user_form(auth_mgr: AuthManager, branch_mgr: BranchManager):
                     st.error(f"Lỗi khi tạo người dùng: {e}")
 
 
-def render_user_list(users, current_user, auth_mgr: AuthManager, branch_mgr: BranchManager):
+def render_user_list(users_page, current_user, auth_mgr: AuthManager, branch_mgr: BranchManager):
     search_query = st.text_input("Tìm kiếm (theo tên hoặc username)", key="user_search").lower()
+    # Tìm kiếm cần duyệt toàn bộ người dùng; khi không tìm kiếm thì chỉ hiển thị trang hiện tại
+    users = auth_mgr.list_users() if search_query else users_page.items
     
     current_user_role = _get_safe_role(current_user)
     current_user_uid = current_user.get('uid')
@@ -271,6 +273,9 @@ def render_user_list(users, current_user, auth_mgr: AuthManager, branch_mgr: Bra
                 else:
                     action_col.text("—")
 
+    if not search_query:
+        render_pager("users", users_page)
+
 
 def render_user_management_page(auth_mgr: AuthManager, branch_mgr: BranchManager):
     render_page_header("Quản lý Người dùng", "👥")
@@ -288,7 +293,7 @@ def render_user_management_page(auth_mgr: AuthManager, branch_mgr: BranchManager
         return
 
     try:
-        all_users = auth_mgr.list_users()
+        all_users = auth_mgr.list_users_page(page_size=50, cursor=get_page_cursor("users"))
     except Exception as e:
         st.error(f"Lỗi khi tải danh sách người dùng: {e}")
         return